@@ -4,6 +4,7 @@ from agenda.models import (
     Estabelecimento,
     Fidelidade,
     Funcionarios,
+    HorarioFuncionamento,
     Servicos,
 )
 
@@ -13,3 +14,4 @@ admin.site.register(Fidelidade)
 admin.site.register(Funcionarios)
 admin.site.register(Estabelecimento)
 admin.site.register(Servicos)
+admin.site.register(HorarioFuncionamento)
@@ -0,0 +1,183 @@
+"""
+Grades de horários de atendimento. As regras de HorarioFuncionamento são
+compiladas uma vez em um ModeloGrade: para cada dia da semana, o deslocamento
+de cada horário a partir da meia-noite UTC e os bits que ele ocupa (ver
+agenda/ocupacao.py). A grade de um dia é então só uma consulta ao modelo mais
+a data, sem laços de datetime.
+
+Os modelos ficam em memória, junto com a versão das regras com que foram
+compilados. A versão fica no cache compartilhado (ver CACHES) e é descartada
+quando as regras mudam; cada processo a relê no máximo uma vez por
+EXPEDIENTE_VERSAO_INTERVALO e recompila os modelos quando ela muda.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from agenda.libs.cache import CacheLRU
+from agenda.models import HorarioFuncionamento
+from agenda.ocupacao import get_mascara_intervalo
+
+DURACAO_HORARIO = timedelta(minutes=30)
+
+# Expediente usado quando não há regras cadastradas: 09:00-18:00 com almoço
+# das 12:00 às 13:00 de segunda a sexta, 09:00-13:00 aos sábados.
+EXPEDIENTE_PADRAO = {
+    **{
+        dia_semana: [(time(9), time(12)), (time(13), time(18))]
+        for dia_semana in range(5)
+    },
+    5: [(time(9), time(13))],
+}
+
+
+class ModeloGrade:
+    """
+    Grade compilada de cada dia da semana: os horários, cada um com os bits
+    que ocupa, e o expediente (os bits de todos os períodos). Para serviços
+    de outra duração, os horários em que o serviço cabe no expediente são
+    compilados na primeira consulta e reaproveitados.
+    """
+
+    def __init__(self, periodos: dict):
+        # periodos: {dia_semana: [(inicio, fim, duracao_horario)]}
+        self.horarios = {dia_semana: () for dia_semana in range(7)}
+        self.expediente = {dia_semana: 0 for dia_semana in range(7)}
+        self._horarios_por_duracao = {}
+        for dia_semana, periodos_dia in periodos.items():
+            horarios = []
+            for inicio, fim, duracao in sorted(periodos_dia):
+                deslocamento = datetime.combine(date.min, inicio) - datetime.min
+                limite = datetime.combine(date.min, fim) - datetime.min
+                self.expediente[dia_semana] |= get_mascara_intervalo(
+                    deslocamento, limite - deslocamento
+                )
+                while deslocamento + duracao <= limite:
+                    mascara = get_mascara_intervalo(deslocamento, duracao)
+                    horarios.append((deslocamento, mascara))
+                    deslocamento += duracao
+            self.horarios[dia_semana] = tuple(horarios)
+
+    def get_horarios(self, dia_semana: int, duracao: timedelta = None) -> tuple:
+        """
+        Horários do dia da semana com os bits que ocupam. Com `duracao`, só
+        os horários em que um serviço dessa duração termina dentro do
+        expediente, com os bits da duração toda.
+        """
+        if duracao is None:
+            return self.horarios[dia_semana]
+
+        chave = (dia_semana, duracao)
+        if chave not in self._horarios_por_duracao:
+            fora_do_expediente = ~self.expediente[dia_semana]
+            horarios = []
+            for deslocamento, _ in self.horarios[dia_semana]:
+                mascara = get_mascara_intervalo(deslocamento, duracao)
+                if deslocamento + duracao <= timedelta(days=1) and not (
+                    mascara & fora_do_expediente
+                ):
+                    horarios.append((deslocamento, mascara))
+            self._horarios_por_duracao[chave] = tuple(horarios)
+        return self._horarios_por_duracao[chave]
+
+    def grade(self, dia: date, ocupados: int = 0, duracao: timedelta = None) -> list:
+        """
+        Horários do dia cujo intervalo (do horário ou, com `duracao`, do
+        serviço) não coincide com os bits de `ocupados`.
+        """
+        meia_noite = datetime.combine(dia, time.min, tzinfo=timezone.utc)
+        return [
+            meia_noite + deslocamento
+            for deslocamento, mascara in self.get_horarios(dia.weekday(), duracao)
+            if not ocupados & mascara
+        ]
+
+
+MODELO_PADRAO = ModeloGrade(
+    {
+        dia_semana: [(inicio, fim, DURACAO_HORARIO) for inicio, fim in periodos]
+        for dia_semana, periodos in EXPEDIENTE_PADRAO.items()
+    }
+)
+
+_cache_modelos = CacheLRU(
+    tamanho_maximo=1, ttl=settings.EXPEDIENTE_CACHE_TTL.total_seconds()
+)
+_versao_lida = CacheLRU(
+    tamanho_maximo=1, ttl=settings.EXPEDIENTE_VERSAO_INTERVALO.total_seconds()
+)
+CHAVE_VERSAO = "expediente:versao"
+
+
+def _get_versao() -> str:
+    """
+    Versão atual das regras no cache compartilhado. Sem versão (as regras
+    mudaram ou a entrada expirou), cria uma nova.
+    """
+    encontrado, versao = _versao_lida.get("versao")
+    if not encontrado:
+        versao = cache.get(CHAVE_VERSAO)
+        if versao is None:
+            cache.add(CHAVE_VERSAO, uuid.uuid4().hex, timeout=None)
+            versao = cache.get(CHAVE_VERSAO)
+        _versao_lida.set("versao", versao)
+    return versao
+
+
+def _compila_regras() -> dict:
+    """Compila todas as regras cadastradas, em uma consulta."""
+    periodos = {}
+    for regra in HorarioFuncionamento.objects.all():
+        dono = (regra.estabelecimento_id, regra.prestador_id)
+        periodos.setdefault(dono, {}).setdefault(regra.dia_semana, []).append(
+            (regra.inicio, regra.fim, regra.duracao_horario)
+        )
+    return {
+        dono: ModeloGrade(periodos_dono) for dono, periodos_dono in periodos.items()
+    }
+
+
+def get_modelo(estabelecimento_id: int = None, prestador_id: int = None):
+    """
+    Modelo de grade do prestador no estabelecimento: as regras do prestador
+    nele, as do prestador em geral, as do estabelecimento ou o padrão, nessa
+    ordem. Sem estabelecimento e prestador, retorna o padrão sem ir ao banco.
+    """
+    if estabelecimento_id is None and prestador_id is None:
+        return MODELO_PADRAO
+
+    versao = _get_versao()
+    encontrado, compilados = _cache_modelos.get("modelos")
+    if encontrado and compilados[0] == versao:
+        modelos = compilados[1]
+    else:
+        modelos = _compila_regras()
+        _cache_modelos.set("modelos", (versao, modelos))
+
+    for dono in [
+        (estabelecimento_id, prestador_id),
+        (None, prestador_id),
+        (estabelecimento_id, None),
+    ]:
+        if dono in modelos:
+            return modelos[dono]
+    return MODELO_PADRAO
+
+
+def limpa_cache_modelos():
+    _cache_modelos.clear()
+    _versao_lida.clear()
+
+
+def regras_alteradas():
+    """
+    Descarta a versão das regras, agora e de novo após o commit (como em
+    incrementa_versao_catalogo), para que todos os processos recompilem os
+    modelos; o processo atual já descarta os seus.
+    """
+    cache.delete(CHAVE_VERSAO)
+    transaction.on_commit(lambda: cache.delete(CHAVE_VERSAO))
+    limpa_cache_modelos()
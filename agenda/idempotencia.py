@@ -0,0 +1,82 @@
+"""
+Idempotency-Key em POST /api/agendamentos/. A primeira requisição com uma
+chave é executada e, se bem-sucedida, sua resposta é gravada em
+RespostaIdempotente na mesma transação do agendamento; as repetições com a
+mesma chave recebem a resposta gravada sem passar pela validação. Respostas de
+erro não são gravadas: nada foi criado e a repetição é executada de novo.
+
+Repetições simultâneas esperam a primeira com ChamadaUnica, no mesmo processo
+ou, pelo cache compartilhado (ver CACHES), em outro. Se ainda assim duas forem
+executadas (a espera passou de espera_maxima), a constraint unique da chave
+desfaz a segunda, que devolve a resposta da primeira.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from agenda.libs.cache import ChamadaUnica
+from agenda.models import RespostaIdempotente
+
+_chamadas = ChamadaUnica("idempotencia")
+
+
+def get_impressao(dados) -> str:
+    """sha256 do corpo da requisição, independente da ordem das chaves."""
+    conteudo = json.dumps(dados, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(conteudo.encode()).hexdigest()
+
+
+def _limite():
+    return timezone.now() - settings.IDEMPOTENCIA_TTL
+
+
+def get_resposta(chave: str):
+    """A resposta gravada para a chave, ou None se não há ou já expirou."""
+    return RespostaIdempotente.objects.filter(
+        chave=chave, criado_em__gte=_limite()
+    ).first()
+
+
+def executa_idempotente(chave: str, impressao: str, cria) -> RespostaIdempotente:
+    """
+    Retorna a resposta gravada para a chave ou, se não houver, chama `cria`,
+    que deve fazer o POST e retornar (status, corpo), e grava a resposta na
+    mesma transação. Erros de `cria` não são gravados.
+    """
+
+    def executa():
+        resposta = get_resposta(chave)
+        if resposta is not None:
+            return resposta
+
+        try:
+            with transaction.atomic():
+                # Uma resposta expirada com a mesma chave dá lugar à nova
+                RespostaIdempotente.objects.filter(
+                    chave=chave, criado_em__lt=_limite()
+                ).delete()
+                status, corpo = cria()
+                return RespostaIdempotente.objects.create(
+                    chave=chave, impressao=impressao, status=status, corpo=corpo
+                )
+        except IntegrityError:
+            # Outro processo gravou a chave primeiro; o agendamento deste foi
+            # desfeito junto com a transação.
+            resposta = get_resposta(chave)
+            if resposta is None:
+                raise
+            return resposta
+
+    # A chave do cliente tem até 255 caracteres; com o prefixo, passaria do
+    # tamanho das chaves do cache.
+    return _chamadas.executa(hashlib.sha256(chave.encode()).hexdigest(), executa)
+
+
+def limpa_respostas_expiradas() -> int:
+    """Apaga as respostas mais antigas que IDEMPOTENCIA_TTL."""
+    apagadas, _ = RespostaIdempotente.objects.filter(criado_em__lt=_limite()).delete()
+    return apagadas
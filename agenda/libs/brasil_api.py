@@ -1,28 +1,148 @@
-from datetime import date
-import requests
+from datetime import date, timedelta
+import json
+from pathlib import Path
 from django.conf import settings
+from django.utils import timezone
 import logging
 
+from agenda.libs.cache import ChamadaUnica
+from agenda.libs.cliente_brasil_api import BrasilAPIIndisponivel, get_cliente
+from agenda.models import CalendarioFeriados
 
-def is_feriado(data: date):
-    logging.info(f"Fazendo requisição para BrasilAPI para a data: {data.isoformat()}")
+# Cache em memória do processo: ano -> (válido até, datas dos feriados)
+_feriados_em_memoria = {}
+
+# Após uma falha da BrasilAPI, espera esse tempo antes de tentar novamente
+ESPERA_APOS_FALHA = timedelta(minutes=5)
+
+# Feriados nacionais distribuídos junto com o código. Atualizado pelo comando
+# `python manage.py atualiza_feriados --arquivo`.
+ARQUIVO_FERIADOS = Path(__file__).resolve().parent / "feriados.json"
+_feriados_embutidos = None
+
+# Requisições concorrentes pelos feriados do mesmo ano viram uma só
+_busca_feriados_agrupada = ChamadaUnica("brasil_api:feriados")
+
+
+def limpa_cache_feriados():
+    global _feriados_embutidos
+    _feriados_em_memoria.clear()
+    _feriados_embutidos = None
+
+
+def get_feriados_embutidos() -> dict:
+    """Retorna os feriados do arquivo distribuído com o código: ano -> datas."""
+
+    global _feriados_embutidos
+    if _feriados_embutidos is None:
+        with open(ARQUIVO_FERIADOS, encoding="utf-8") as arquivo:
+            anos = json.load(arquivo)["anos"]
+        _feriados_embutidos = {
+            int(ano): frozenset(date.fromisoformat(f["date"]) for f in feriados)
+            for ano, feriados in anos.items()
+        }
+    return _feriados_embutidos
+
+
+def busca_feriados(ano: int):
+    """
+    Busca os feriados do ano na BrasilAPI, como uma lista de dicionários com
+    "date" e "name". Retorna None em caso de erro.
+    """
+
+    logging.info(f"Fazendo requisição para BrasilAPI para o ano: {ano}")
     if settings.TESTING == True:
         logging.info("Requisição não está sendo feita pois TESTING = True")
-        if date.day == 15 and date.month == 4:
-            return True
-        return False
+        return []
 
-    ano = data.year
-    r = requests.get(f"https://brasilapi.com.br/api/feriados/v1/{ano}")
+    try:
+        r = get_cliente().get(f"/feriados/v1/{ano}")
+    except BrasilAPIIndisponivel:
+        return None
 
     if not r.status_code == 200:
         logging.error("Algum erro ocorreu na Brasil API")
+        return None
+    return r.json()
+
+
+def busca_cep(cep: str):
+    """
+    Busca o CEP na BrasilAPI. Retorna os dados do endereço, False se o CEP
+    não existe ou None se não foi possível consultar a BrasilAPI.
+    """
+
+    logging.info(f"Fazendo requisição para BrasilAPI com o CEP: {cep}")
+    try:
+        r = get_cliente().get(f"/cep/v2/{cep}")
+    except BrasilAPIIndisponivel:
+        return None
+
+    if r.status_code in (400, 404):
+        logging.info(f"CEP {cep} não encontrado na BrasilAPI")
         return False
-    feriados = r.json()
-    for feriado in feriados:
-        data_feriado_str = feriado["date"]
-        data_feriado = date.fromisoformat(data_feriado_str)
-        if data == data_feriado:
-            return True
-
-    return False
+
+    if not r.status_code == 200:
+        logging.error("Algum erro ocorreu na Brasil API")
+        return None
+    return r.json()
+
+
+def salva_feriados(ano: int, feriados) -> frozenset:
+    """Salva na tabela CalendarioFeriados os feriados retornados pela BrasilAPI."""
+
+    agora = timezone.now()
+    datas = frozenset(date.fromisoformat(feriado["date"]) for feriado in feriados)
+    CalendarioFeriados.objects.update_or_create(
+        ano=ano,
+        defaults={
+            "datas": sorted(d.isoformat() for d in datas),
+            "atualizado_em": agora,
+        },
+    )
+    _feriados_em_memoria[ano] = (agora + settings.FERIADOS_TTL, datas)
+    return datas
+
+
+def get_feriados(ano: int) -> frozenset:
+    """
+    Retorna o conjunto de datas de feriados nacionais do ano.
+
+    A consulta é local: memória do processo, tabela CalendarioFeriados
+    (atualizada pelo comando atualiza_feriados) e o arquivo feriados.json.
+    A BrasilAPI só é consultada para anos que não estão no arquivo e cujo
+    calendário salvo tem mais de settings.FERIADOS_TTL.
+    """
+
+    agora = timezone.now()
+    em_memoria = _feriados_em_memoria.get(ano)
+    if em_memoria and em_memoria[0] > agora:
+        return em_memoria[1]
+
+    calendario = CalendarioFeriados.objects.filter(ano=ano).first()
+    if calendario and calendario.atualizado_em + settings.FERIADOS_TTL > agora:
+        feriados = frozenset(date.fromisoformat(d) for d in calendario.datas)
+        validade = calendario.atualizado_em + settings.FERIADOS_TTL
+        _feriados_em_memoria[ano] = (validade, feriados)
+        return feriados
+
+    embutidos = get_feriados_embutidos().get(ano)
+    if embutidos is not None:
+        _feriados_em_memoria[ano] = (agora + settings.FERIADOS_TTL, embutidos)
+        return embutidos
+
+    buscados = _busca_feriados_agrupada.executa(ano, lambda: busca_feriados(ano))
+    if buscados is None:
+        feriados = frozenset()
+        if calendario:
+            logging.warning(f"Usando calendário de feriados desatualizado de {ano}")
+            feriados = frozenset(date.fromisoformat(d) for d in calendario.datas)
+        _feriados_em_memoria[ano] = (agora + ESPERA_APOS_FALHA, feriados)
+        return feriados
+
+    return salva_feriados(ano, buscados)
+
+
+def is_feriado(data: date):
+    logging.info(f"Verificando se a data {data.isoformat()} é feriado")
+    return data in get_feriados(data.year)
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import threading
+import time
+
+from django.core.cache import cache
+
+
+class CacheLRU:
+    """
+    Cache em memória com tamanho máximo e validade por entrada. Quando cheio,
+    descarta a entrada usada há mais tempo.
+    """
+
+    def __init__(self, tamanho_maximo: int, ttl: float):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        """Retorna (encontrado, valor)."""
+
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                return False, None
+            validade, valor = entrada
+            if validade <= time.monotonic():
+                del self._entradas[chave]
+                return False, None
+            self._entradas.move_to_end(chave)
+            return True, valor
+
+    def set(self, chave, valor, ttl: float = None):
+        validade = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entradas[chave] = (validade, valor)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.tamanho_maximo:
+                self._entradas.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+class _Chamada:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class ChamadaUnica:
+    """
+    Agrupa chamadas concorrentes com a mesma chave: a primeira executa a
+    função e as demais esperam e recebem o mesmo resultado.
+
+    Entre threads do mesmo processo isso é feito em memória. Entre processos
+    (workers do gunicorn), a primeira chamada reserva a chave no cache do
+    Django com `cache.add` e publica o resultado nele; os outros processos
+    esperam o resultado por até `espera_maxima` segundos antes de executar
+    a função por conta própria. Para isso o cache do Django precisa ser
+    compartilhado entre os processos, como o configurado em CACHES.
+    """
+
+    def __init__(self, prefixo: str, espera_maxima: float = 10):
+        self.prefixo = prefixo
+        self.espera_maxima = espera_maxima
+        self._em_andamento = {}
+        self._lock = threading.Lock()
+
+    def executa(self, chave, funcao):
+        with self._lock:
+            chamada = self._em_andamento.get(chave)
+            lider = chamada is None
+            if lider:
+                chamada = self._em_andamento[chave] = _Chamada()
+
+        if not lider:
+            chamada.evento.wait()
+            if chamada.erro is not None:
+                raise chamada.erro
+            return chamada.resultado
+
+        try:
+            chamada.resultado = self._executa_entre_processos(chave, funcao)
+            return chamada.resultado
+        except Exception as erro:
+            chamada.erro = erro
+            raise
+        finally:
+            with self._lock:
+                del self._em_andamento[chave]
+            chamada.evento.set()
+
+    def _executa_entre_processos(self, chave, funcao):
+        chave_lock = f"{self.prefixo}:{chave}:lock"
+        chave_resultado = f"{self.prefixo}:{chave}:resultado"
+
+        if cache.add(chave_lock, True, timeout=self.espera_maxima):
+            try:
+                resultado = funcao()
+                cache.set(chave_resultado, (resultado,), timeout=self.espera_maxima)
+                return resultado
+            finally:
+                cache.delete(chave_lock)
+
+        limite = time.monotonic() + self.espera_maxima
+        while time.monotonic() < limite:
+            publicado = cache.get(chave_resultado)
+            if publicado is not None:
+                return publicado[0]
+            if cache.get(chave_lock) is None:
+                break
+            time.sleep(0.05)
+
+        return funcao()
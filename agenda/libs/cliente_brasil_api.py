@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class BrasilAPIIndisponivel(Exception):
+    """A BrasilAPI não respondeu ou o disjuntor está aberto."""
+
+
+class Disjuntor:
+    """
+    Circuit breaker: depois de `limite_falhas` falhas seguidas, recusa novas
+    chamadas por `tempo_aberto` segundos. Passado esse tempo, deixa uma
+    chamada de teste passar; se ela funcionar, volta a aceitar todas.
+    """
+
+    def __init__(self, limite_falhas: int, tempo_aberto: float):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self.falhas = 0
+        self.aberto_ate = None
+        self._testando = False
+        self._lock = threading.Lock()
+
+    @property
+    def aberto(self):
+        return self.aberto_ate is not None
+
+    def permite(self) -> bool:
+        with self._lock:
+            if self.aberto_ate is None:
+                return True
+            if self._testando or time.monotonic() < self.aberto_ate:
+                return False
+            self._testando = True
+            return True
+
+    def registra_sucesso(self):
+        with self._lock:
+            self.falhas = 0
+            self.aberto_ate = None
+            self._testando = False
+
+    def registra_falha(self):
+        with self._lock:
+            self.falhas += 1
+            self._testando = False
+            if self.falhas >= self.limite_falhas:
+                self.aberto_ate = time.monotonic() + self.tempo_aberto
+
+
+class ClienteBrasilAPI:
+    """
+    Cliente HTTP compartilhado para a BrasilAPI: mantém as conexões abertas
+    entre requisições, limita o tempo de espera, repete requisições que
+    falharam por erro temporário e para de chamar a API enquanto ela estiver
+    fora do ar.
+    """
+
+    def __init__(
+        self,
+        url_base: str = None,
+        timeout: tuple = None,
+        tentativas: int = None,
+        limite_falhas: int = None,
+        tempo_aberto: float = None,
+    ):
+        self.url_base = (url_base or settings.BRASIL_API_URL).rstrip("/")
+        self.timeout = timeout or settings.BRASIL_API_TIMEOUT
+        if tentativas is None:
+            tentativas = settings.BRASIL_API_TENTATIVAS
+        self.disjuntor = Disjuntor(
+            limite_falhas or settings.BRASIL_API_LIMITE_FALHAS,
+            tempo_aberto or settings.BRASIL_API_TEMPO_ABERTO.total_seconds(),
+        )
+
+        retry = Retry(
+            total=tentativas,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, caminho: str) -> requests.Response:
+        """
+        Faz um GET em `caminho` (ex.: "/cep/v2/01001000"). Respostas 5xx e
+        erros de conexão contam como falha para o disjuntor e levantam
+        BrasilAPIIndisponivel; outras respostas são retornadas.
+        """
+        if not self.disjuntor.permite():
+            raise BrasilAPIIndisponivel("Disjuntor da BrasilAPI está aberto")
+
+        try:
+            r = self.session.get(self.url_base + caminho, timeout=self.timeout)
+        except requests.RequestException as erro:
+            self.disjuntor.registra_falha()
+            logging.error(f"Erro ao acessar a BrasilAPI: {erro}")
+            raise BrasilAPIIndisponivel(str(erro)) from erro
+
+        if r.status_code >= 500:
+            self.disjuntor.registra_falha()
+            logging.error(f"BrasilAPI respondeu com status {r.status_code}")
+            raise BrasilAPIIndisponivel(f"Status {r.status_code}")
+
+        self.disjuntor.registra_sucesso()
+        return r
+
+
+_cliente = None
+_cliente_lock = threading.Lock()
+
+
+def get_cliente() -> ClienteBrasilAPI:
+    global _cliente
+    if _cliente is None:
+        with _cliente_lock:
+            if _cliente is None:
+                _cliente = ClienteBrasilAPI()
+    return _cliente
@@ -0,0 +1,193 @@
+"""
+Criação de agendamentos em lote (POST /api/agendamentos/batch/). Cada item é
+validado com AgendamentoLoteSerializer, com as mesmas regras de
+AgendamentoSerializer; as consultas que o serializer faria por item
+(prestador, estabelecimento, serviço, Funcionarios, ocupação e agendamento do
+cliente no dia) são feitas uma vez para o lote inteiro pelo ContextoLote. Os
+itens válidos são gravados com um bulk_create.
+"""
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework import serializers
+
+from agenda.models import Agendamento, Estabelecimento, Funcionarios, Servicos
+from agenda.ocupacao import get_dia, get_mascara, get_ocupacao, reserva_ocupacao
+from agenda.serializers import AgendamentoLoteSerializer
+from agenda.utils import (
+    AcumuladorFidelidade,
+    MapaIdentidade,
+    get_horarios_disponiveis,
+    get_intervalo_do_dia,
+    invalida_horarios,
+)
+
+
+def _valores(itens: list, campo: str) -> set:
+    return {
+        str(item[campo])
+        for item in itens
+        if isinstance(item, dict) and isinstance(item.get(campo), (str, int))
+    }
+
+
+def _le_data_horario(item):
+    if not isinstance(item, dict):
+        return None
+    try:
+        return serializers.DateTimeField().run_validation(item.get("data_horario"))
+    except serializers.ValidationError:
+        return None
+
+
+class ContextoLote:
+    """
+    Dados de que a validação dos itens precisa, lidos para o lote inteiro em
+    seis consultas: prestadores, estabelecimentos, serviços, Funcionarios, a
+    ocupação dos prestadores e os agendamentos deles nos dias do lote. Os
+    itens aceitos entram nas verificações dos seguintes com `registra`.
+    """
+
+    def __init__(self, itens: list):
+        self.mapa_identidade = MapaIdentidade()
+        prestador_ids = [
+            prestador.id
+            for prestador in self.mapa_identidade.carrega(
+                User, "username", _valores(itens, "prestador")
+            )
+        ]
+        estabelecimento_ids = [
+            estabelecimento.id
+            for estabelecimento in self.mapa_identidade.carrega(
+                Estabelecimento,
+                "nome_estabelecimento",
+                _valores(itens, "estabelecimento"),
+            )
+        ]
+        self.mapa_identidade.carrega(Servicos, "servico", _valores(itens, "servico"))
+
+        self.funcionarios = set(
+            Funcionarios.objects.filter(
+                prestador_id__in=prestador_ids,
+                estabelecimento_id__in=estabelecimento_ids,
+            ).values_list("prestador_id", "estabelecimento_id", "servico_id")
+        )
+
+        self.ocupacao = {}
+        self.clientes = set()
+        datas = [data for data in map(_le_data_horario, itens) if data is not None]
+        if datas and prestador_ids:
+            primeiro, ultimo = min(datas), max(datas)
+            self.ocupacao = get_ocupacao(
+                get_dia(primeiro),
+                get_dia(ultimo),
+                prestador_ids,
+            )
+            agendamentos = Agendamento.objects.filter(
+                prestador_id__in=prestador_ids,
+                data_horario__gte=get_intervalo_do_dia(primeiro)[0],
+                data_horario__lt=get_intervalo_do_dia(ultimo)[1],
+                cancelado=False,
+            ).values_list(
+                "nome_cliente",
+                "email_cliente",
+                "prestador_id",
+                "estabelecimento_id",
+                "data_horario",
+            )
+            self.clientes = {
+                (nome, email, prestador_id, estabelecimento_id, self._dia(data))
+                for nome, email, prestador_id, estabelecimento_id, data in agendamentos
+            }
+
+    @staticmethod
+    def _dia(data_horario):
+        return timezone.localtime(data_horario).date()
+
+    def horario_disponivel(
+        self, data_horario, prestador_id, estabelecimento_id, duracao
+    ) -> bool:
+        return data_horario in get_horarios_disponiveis(
+            data_horario.date(),
+            prestador_id,
+            estabelecimento_id,
+            duracao,
+            ocupacao=self.ocupacao,
+        )
+
+    def atende_servico(self, prestador, estabelecimento, servico) -> bool:
+        return (prestador.id, estabelecimento.id, servico.id) in self.funcionarios
+
+    def cliente_agendado_no_dia(
+        self, nome_cliente, email_cliente, data_horario, prestador, estabelecimento
+    ) -> bool:
+        return (
+            nome_cliente,
+            email_cliente,
+            prestador.id,
+            estabelecimento.id,
+            self._dia(data_horario),
+        ) in self.clientes
+
+    def registra(self, dados: dict):
+        prestador, data_horario = dados["prestador"], dados["data_horario"]
+        self.clientes.add(
+            (
+                dados["nome_cliente"],
+                dados["email_cliente"],
+                prestador.id,
+                dados["estabelecimento"].id,
+                self._dia(data_horario),
+            )
+        )
+        if dados.get("states") == "CONF" and not dados.get("cancelado"):
+            chave = (prestador.id, get_dia(data_horario))
+            self.ocupacao[chave] = self.ocupacao.get(chave, 0) | get_mascara(
+                data_horario, dados["servico"].duracao
+            )
+
+
+def valida_lote(itens: list) -> list:
+    """Valida os itens em ordem; retorna um serializer validado por item."""
+    lote = ContextoLote(itens)
+    contexto = {"lote": lote, "mapa_identidade": lote.mapa_identidade}
+    validados = []
+    for item in itens:
+        serializer = AgendamentoLoteSerializer(data=item, context=contexto)
+        if serializer.is_valid():
+            lote.registra(serializer.validated_data)
+        validados.append(serializer)
+    return validados
+
+
+def grava_lote(validos: list) -> list:
+    """
+    Grava os agendamentos dos serializers válidos com bulk_create, na
+    transação atual. Como bulk_create não dispara os sinais, a ocupação, o
+    cache de horários e a fidelidade são atualizados aqui, de uma vez.
+    Levanta ConflitoHorario se outro agendamento ocupou um dos horários
+    depois da validação.
+    """
+    agendamentos = [Agendamento(**serializer.validated_data) for serializer in validos]
+    reserva_ocupacao(
+        (
+            agendamento.prestador_id,
+            agendamento.data_horario,
+            agendamento.servico.duracao,
+        )
+        for agendamento in agendamentos
+        if agendamento.states == "CONF" and not agendamento.cancelado
+    )
+    Agendamento.objects.bulk_create(agendamentos, batch_size=500)
+    invalida_horarios(
+        *[
+            (agendamento.prestador_id, agendamento.data_horario)
+            for agendamento in agendamentos
+        ]
+    )
+
+    fidelidade = AcumuladorFidelidade()
+    for serializer, agendamento in zip(validos, agendamentos):
+        serializer.instance = agendamento
+        fidelidade.adiciona(agendamento.nome_cliente, agendamento.prestador)
+    fidelidade.grava()
+    return agendamentos
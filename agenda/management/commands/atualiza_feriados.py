@@ -0,0 +1,62 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from agenda.libs import brasil_api
+
+
+class Command(BaseCommand):
+    help = (
+        "Atualiza o calendário de feriados a partir da BrasilAPI. "
+        "Sem anos informados, atualiza o ano atual e o próximo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("anos", nargs="*", type=int)
+        parser.add_argument(
+            "--arquivo",
+            action="store_true",
+            help="Também grava os feriados no arquivo agenda/libs/feriados.json",
+        )
+
+    def handle(self, *args, **options):
+        anos = options["anos"]
+        if not anos:
+            ano_atual = timezone.now().year
+            anos = [ano_atual, ano_atual + 1]
+
+        atualizados = {}
+        for ano in anos:
+            feriados = brasil_api.busca_feriados(ano)
+            if feriados is None:
+                # Não interrompe o deploy: o calendário salvo ou o arquivo
+                # distribuído com o código continuam sendo usados.
+                logging.warning(f"Não foi possível atualizar os feriados de {ano}")
+                continue
+            brasil_api.salva_feriados(ano, feriados)
+            atualizados[ano] = feriados
+            self.stdout.write(f"Feriados de {ano} atualizados ({len(feriados)})")
+
+        if options["arquivo"] and atualizados:
+            self.grava_arquivo(atualizados)
+
+    def grava_arquivo(self, atualizados):
+        with open(brasil_api.ARQUIVO_FERIADOS, encoding="utf-8") as arquivo:
+            dados = json.load(arquivo)
+
+        for ano, feriados in atualizados.items():
+            dados["anos"][str(ano)] = [
+                {"date": feriado["date"], "name": feriado["name"]}
+                for feriado in sorted(feriados, key=lambda f: f["date"])
+            ]
+        dados["anos"] = dict(sorted(dados["anos"].items()))
+        dados["versao"] = timezone.now().date().isoformat().replace("-", ".")
+
+        with open(brasil_api.ARQUIVO_FERIADOS, "w", encoding="utf-8") as arquivo:
+            json.dump(dados, arquivo, ensure_ascii=False, indent=2)
+            arquivo.write("\n")
+
+        brasil_api.limpa_cache_feriados()
+        self.stdout.write(f"Arquivo {brasil_api.ARQUIVO_FERIADOS.name} atualizado")
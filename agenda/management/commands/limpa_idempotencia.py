@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from agenda.idempotencia import limpa_respostas_expiradas
+
+
+class Command(BaseCommand):
+    help = (
+        "Apaga as respostas guardadas para Idempotency-Key mais antigas que "
+        "IDEMPOTENCIA_TTL."
+    )
+
+    def handle(self, *args, **options):
+        apagadas = limpa_respostas_expiradas()
+        self.stdout.write(f"{apagadas} respostas expiradas apagadas")
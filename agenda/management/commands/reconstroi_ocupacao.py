@@ -0,0 +1,20 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from agenda.ocupacao import reconstroi_ocupacao
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula a tabela de ocupação dos prestadores a partir dos "
+        "agendamentos confirmados. Sem período informado, recalcula todos os dias."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--inicio", type=date.fromisoformat)
+        parser.add_argument("--fim", type=date.fromisoformat)
+
+    def handle(self, *args, **options):
+        linhas = reconstroi_ocupacao(options["inicio"], options["fim"])
+        self.stdout.write(f"Ocupação reconstruída ({linhas} prestadores/dias)")
@@ -0,0 +1,47 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from agenda.ocupacao import UNIDADE, reconstroi_ocupacao, verifica_ocupacao
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara a tabela de ocupação com os agendamentos confirmados e lista "
+        "as divergências. Com --corrige, reconstrói os dias divergentes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--inicio", type=date.fromisoformat)
+        parser.add_argument("--fim", type=date.fromisoformat)
+        parser.add_argument("--corrige", action="store_true")
+
+    def handle(self, *args, **options):
+        divergencias = verifica_ocupacao(options["inicio"], options["fim"])
+        if not divergencias:
+            self.stdout.write("Ocupação consistente com os agendamentos")
+            return
+
+        for prestador_id, dia, esperado, gravado in divergencias:
+            self.stdout.write(
+                f"Prestador {prestador_id} em {dia}: "
+                f"faltando {self.horarios(esperado & ~gravado)}, "
+                f"sobrando {self.horarios(gravado & ~esperado)}"
+            )
+
+        if not options["corrige"]:
+            raise CommandError(f"{len(divergencias)} divergências na ocupação")
+
+        for dia in sorted({dia for _, dia, _, _ in divergencias}):
+            reconstroi_ocupacao(dia, dia)
+        self.stdout.write(f"{len(divergencias)} divergências corrigidas")
+
+    def horarios(self, mascara):
+        """Início de cada trecho de bits ligados, como HH:MM."""
+        inicios = []
+        for unidade in range(mascara.bit_length()):
+            anterior = unidade > 0 and mascara >> (unidade - 1) & 1
+            if mascara >> unidade & 1 and not anterior:
+                minutos = unidade * UNIDADE.seconds // 60
+                inicios.append(f"{minutos // 60:02d}:{minutos % 60:02d}")
+        return ", ".join(inicios) or "-"
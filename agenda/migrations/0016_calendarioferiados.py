@@ -0,0 +1,22 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0015_alter_endereco_estado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarioFeriados',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.IntegerField(unique=True)),
+                ('datas', models.JSONField(default=list)),
+                ('atualizado_em', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+def desconfirma_agendamentos_duplicados(apps, schema_editor):
+    # Antes da constraint, duas requisições concorrentes podiam confirmar o
+    # mesmo horário para o prestador. Mantém confirmado o agendamento mais
+    # antigo de cada horário; os demais voltam a não confirmados.
+    Agendamento = apps.get_model('agenda', 'Agendamento')
+    vistos = set()
+    duplicados = []
+    confirmados = Agendamento.objects.filter(states='CONF', cancelado=False)
+    for id, prestador_id, data_horario in confirmados.order_by('id').values_list(
+        'id', 'prestador_id', 'data_horario'
+    ):
+        if (prestador_id, data_horario) in vistos:
+            duplicados.append(id)
+        vistos.add((prestador_id, data_horario))
+    Agendamento.objects.filter(id__in=duplicados).update(states='UNCO')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0016_calendarioferiados'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            desconfirma_agendamentos_duplicados, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='agendamento',
+            constraint=models.UniqueConstraint(condition=models.Q(('cancelado', False), ('states', 'CONF')), fields=('prestador', 'data_horario'), name='agendamento_horario_confirmado_unique'),
+        ),
+    ]
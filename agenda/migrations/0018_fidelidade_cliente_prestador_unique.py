@@ -0,0 +1,39 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+def junta_fidelidades_duplicadas(apps, schema_editor):
+    # Incrementos concorrentes podiam criar mais de uma fidelidade para o
+    # mesmo cliente e prestador. Cada linha representa nivel_fidelidade + 1
+    # agendamentos; junta tudo na linha mais antiga.
+    Fidelidade = apps.get_model('agenda', 'Fidelidade')
+    vistas = {}
+    for fidelidade in Fidelidade.objects.order_by('id'):
+        chave = (fidelidade.nome_cliente, fidelidade.prestador_id)
+        if chave not in vistas:
+            vistas[chave] = fidelidade
+            continue
+        principal = vistas[chave]
+        principal.nivel_fidelidade += fidelidade.nivel_fidelidade + 1
+        principal.save(update_fields=['nivel_fidelidade'])
+        fidelidade.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0017_agendamento_horario_confirmado_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='fidelidade',
+            name='fidelidade_unique',
+        ),
+        migrations.RunPython(junta_fidelidades_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='fidelidade',
+            constraint=models.UniqueConstraint(fields=('nome_cliente', 'prestador'), name='fidelidade_cliente_prestador_unique'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0018_fidelidade_cliente_prestador_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(condition=models.Q(('cancelado', False)), fields=['prestador', 'states', 'data_horario'], name='agendamento_prest_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(condition=models.Q(('cancelado', False)), fields=['prestador', 'data_horario', 'id'], name='agendamento_prest_horario_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(condition=models.Q(('cancelado', False), ('states', 'CONF')), fields=['data_horario'], name='agendamento_confirmado_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0019_agendamento_indices'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agendamento',
+            index=models.Index(condition=models.Q(('cancelado', False)), fields=['email_cliente', 'prestador', 'data_horario'], name='agendamento_cliente_dia_idx'),
+        ),
+    ]
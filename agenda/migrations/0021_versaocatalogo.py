@@ -0,0 +1,22 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0020_agendamento_cliente_dia_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tabela', models.CharField(max_length=50, unique=True)),
+                ('versao', models.PositiveIntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:26
+
+from datetime import timezone
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def preenche_ocupacao(apps, schema_editor):
+    # Mesmo cálculo de agenda.ocupacao, na época em que todo agendamento
+    # ocupava 30 minutos (6 intervalos de 5 minutos).
+    Agendamento = apps.get_model('agenda', 'Agendamento')
+    OcupacaoDia = apps.get_model('agenda', 'OcupacaoDia')
+    mascaras = {}
+    confirmados = Agendamento.objects.filter(states='CONF', cancelado=False)
+    for prestador_id, data_horario in confirmados.values_list('prestador_id', 'data_horario'):
+        data_horario = data_horario.astimezone(timezone.utc)
+        unidade = (data_horario.hour * 60 + data_horario.minute) // 5
+        chave = (prestador_id, data_horario.date())
+        mascaras[chave] = mascaras.get(chave, 0) | (0b111111 << unidade)
+    OcupacaoDia.objects.bulk_create(
+        [
+            OcupacaoDia(
+                prestador_id=prestador_id,
+                dia=dia,
+                ocupados=(mascara & (1 << 288) - 1).to_bytes(36, 'big'),
+            )
+            for (prestador_id, dia), mascara in mascaras.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('agenda', '0021_versaocatalogo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacaoDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('ocupados', models.BinaryField(default=b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00')),
+                ('prestador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacao', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ocupacaodia',
+            index=models.Index(fields=['dia'], name='ocupacao_dia_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ocupacaodia',
+            constraint=models.UniqueConstraint(fields=('prestador', 'dia'), name='ocupacao_prestador_dia_unique'),
+        ),
+        migrations.RunPython(preenche_ocupacao, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:30
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('agenda', '0022_ocupacaodia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HorarioFuncionamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Segunda-feira'), (1, 'Terça-feira'), (2, 'Quarta-feira'), (3, 'Quinta-feira'), (4, 'Sexta-feira'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('inicio', models.TimeField()),
+                ('fim', models.TimeField()),
+                ('duracao_horario', models.DurationField(default=datetime.timedelta(seconds=1800))),
+                ('estabelecimento', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='horarios_funcionamento', to='agenda.estabelecimento')),
+                ('prestador', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='horarios_funcionamento', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='horariofuncionamento',
+            constraint=models.CheckConstraint(check=models.Q(('fim__gt', django.db.models.expressions.F('inicio'))), name='horario_funcionamento_fim_apos_inicio'),
+        ),
+        migrations.AddConstraint(
+            model_name='horariofuncionamento',
+            constraint=models.CheckConstraint(check=models.Q(('estabelecimento__isnull', False), ('prestador__isnull', False), _connector='OR'), name='horario_funcionamento_com_dono'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:33
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0023_horariofuncionamento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicos',
+            name='duracao',
+            field=models.DurationField(default=datetime.timedelta(seconds=1800)),
+        ),
+    ]
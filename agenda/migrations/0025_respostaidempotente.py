@@ -0,0 +1,25 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:43
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0024_servicos_duracao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RespostaIdempotente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(max_length=255, unique=True)),
+                ('impressao', models.CharField(max_length=64)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('corpo', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('criado_em', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.2 on 2026-10-18 21:10
+
+import agenda.models
+import datetime
+from django.db import migrations, models
+
+
+def corrige_duracoes_invalidas(apps, schema_editor):
+    # Antes da validação, a API aceitava durações negativas, nulas ou maiores
+    # que um dia. Essas voltam ao padrão de 30 minutos (rode
+    # reconstroi_ocupacao depois); as que não são múltiplas de 5 minutos são
+    # arredondadas para cima, como a ocupação já as marcava.
+    Servicos = apps.get_model('agenda', 'Servicos')
+    unidade = datetime.timedelta(minutes=5)
+    for servico in Servicos.objects.all():
+        duracao = servico.duracao
+        if duracao <= datetime.timedelta(0) or duracao > datetime.timedelta(days=1):
+            duracao = datetime.timedelta(minutes=30)
+        duracao = -(-duracao // unidade) * unidade
+        if duracao != servico.duracao:
+            Servicos.objects.filter(id=servico.id).update(duracao=duracao)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0025_respostaidempotente'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='servicos',
+            name='duracao',
+            field=models.DurationField(default=datetime.timedelta(seconds=1800), validators=[agenda.models.valida_duracao]),
+        ),
+        migrations.RunPython(
+            corrige_duracoes_invalidas, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='servicos',
+            constraint=models.CheckConstraint(check=models.Q(('duracao__gt', datetime.timedelta(0)), ('duracao__lte', datetime.timedelta(days=1))), name='servicos_duracao_positiva_ate_um_dia'),
+        ),
+    ]
@@ -1,7 +1,27 @@
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 # Create your models here.
 
+# A ocupação dos prestadores é marcada em unidades de 5 minutos, em mapas de
+# um dia (ver agenda/ocupacao.py)
+UNIDADE_OCUPACAO = timedelta(minutes=5)
+DURACAO_MAXIMA = timedelta(days=1)
+
+
+def valida_duracao(duracao: timedelta):
+    if (
+        duracao <= timedelta(0)
+        or duracao > DURACAO_MAXIMA
+        or duracao % UNIDADE_OCUPACAO
+    ):
+        raise ValidationError(
+            "A duração deve ser um múltiplo de 5 minutos, de até um dia."
+        )
+
 
 class Fidelidade(models.Model):
     nome_cliente = models.CharField(max_length=200)
@@ -13,8 +33,8 @@ class Fidelidade(models.Model):
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=["nome_cliente", "prestador", "nivel_fidelidade"],
-                name="fidelidade_unique",
+                fields=["nome_cliente", "prestador"],
+                name="fidelidade_cliente_prestador_unique",
             )
         ]
 
@@ -24,6 +44,21 @@ class Fidelidade(models.Model):
 
 class Servicos(models.Model):
     servico = models.CharField(max_length=300, unique=True)
+    # Por quanto tempo um agendamento do serviço ocupa o prestador. Ao alterar
+    # a duração de um serviço já agendado, rode reconstroi_ocupacao.
+    duracao = models.DurationField(
+        default=timedelta(minutes=30), validators=[valida_duracao]
+    )
+
+    class Meta:
+        constraints = [
+            # O múltiplo de 5 minutos é verificado por valida_duracao
+            models.CheckConstraint(
+                check=models.Q(duracao__gt=timedelta(0))
+                & models.Q(duracao__lte=DURACAO_MAXIMA),
+                name="servicos_duracao_positiva_ate_um_dia",
+            )
+        ]
 
     def __str__(self):
         return self.servico
@@ -75,6 +110,138 @@ class Agendamento(models.Model):
     servico = models.ForeignKey(Servicos, on_delete=models.CASCADE)
     estabelecimento = models.ForeignKey(Estabelecimento, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Listagens de agendamentos de um prestador, filtradas por estado
+            # (confirmados, não confirmados, executados) e ordenadas por data.
+            models.Index(
+                fields=["prestador", "states", "data_horario"],
+                condition=models.Q(cancelado=False),
+                name="agendamento_prest_estado_idx",
+            ),
+            # Listagem de todos os agendamentos ativos de um prestador,
+            # paginada por (data_horario, id).
+            models.Index(
+                fields=["prestador", "data_horario", "id"],
+                condition=models.Q(cancelado=False),
+                name="agendamento_prest_horario_idx",
+            ),
+            # Verificação de um agendamento por cliente e dia no serializer.
+            models.Index(
+                fields=["email_cliente", "prestador", "data_horario"],
+                condition=models.Q(cancelado=False),
+                name="agendamento_cliente_dia_idx",
+            ),
+            # Agendamentos confirmados de um período, lidos ao reconstruir ou
+            # verificar a OcupacaoDia.
+            models.Index(
+                fields=["data_horario"],
+                condition=models.Q(states="CONF", cancelado=False),
+                name="agendamento_confirmado_idx",
+            ),
+        ]
+        constraints = [
+            # Um prestador só pode ter um agendamento confirmado por horário.
+            # Garante no banco a verificação de disponibilidade do serializer
+            # quando duas requisições tentam o mesmo horário ao mesmo tempo.
+            models.UniqueConstraint(
+                fields=["prestador", "data_horario"],
+                condition=models.Q(states="CONF", cancelado=False),
+                name="agendamento_horario_confirmado_unique",
+            )
+        ]
+
+
+class HorarioFuncionamento(models.Model):
+    """
+    Período de atendimento em um dia da semana (UTC), dividido em horários de
+    `duracao_horario`. Vários períodos no mesmo dia formam os intervalos (por
+    exemplo, 09:00-12:00 e 13:00-18:00 deixam o almoço livre).
+
+    As regras de um estabelecimento valem para todos os seus prestadores; as
+    de um prestador nesse estabelecimento (ou, sem estabelecimento, em
+    qualquer um) as substituem. Sem regras, vale o expediente padrão de
+    agenda/expediente.py.
+    """
+
+    DIAS_SEMANA = [
+        (0, "Segunda-feira"),
+        (1, "Terça-feira"),
+        (2, "Quarta-feira"),
+        (3, "Quinta-feira"),
+        (4, "Sexta-feira"),
+        (5, "Sábado"),
+        (6, "Domingo"),
+    ]
+
+    estabelecimento = models.ForeignKey(
+        Estabelecimento,
+        related_name="horarios_funcionamento",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    prestador = models.ForeignKey(
+        "auth.User",
+        related_name="horarios_funcionamento",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    dia_semana = models.PositiveSmallIntegerField(choices=DIAS_SEMANA)
+    inicio = models.TimeField()
+    fim = models.TimeField()
+    duracao_horario = models.DurationField(default=timedelta(minutes=30))
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(fim__gt=models.F("inicio")),
+                name="horario_funcionamento_fim_apos_inicio",
+            ),
+            models.CheckConstraint(
+                check=models.Q(estabelecimento__isnull=False)
+                | models.Q(prestador__isnull=False),
+                name="horario_funcionamento_com_dono",
+            ),
+        ]
+
+    def clean(self):
+        if self.duracao_horario is not None:
+            try:
+                valida_duracao(self.duracao_horario)
+            except ValidationError as erro:
+                raise ValidationError({"duracao_horario": erro.messages})
+
+    def __str__(self):
+        dono = self.prestador or self.estabelecimento
+        return f"{dono}: {self.get_dia_semana_display()} {self.inicio}-{self.fim}"
+
+
+class OcupacaoDia(models.Model):
+    """
+    Horários ocupados por agendamentos confirmados de um prestador em um dia
+    (UTC), como um mapa de bits com um bit para cada 5 minutos a partir da
+    meia-noite. É atualizada junto com o agendamento; ver agenda/ocupacao.py.
+    """
+
+    prestador = models.ForeignKey(
+        "auth.User", related_name="ocupacao", on_delete=models.CASCADE
+    )
+    dia = models.DateField()
+    ocupados = models.BinaryField(default=bytes(36))
+
+    class Meta:
+        indexes = [models.Index(fields=["dia"], name="ocupacao_dia_idx")]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["prestador", "dia"], name="ocupacao_prestador_dia_unique"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.prestador} {self.dia}"
+
 
 class Endereco(models.Model):
     estabelecimento = models.ForeignKey(Estabelecimento, on_delete=models.CASCADE)
@@ -84,3 +251,44 @@ class Endereco(models.Model):
     bairro = models.CharField(max_length=50)
     rua = models.CharField(max_length=200)
     complemento = models.CharField(max_length=50, blank=True)
+
+
+class CalendarioFeriados(models.Model):
+    ano = models.IntegerField(unique=True)
+    datas = models.JSONField(default=list)
+    atualizado_em = models.DateTimeField()
+
+    def __str__(self):
+        return str(self.ano)
+
+
+class VersaoCatalogo(models.Model):
+    """
+    Versão de uma tabela de catálogo (serviços, estabelecimentos, endereços),
+    incrementada a cada alteração. Serve de ETag barato para as listagens.
+    """
+
+    tabela = models.CharField(max_length=50, unique=True)
+    versao = models.PositiveIntegerField(default=0)
+    atualizado_em = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.tabela} v{self.versao}"
+
+
+class RespostaIdempotente(models.Model):
+    """
+    Resposta de um POST /agendamentos/ com o cabeçalho Idempotency-Key. As
+    repetições com a mesma chave recebem essa resposta, sem criar outro
+    agendamento, por IDEMPOTENCIA_TTL; ver agenda/idempotencia.py.
+    """
+
+    chave = models.CharField(max_length=255, unique=True)
+    # sha256 do corpo da requisição, para recusar a chave reutilizada em outra
+    impressao = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField()
+    corpo = models.JSONField(encoder=DjangoJSONEncoder)
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.chave
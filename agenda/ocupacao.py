@@ -0,0 +1,267 @@
+"""
+Ocupação dos prestadores por dia, guardada em OcupacaoDia como um mapa de bits
+com um bit para cada UNIDADE (5 minutos) a partir da meia-noite UTC. Um
+agendamento confirmado e não cancelado ocupa os bits do seu intervalo, da
+data_horario até o fim da duração do serviço. Verificar se um intervalo está
+livre é um AND com a ocupação do dia, qualquer que seja o número de
+agendamentos.
+
+A tabela é atualizada na mesma transação do agendamento (ver agenda/signals.py)
+e pode ser reconstruída ou verificada com os comandos reconstroi_ocupacao e
+verifica_ocupacao.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+
+from django.db import IntegrityError, transaction
+
+from agenda.models import UNIDADE_OCUPACAO as UNIDADE
+from agenda.models import Agendamento, OcupacaoDia
+
+UNIDADES_POR_DIA = 288
+BYTES_POR_DIA = UNIDADES_POR_DIA // 8
+DIA_INTEIRO = (1 << UNIDADES_POR_DIA) - 1
+DURACAO_AGENDAMENTO = timedelta(minutes=30)
+
+
+def get_dia(data_horario: datetime) -> date:
+    return data_horario.astimezone(timezone.utc).date()
+
+
+def get_intervalo_utc(inicio: date, fim: date):
+    """Intervalo [início, fim) em UTC que cobre os dias de inicio a fim."""
+    return (
+        datetime.combine(inicio, time.min, tzinfo=timezone.utc),
+        datetime.combine(fim + timedelta(days=1), time.min, tzinfo=timezone.utc),
+    )
+
+
+def get_mascara_intervalo(deslocamento: timedelta, duracao: timedelta) -> int:
+    """Bits de [deslocamento, deslocamento + duracao) a partir da meia-noite."""
+    primeira = deslocamento // UNIDADE
+    quantidade = -(-duracao // UNIDADE)
+    return (((1 << quantidade) - 1) << primeira) & DIA_INTEIRO
+
+
+def get_mascara(data_horario: datetime, duracao: timedelta = DURACAO_AGENDAMENTO):
+    """Bits de [data_horario, data_horario + duracao) no dia de data_horario."""
+    data_horario = data_horario.astimezone(timezone.utc)
+    meia_noite = datetime.combine(data_horario.date(), time.min, tzinfo=timezone.utc)
+    return get_mascara_intervalo(data_horario - meia_noite, duracao)
+
+
+def para_bytes(mascara: int) -> bytes:
+    return mascara.to_bytes(BYTES_POR_DIA, "big")
+
+
+def de_bytes(valor) -> int:
+    return int.from_bytes(bytes(valor), "big")
+
+
+class ConflitoHorario(IntegrityError):
+    """O agendamento confirmado se sobrepõe a outro do mesmo prestador."""
+
+
+def _mascaras_agendamentos(**filtros):
+    """
+    (id, prestador_id, dia, mascara) de cada agendamento confirmado, em uma
+    consulta; cada um ocupa a duração do seu serviço.
+    """
+    agendamentos = Agendamento.objects.filter(
+        states="CONF", cancelado=False, **filtros
+    ).values_list("id", "prestador_id", "data_horario", "servico__duracao")
+    for agendamento_id, prestador_id, data_horario, duracao in agendamentos:
+        yield (
+            agendamento_id,
+            prestador_id,
+            get_dia(data_horario),
+            get_mascara(data_horario, duracao),
+        )
+
+
+def calcula_ocupacao(**filtros) -> dict:
+    """
+    Calcula a ocupação a partir dos agendamentos, em uma consulta. Retorna
+    {(prestador_id, dia): mascara}.
+    """
+    mascaras = {}
+    for _, prestador_id, dia, mascara in _mascaras_agendamentos(**filtros):
+        mascaras[(prestador_id, dia)] = mascaras.get((prestador_id, dia), 0) | mascara
+    return mascaras
+
+
+def atualiza_ocupacao(
+    prestador_id: int, dia: date, agendamento_id: int = None, cria: bool = True
+):
+    """
+    Recalcula a ocupação do prestador no dia. A linha é travada antes da
+    leitura dos agendamentos, então duas transações que alteram o mesmo dia
+    gravam uma depois da outra e a segunda já vê os agendamentos da primeira.
+
+    Com agendamento_id, levanta ConflitoHorario se o intervalo desse
+    agendamento se sobrepõe ao de outro agendamento do prestador no dia.
+    Com cria=False (agendamento apagado, que só libera horários), um dia sem
+    linha fica sem linha: o prestador pode estar sendo apagado em cascata.
+    """
+    inicio, fim = get_intervalo_utc(dia, dia)
+    with transaction.atomic(savepoint=False):
+        if cria:
+            OcupacaoDia.objects.bulk_create(
+                [OcupacaoDia(prestador_id=prestador_id, dia=dia)],
+                ignore_conflicts=True,
+            )
+        ocupacao = (
+            OcupacaoDia.objects.select_for_update()
+            .filter(prestador_id=prestador_id, dia=dia)
+            .first()
+        )
+        if ocupacao is None:
+            return
+        outros = agendamento = 0
+        for id_, _, _, mascara in _mascaras_agendamentos(
+            prestador_id=prestador_id, data_horario__gte=inicio, data_horario__lt=fim
+        ):
+            if id_ == agendamento_id:
+                agendamento = mascara
+            else:
+                outros |= mascara
+        if agendamento & outros:
+            raise ConflitoHorario(
+                f"Agendamento {agendamento_id} se sobrepõe a outro do prestador"
+            )
+        ocupacao.ocupados = para_bytes(outros | agendamento)
+        ocupacao.save(update_fields=["ocupados"])
+
+
+def reserva_ocupacao(intervalos):
+    """
+    Marca na OcupacaoDia os intervalos [(prestador_id, data_horario, duracao)]
+    de agendamentos confirmados que serão gravados sem os sinais (como com
+    bulk_create), na mesma transação. As linhas dos dias são travadas antes
+    da verificação; se algum intervalo se sobrepõe à ocupação gravada ou a
+    outro da lista, levanta ConflitoHorario.
+    """
+    mascaras = {}
+    for prestador_id, data_horario, duracao in intervalos:
+        chave = (prestador_id, get_dia(data_horario))
+        mascara = get_mascara(data_horario, duracao)
+        if mascaras.get(chave, 0) & mascara:
+            raise ConflitoHorario(f"Horários sobrepostos para o prestador {chave}")
+        mascaras[chave] = mascaras.get(chave, 0) | mascara
+    if not mascaras:
+        return
+
+    with transaction.atomic(savepoint=False):
+        OcupacaoDia.objects.bulk_create(
+            [OcupacaoDia(prestador_id=p, dia=dia) for p, dia in mascaras],
+            ignore_conflicts=True,
+        )
+        linhas = OcupacaoDia.objects.select_for_update().filter(
+            prestador_id__in={p for p, _ in mascaras},
+            dia__in={dia for _, dia in mascaras},
+        )
+        alteradas = []
+        for ocupacao in linhas:
+            mascara = mascaras.get((ocupacao.prestador_id, ocupacao.dia))
+            if mascara is None:
+                continue
+            ocupados = de_bytes(ocupacao.ocupados)
+            if ocupados & mascara:
+                raise ConflitoHorario(
+                    f"Horários sobrepostos para o prestador {ocupacao.prestador_id}"
+                )
+            ocupacao.ocupados = para_bytes(ocupados | mascara)
+            alteradas.append(ocupacao)
+        OcupacaoDia.objects.bulk_update(alteradas, ["ocupados"])
+
+
+def get_ocupacao_por_dia(inicio: date, fim: date) -> dict:
+    """
+    Horários ocupados por qualquer prestador em cada dia de inicio a fim,
+    lidos da OcupacaoDia em uma consulta. Retorna {dia: mascara}.
+    """
+    mascaras = {}
+    linhas = OcupacaoDia.objects.filter(dia__gte=inicio, dia__lte=fim).values_list(
+        "dia", "ocupados"
+    )
+    for dia, ocupados in linhas:
+        mascaras[dia] = mascaras.get(dia, 0) | de_bytes(ocupados)
+    return mascaras
+
+
+def get_ocupacao(inicio: date, fim: date, prestador_ids) -> dict:
+    """
+    Horários ocupados de cada prestador em cada dia de inicio a fim, lidos da
+    OcupacaoDia em uma consulta. Retorna {(prestador_id, dia): mascara}; dias
+    sem linha estão livres.
+    """
+    linhas = OcupacaoDia.objects.filter(
+        prestador_id__in=prestador_ids, dia__gte=inicio, dia__lte=fim
+    ).values_list("prestador_id", "dia", "ocupados")
+    return {
+        (prestador_id, dia): de_bytes(ocupados)
+        for prestador_id, dia, ocupados in linhas
+    }
+
+
+def _filtros_periodo(inicio: date = None, fim: date = None):
+    agendamentos, ocupacoes = {}, {}
+    if inicio:
+        agendamentos["data_horario__gte"] = get_intervalo_utc(inicio, inicio)[0]
+        ocupacoes["dia__gte"] = inicio
+    if fim:
+        agendamentos["data_horario__lt"] = get_intervalo_utc(fim, fim)[1]
+        ocupacoes["dia__lte"] = fim
+    return agendamentos, ocupacoes
+
+
+def reconstroi_ocupacao(inicio: date = None, fim: date = None) -> int:
+    """
+    Apaga e recalcula a ocupação dos dias de inicio a fim (por padrão, de
+    todos) a partir dos agendamentos e descarta do cache os horários
+    disponíveis dos dias alterados. Retorna o número de linhas gravadas.
+    """
+    # agenda.utils importa este módulo
+    from agenda.utils import invalida_horarios
+
+    filtros_agendamentos, filtros_ocupacoes = _filtros_periodo(inicio, fim)
+    with transaction.atomic():
+        mascaras = calcula_ocupacao(**filtros_agendamentos)
+        ocupacoes = OcupacaoDia.objects.filter(**filtros_ocupacoes)
+        dias = set(ocupacoes.values_list("prestador_id", "dia")) | mascaras.keys()
+        ocupacoes.delete()
+        OcupacaoDia.objects.bulk_create(
+            [
+                OcupacaoDia(prestador_id=prestador_id, dia=dia, ocupados=para_bytes(m))
+                for (prestador_id, dia), m in mascaras.items()
+            ],
+            batch_size=1000,
+        )
+        invalida_horarios(
+            *[
+                (prestador_id, get_intervalo_utc(dia, dia)[0])
+                for prestador_id, dia in dias
+            ]
+        )
+    return len(mascaras)
+
+
+def verifica_ocupacao(inicio: date = None, fim: date = None) -> list:
+    """
+    Compara a OcupacaoDia com a ocupação calculada dos agendamentos. Retorna
+    [(prestador_id, dia, esperado, gravado)] das linhas divergentes.
+    """
+    filtros_agendamentos, filtros_ocupacoes = _filtros_periodo(inicio, fim)
+    esperadas = calcula_ocupacao(**filtros_agendamentos)
+    gravadas = {
+        (prestador_id, dia): de_bytes(ocupados)
+        for prestador_id, dia, ocupados in OcupacaoDia.objects.filter(
+            **filtros_ocupacoes
+        ).values_list("prestador_id", "dia", "ocupados")
+    }
+    divergencias = []
+    for prestador_id, dia in sorted(esperadas.keys() | gravadas.keys()):
+        esperado = esperadas.get((prestador_id, dia), 0)
+        gravado = gravadas.get((prestador_id, dia), 0)
+        if esperado != gravado:
+            divergencias.append((prestador_id, dia, esperado, gravado))
+    return divergencias
@@ -0,0 +1,93 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class PaginacaoCursor(CursorPagination):
+    """
+    Paginação por cursor (keyset): cada página é buscada a partir da posição
+    da última linha da página anterior, então o custo não cresce com a
+    profundidade. O corpo da resposta continua sendo a lista de objetos; os
+    links para a próxima página e a anterior vão no cabeçalho Link.
+    """
+
+    page_size = 50
+    page_size_query_param = "tamanho"
+    max_page_size = 200
+    ordering = "id"
+
+    def get_paginated_response(self, data):
+        links = [
+            f'<{url}>; rel="{rel}"'
+            for rel, url in (
+                ("next", self.get_next_link()),
+                ("prev", self.get_previous_link()),
+            )
+            if url
+        ]
+        headers = {"Link": ", ".join(links)} if links else None
+        return Response(data, headers=headers)
+
+
+class PaginacaoAgendamentos(PaginacaoCursor):
+    """
+    Ordena por data_horario e, no mesmo horário, por id. O cursor do DRF
+    guarda só o primeiro campo da ordenação e pula por offset os empates, o
+    que volta para a página errada ao seguir o link "prev" no meio deles;
+    aqui a posição guarda o par (data_horario, id), que é único, e as páginas
+    são sempre buscadas a partir dele.
+    """
+
+    ordering = ("data_horario", "id")
+
+    def _get_position_from_instance(self, instance, ordering):
+        if not isinstance(instance, dict):
+            instance = vars(instance)
+        return f"{instance['data_horario'].isoformat()} {instance['id']}"
+
+    def _le_posicao(self, posicao):
+        data_horario, _, id = posicao.rpartition(" ")
+        try:
+            data_horario, id = parse_datetime(data_horario), int(id)
+        except ValueError:
+            data_horario = None
+        if data_horario is None:
+            raise NotFound(self.invalid_cursor_message)
+        return data_horario, id
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, posicao = self.cursor or (0, False, None)
+
+        if reverse:
+            queryset = queryset.order_by("-data_horario", "-id")
+            depois = "lt"
+        else:
+            queryset = queryset.order_by(*self.ordering)
+            depois = "gt"
+        if posicao is not None:
+            data_horario, id = self._le_posicao(posicao)
+            queryset = queryset.filter(
+                Q(**{f"data_horario__{depois}": data_horario})
+                | Q(data_horario=data_horario, **{f"id__{depois}": id})
+            )
+
+        resultados = list(queryset[offset : offset + self.page_size + 1])
+        self.page = resultados[: self.page_size]
+        seguinte = None
+        if len(resultados) > len(self.page):
+            seguinte = self._get_position_from_instance(resultados[-1], self.ordering)
+
+        anterior = posicao is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = anterior, seguinte is not None
+            self.next_position, self.previous_position = posicao, seguinte
+        else:
+            self.has_next, self.has_previous = seguinte is not None, anterior
+            self.next_position, self.previous_position = seguinte, posicao
+        return self.page
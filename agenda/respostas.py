@@ -0,0 +1,45 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+TAMANHO_BLOCO = 500
+
+
+def itera_linhas(queryset, campos, tamanho_bloco: int = TAMANHO_BLOCO):
+    """
+    Percorre o queryset em blocos de ``tamanho_bloco`` linhas, lendo apenas
+    as colunas em ``campos`` e devolvendo cada linha como dicionário, sem
+    guardar o resultado inteiro em memória.
+    """
+
+    return queryset.values(*campos).iterator(chunk_size=tamanho_bloco)
+
+
+class JsonEmFluxoResponse(StreamingHttpResponse):
+    """
+    Resposta com uma lista JSON codificada aos poucos, item a item, a partir
+    de um iterável. O uso de memória não depende do tamanho da lista e o
+    primeiro byte sai assim que o primeiro bloco fica pronto.
+    """
+
+    def __init__(
+        self,
+        itens,
+        encoder=DjangoJSONEncoder,
+        tamanho_bloco: int = TAMANHO_BLOCO,
+        **kwargs,
+    ):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(self._codifica(itens, encoder(), tamanho_bloco), **kwargs)
+
+    @staticmethod
+    def _codifica(itens, encoder, tamanho_bloco):
+        yield "["
+        bloco = []
+        separador = ""
+        for item in itens:
+            bloco.append(separador + encoder.encode(item))
+            separador = ","
+            if len(bloco) >= tamanho_bloco:
+                yield "".join(bloco)
+                bloco = []
+        yield "".join(bloco) + "]"
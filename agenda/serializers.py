@@ -16,7 +16,12 @@ from agenda.models import (
     Funcionarios,
     Servicos,
 )
-from agenda.utils import get_horarios_disponiveis, verifica_cep
+from agenda.utils import (
+    MapaIdentidade,
+    get_horarios_disponiveis,
+    get_intervalo_do_dia,
+    verifica_cep,
+)
 
 
 class AgendamentoSerializer(serializers.ModelSerializer):
@@ -28,17 +33,23 @@ class AgendamentoSerializer(serializers.ModelSerializer):
     estabelecimento = serializers.CharField()
     servico = serializers.CharField()
 
+    @property
+    def mapa_identidade(self):
+        if "mapa_identidade" not in self.context:
+            self.context["mapa_identidade"] = MapaIdentidade()
+        return self.context["mapa_identidade"]
+
     def validate_prestador(self, value):
         try:
-            prestador_obj = User.objects.get(username=value)
+            prestador_obj = self.mapa_identidade.get(User, username=value)
         except User.DoesNotExist:
             raise serializers.ValidationError("Username incorreto!")
         return prestador_obj
 
     def validate_estabelecimento(self, value):
         try:
-            estabelecimento_obj = Estabelecimento.objects.get(
-                nome_estabelecimento=value
+            estabelecimento_obj = self.mapa_identidade.get(
+                Estabelecimento, nome_estabelecimento=value
             )
         except ObjectDoesNotExist:
             raise serializers.ValidationError("Estabelecimento não encontrado!")
@@ -46,7 +57,7 @@ class AgendamentoSerializer(serializers.ModelSerializer):
 
     def validate_servico(self, value):
         try:
-            servico_obj = Servicos.objects.get(servico=value)
+            servico_obj = self.mapa_identidade.get(Servicos, servico=value)
         except ObjectDoesNotExist:
             raise serializers.ValidationError("Serviço não encontrado!")
         return servico_obj
@@ -56,8 +67,6 @@ class AgendamentoSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 "Agendamento não pode ser feito no passado!"
             )
-        if value not in get_horarios_disponiveis(value.date()):
-            raise serializers.ValidationError("Este horário não está disponível!")
 
         return value
 
@@ -70,25 +79,39 @@ class AgendamentoSerializer(serializers.ModelSerializer):
         estabelecimento = attrs.get("estabelecimento", "")
         servico = attrs.get("servico", "")
 
+        # A disponibilidade depende do prestador: só os agendamentos dele
+        # ocupam o horário, e o serviço precisa caber inteiro no expediente
+        # sem encostar em outro agendamento. Manter o horário atual do
+        # agendamento é permitido (a sobreposição é conferida ao gravar).
+        if data_horario and (prestador or self.instance):
+            prestador_id = prestador.id if prestador else self.instance.prestador_id
+            mantem_horario = self.instance is not None and (
+                self.instance.prestador_id,
+                self.instance.data_horario,
+            ) == (prestador_id, data_horario)
+            estabelecimento_id = (
+                estabelecimento.id
+                if estabelecimento
+                else getattr(self.instance, "estabelecimento_id", None)
+            )
+            duracao = servico.duracao if servico else self.instance.servico.duracao
+            if not mantem_horario and not self.horario_disponivel(
+                data_horario, prestador_id, estabelecimento_id, duracao
+            ):
+                raise serializers.ValidationError(
+                    {"data_horario": ["Este horário não está disponível!"]}
+                )
+
         if prestador and estabelecimento:
-            if not Funcionarios.objects.filter(
-                prestador__username=prestador,
-                estabelecimento=estabelecimento,
-                servico=servico,
-            ).exists():
+            if not self.atende_servico(prestador, estabelecimento, servico):
                 raise serializers.ValidationError(
                     "Funcionário, estabelecimento ou serviço não estão corretos ou não existem!"
                 )
 
-        if data_horario and email_cliente:
-            if Agendamento.objects.filter(
-                nome_cliente=nome_cliente,
-                email_cliente=email_cliente,
-                data_horario__date=data_horario,
-                prestador__username=prestador,
-                estabelecimento=estabelecimento,
-                cancelado=False,
-            ).exists():
+        if data_horario and email_cliente and prestador:
+            if self.cliente_agendado_no_dia(
+                nome_cliente, email_cliente, data_horario, prestador, estabelecimento
+            ):
                 raise serializers.ValidationError(
                     "Cada cliente pode ter apenas uma reverva por dia!"
                 )
@@ -104,6 +127,34 @@ class AgendamentoSerializer(serializers.ModelSerializer):
 
         return attrs
 
+    def horario_disponivel(
+        self, data_horario, prestador_id, estabelecimento_id, duracao
+    ) -> bool:
+        return data_horario in get_horarios_disponiveis(
+            data_horario.date(), prestador_id, estabelecimento_id, duracao
+        )
+
+    def atende_servico(self, prestador, estabelecimento, servico) -> bool:
+        return Funcionarios.objects.filter(
+            prestador=prestador,
+            estabelecimento=estabelecimento,
+            servico=servico,
+        ).exists()
+
+    def cliente_agendado_no_dia(
+        self, nome_cliente, email_cliente, data_horario, prestador, estabelecimento
+    ) -> bool:
+        inicio_dia, fim_dia = get_intervalo_do_dia(data_horario)
+        return Agendamento.objects.filter(
+            nome_cliente=nome_cliente,
+            email_cliente=email_cliente,
+            data_horario__gte=inicio_dia,
+            data_horario__lt=fim_dia,
+            prestador=prestador,
+            estabelecimento=estabelecimento,
+            cancelado=False,
+        ).exists()
+
     def validate_telefone_cliente(self, value):
         if len(value) < 8:
             raise serializers.ValidationError(
@@ -116,12 +167,38 @@ class AgendamentoSerializer(serializers.ModelSerializer):
         return value
 
 
+class AgendamentoLoteSerializer(AgendamentoSerializer):
+    """
+    Valida um item de POST /agendamentos/batch/. As consultas de cada item
+    são respondidas pelo ContextoLote em `context["lote"]`, carregado uma vez
+    para o lote inteiro (ver agenda/lote.py).
+    """
+
+    def horario_disponivel(self, *args) -> bool:
+        return self.context["lote"].horario_disponivel(*args)
+
+    def atende_servico(self, *args) -> bool:
+        return self.context["lote"].atende_servico(*args)
+
+    def cliente_agendado_no_dia(self, *args) -> bool:
+        return self.context["lote"].cliente_agendado_no_dia(*args)
+
+
 class PrestadorSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["id", "username", "agendamentos"]
 
-    agendamentos = AgendamentoSerializer(many=True, read_only=True)
+    agendamentos = serializers.SerializerMethodField()
+
+    def get_agendamentos(self, obj):
+        # Usa os agendamentos pré-carregados pela view; `limite_agendamentos`
+        # no contexto restringe a lista aos N primeiros.
+        agendamentos = obj.agendamentos.all()
+        limite = self.context.get("limite_agendamentos")
+        if limite:
+            agendamentos = agendamentos[:limite]
+        return AgendamentoSerializer(agendamentos, many=True, context=self.context).data
 
 
 class FidelidadeSerializer(serializers.ModelSerializer):
@@ -341,3 +418,67 @@ class EnderecoSerializer(serializers.ModelSerializer):
             attrs["street"] = verifica_rua
 
         return attrs
+
+
+class SerializerLeitura:
+    """
+    Serializer somente leitura para listagens. Lê apenas as colunas usadas
+    com values(), já com os nomes das chaves estrangeiras por join, e converte
+    cada linha com os campos de `serializer_class`, então a saída é a mesma
+    do serializer completo sem instanciar um modelo por linha.
+    """
+
+    serializer_class = None
+    # Caminho no values() dos campos de saída que não são colunas do modelo
+    origens = {}
+    # Colunas lidas além dos campos de saída (ex.: a ordenação da paginação)
+    colunas_extras = ("id",)
+
+    _campos = None
+
+    def __init__(self, linhas, many=True, **kwargs):
+        self.linhas = linhas
+
+    @classmethod
+    def get_campos(cls):
+        if cls._campos is None:
+            cls._campos = [
+                (nome, cls.origens.get(nome, nome), campo.to_representation)
+                for nome, campo in cls.serializer_class().fields.items()
+                if not campo.write_only
+            ]
+        return cls._campos
+
+    @classmethod
+    def prepara(cls, queryset):
+        colunas = [origem for _, origem, _ in cls.get_campos()]
+        colunas += [coluna for coluna in cls.colunas_extras if coluna not in colunas]
+        return queryset.values(*colunas)
+
+    @property
+    def data(self):
+        campos = self.get_campos()
+        return [
+            {
+                nome: None if linha[origem] is None else converte(linha[origem])
+                for nome, origem, converte in campos
+            }
+            for linha in self.linhas
+        ]
+
+
+class AgendamentoLeitura(SerializerLeitura):
+    serializer_class = AgendamentoSerializer
+    origens = {
+        "prestador": "prestador__username",
+        "estabelecimento": "estabelecimento__nome_estabelecimento",
+        "servico": "servico__servico",
+    }
+
+
+class FidelidadeLeitura(SerializerLeitura):
+    serializer_class = FidelidadeSerializer
+
+
+class ServicosLeitura(SerializerLeitura):
+    serializer_class = ServicosSerializer
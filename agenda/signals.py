@@ -0,0 +1,84 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from agenda.expediente import regras_alteradas
+from agenda.models import (
+    Agendamento,
+    Endereco,
+    Estabelecimento,
+    HorarioFuncionamento,
+    Servicos,
+)
+from agenda.ocupacao import atualiza_ocupacao, get_dia
+from agenda.utils import incrementa_versao_catalogo, invalida_horarios
+
+
+@receiver(post_save, sender=Servicos)
+@receiver(post_delete, sender=Servicos)
+@receiver(post_save, sender=Estabelecimento)
+@receiver(post_delete, sender=Estabelecimento)
+@receiver(post_save, sender=Endereco)
+@receiver(post_delete, sender=Endereco)
+def catalogo_alterado(sender, **kwargs):
+    # update() e bulk_create() não disparam esses sinais; quem alterar o
+    # catálogo em massa deve chamar incrementa_versao_catalogo diretamente.
+    incrementa_versao_catalogo(sender._meta.model_name)
+
+
+def _estado_agendamento(instance):
+    # Usa __dict__ para não carregar campos adiados por only()/defer().
+    campos = instance.__dict__
+    return (
+        campos.get("prestador_id"),
+        campos.get("data_horario"),
+        campos.get("states") == "CONF" and not campos.get("cancelado"),
+        campos.get("servico_id"),
+    )
+
+
+@receiver(post_init, sender=Agendamento)
+def guarda_estado_original(sender, instance, **kwargs):
+    # Guarda o estado carregado para atualizar também o dia antigo quando o
+    # agendamento for remarcado ou trocar de prestador.
+    instance._estado_original = _estado_agendamento(instance)
+
+
+@receiver(post_save, sender=Agendamento)
+@receiver(post_delete, sender=Agendamento)
+def agendamento_alterado(sender, instance, **kwargs):
+    # Criar, confirmar, remarcar ou cancelar muda os horários disponíveis do
+    # dia. Assim como no catálogo, update() em massa precisa chamar
+    # invalida_horarios e atualiza_ocupacao (ou reconstroi_ocupacao)
+    # diretamente.
+    original = instance._estado_original
+    atual = _estado_agendamento(instance)
+    instance._estado_original = atual
+
+    invalida_horarios(original[:2], atual[:2])
+
+    if kwargs.get("created") is False and original == atual:
+        return
+    dias = {
+        (prestador_id, get_dia(data_horario))
+        for prestador_id, data_horario, ocupa, _ in (original, atual)
+        if ocupa and data_horario is not None
+    }
+    apagado = kwargs["signal"] is post_delete
+    for prestador_id, dia in dias:
+        if apagado:
+            # Na exclusão em cascata de um prestador, a ocupação dele também
+            # é apagada; recriá-la quebraria a chave estrangeira.
+            atualiza_ocupacao(prestador_id, dia, cria=False)
+        elif atual[2] and (prestador_id, dia) == (atual[0], get_dia(atual[1])):
+            # Só o dia em que o agendamento passa a ocupar é verificado quanto
+            # a sobreposições; ConflitoHorario desfaz o save (ver
+            # salva_agendamento).
+            atualiza_ocupacao(prestador_id, dia, instance.id)
+        else:
+            atualiza_ocupacao(prestador_id, dia)
+
+
+@receiver(post_save, sender=HorarioFuncionamento)
+@receiver(post_delete, sender=HorarioFuncionamento)
+def expediente_alterado(sender, **kwargs):
+    regras_alteradas()
@@ -1,14 +1,99 @@
+import base64
 import json
-from datetime import datetime, timezone
+import re
+import threading
+import time
+import warnings
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
 from unittest import mock
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.utils.timezone import now
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient, APITestCase
 
-from agenda.models import Agendamento, Estabelecimento, Funcionarios, Servicos
+from agenda import expediente
+from agenda import idempotencia
+from agenda import lote as lote_lib
+from agenda import ocupacao as ocupacao_lib
+from agenda import utils
+from agenda.libs import brasil_api
+from agenda.libs.cache import CacheLRU, ChamadaUnica
+from agenda.libs.cliente_brasil_api import BrasilAPIIndisponivel, ClienteBrasilAPI
+from agenda.models import (
+    Agendamento,
+    CalendarioFeriados,
+    Estabelecimento,
+    Fidelidade,
+    Funcionarios,
+    HorarioFuncionamento,
+    OcupacaoDia,
+    RespostaIdempotente,
+    Servicos,
+)
+from agenda.respostas import JsonEmFluxoResponse
+from agenda.serializers import (
+    AgendamentoSerializer,
+    FidelidadeSerializer,
+    ServicosSerializer,
+)
+from agenda.utils import (
+    AcumuladorFidelidade,
+    get_horarios_disponiveis,
+    get_intervalo_do_dia,
+    registra_fidelidade,
+)
 
 # Create your tests here.
 
 
+class DadosAgendamentoMixin:
+    """
+    A prestadora silvia, que atende Manicure no Salão de Beleza, e
+    `cria_agendamento` para agendar com ela (os campos podem ser trocados).
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(
+            email="silvia@email.com", username="silvia", password="123"
+        )
+        self.servico = Servicos.objects.create(servico="Manicure")
+        self.estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        Funcionarios.objects.create(
+            prestador=self.user,
+            estabelecimento=self.estabelecimento,
+            servico=self.servico,
+        )
+
+    def cria_agendamento(self, data_horario, **campos):
+        return Agendamento.objects.create(
+            **{
+                "prestador": self.user,
+                "estabelecimento": self.estabelecimento,
+                "servico": self.servico,
+                "data_horario": data_horario,
+                "nome_cliente": "Virginia",
+                "email_cliente": "virginia@email.com",
+                "telefone_cliente": "123123123",
+                **campos,
+            }
+        )
+
+
 class TestPermissoes(APITestCase):
     def test_retorna_false_has_permission(self):
         user = User.objects.create(
@@ -277,6 +362,141 @@ class TestListagemAgendamentos(APITestCase):
         self.assertDictEqual(data[0], agendamento_serializado)
 
 
+class TestListagemRapida(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email="silvia@email.com", username="silvia", password="123"
+        )
+        self.client.force_authenticate(self.user)
+        estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        for nome in ["Manicure", "Pedicure"]:
+            servico = Servicos.objects.create(servico=nome)
+            for hora in [9, 15]:
+                Agendamento.objects.create(
+                    prestador=self.user,
+                    estabelecimento=estabelecimento,
+                    servico=servico,
+                    data_horario=datetime(2030, 1, 9, hora, tzinfo=timezone.utc),
+                    nome_cliente=f"Cliente {nome}",
+                    email_cliente="cliente@email.com",
+                    telefone_cliente="123123123",
+                )
+            Fidelidade.objects.create(
+                nome_cliente=f"Cliente {nome}", prestador=self.user, nivel_fidelidade=2
+            )
+
+    def test_saida_igual_a_do_serializer_do_modelo(self):
+        casos = [
+            (
+                "/api/agendamentos/?username=silvia",
+                AgendamentoSerializer,
+                Agendamento.objects.order_by("data_horario", "id"),
+            ),
+            (
+                "/api/fidelidade/?username=silvia",
+                FidelidadeSerializer,
+                Fidelidade.objects.order_by("id"),
+            ),
+            ("/api/servicos/", ServicosSerializer, Servicos.objects.order_by("id")),
+        ]
+        # A versão do catálogo usada no ETag de /api/servicos/ já fica em cache
+        utils.get_versoes_catalogo(["servicos"])
+        for url, serializer_class, queryset in casos:
+            with self.subTest(url=url), self.assertNumQueries(1):
+                response = self.client.get(url)
+            esperado = serializer_class(queryset, many=True).data
+            self.assertEqual(response.content, JSONRenderer().render(esperado))
+
+
+class TestPaginacaoAgendamentos(APITestCase):
+    def test_listagem_e_paginada_por_cursor(self):
+        user = User.objects.create(
+            email="silvia@email.com", username="silvia", password="123"
+        )
+        self.client.force_authenticate(user)
+        servico = Servicos.objects.create(servico="Manicure")
+        estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        for hora in [17, 9, 15]:
+            Agendamento.objects.create(
+                prestador=user,
+                estabelecimento=estabelecimento,
+                servico=servico,
+                data_horario=datetime(2030, 1, 9, hora, tzinfo=timezone.utc),
+                nome_cliente="Virginia",
+                email_cliente="virginia@email.com",
+                telefone_cliente="123123123",
+            )
+
+        response = self.client.get("/api/agendamentos/?username=silvia&tamanho=2")
+        data = json.loads(response.content)
+
+        self.assertEqual(
+            [agendamento["data_horario"] for agendamento in data],
+            ["2030-01-09T09:00:00Z", "2030-01-09T15:00:00Z"],
+        )
+        proxima_pagina = re.search(r'<([^>]+)>; rel="next"', response["Link"])
+
+        response = self.client.get(proxima_pagina.group(1))
+        data = json.loads(response.content)
+
+        self.assertEqual(
+            [agendamento["data_horario"] for agendamento in data],
+            ["2030-01-09T17:00:00Z"],
+        )
+        self.assertIn('rel="prev"', response["Link"])
+        self.assertNotIn('rel="next"', response["Link"])
+
+    def test_agendamentos_no_mesmo_horario_atravessam_paginas(self):
+        user = User.objects.create(
+            email="silvia@email.com", username="silvia", password="123"
+        )
+        self.client.force_authenticate(user)
+        servico = Servicos.objects.create(servico="Manicure")
+        estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        ids = [
+            Agendamento.objects.create(
+                prestador=user,
+                estabelecimento=estabelecimento,
+                servico=servico,
+                data_horario=datetime(2030, 1, 9, 9, tzinfo=timezone.utc),
+                nome_cliente=f"Cliente {n}",
+                email_cliente=f"cliente{n}@email.com",
+                telefone_cliente="123123123",
+            ).id
+            for n in range(7)
+        ]
+
+        paginas = []
+        url = "/api/agendamentos/?username=silvia&tamanho=3"
+        while url:
+            response = self.client.get(url)
+            paginas.append([agendamento["id"] for agendamento in response.json()])
+            proxima_pagina = re.search(
+                r'<([^>]+)>; rel="next"', response.get("Link", "")
+            )
+            url = proxima_pagina and proxima_pagina.group(1)
+
+        self.assertEqual(paginas, [ids[0:3], ids[3:6], ids[6:7]])
+
+        anterior = re.search(r'<([^>]+)>; rel="prev"', response["Link"])
+        response = self.client.get(anterior.group(1))
+        self.assertEqual(
+            [agendamento["id"] for agendamento in response.json()], ids[3:6]
+        )
+
+        cursor = base64.b64encode(b"p=2030-01-09").decode()
+        response = self.client.get(
+            f"/api/agendamentos/?username=silvia&cursor={cursor}"
+        )
+        self.assertEqual(response.status_code, 404)
+
+
 class TestCriacaoAgendamento(APITestCase):
     def test_cria_agendamento(self):
         user = User.objects.create(
@@ -472,6 +692,14 @@ class TestCriacaoAgendamento(APITestCase):
         self.assertEqual(response.status_code, 400)
         self.assertDictEqual(data, resposta_agendamento)
 
+    def test_intervalo_do_dia_e_meio_aberto(self):
+        inicio, fim = get_intervalo_do_dia(
+            datetime(2030, 1, 9, 17, 30, tzinfo=timezone.utc)
+        )
+
+        self.assertEqual(inicio, datetime(2030, 1, 9, tzinfo=timezone.utc))
+        self.assertEqual(fim, datetime(2030, 1, 10, tzinfo=timezone.utc))
+
     def test_email_brasileiro_deve_estar_associado_a_numero_brasilerio(self):
         user = User.objects.create(
             email="silvia@email.com", username="silvia", password="123"
@@ -838,7 +1066,75 @@ class TestListagemPrestadores(APITestCase):
         self.assertEqual("maria@email.com", prestador_criado.email)
 
 
+class TestListagemPrestadoresComAgendamentos(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create(
+            email="admin@email.com", username="admin", password="123", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        servico = Servicos.objects.create(servico="Manicure")
+        estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        for username in ["maria", "silvia", "ana"]:
+            user = User.objects.create(
+                email=f"{username}@email.com", username=username, password="123"
+            )
+            for dia, cancelado in [(8, False), (9, True), (10, False), (11, False)]:
+                Agendamento.objects.create(
+                    prestador=user,
+                    estabelecimento=estabelecimento,
+                    servico=servico,
+                    data_horario=datetime(2030, 1, dia, 15, tzinfo=timezone.utc),
+                    nome_cliente="Virginia",
+                    email_cliente="virginia@email.com",
+                    telefone_cliente="123123123",
+                    cancelado=cancelado,
+                )
+
+    def test_lista_agendamentos_da_janela_com_duas_consultas(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/api/prestadores/?inicio=2030-01-09&fim=2030-01-12"
+            )
+        data = json.loads(response.content)
+
+        self.assertEqual(
+            [p["username"] for p in data], ["admin", "maria", "silvia", "ana"]
+        )
+        self.assertEqual(data[0]["agendamentos"], [])
+        self.assertEqual(
+            [a["data_horario"] for a in data[1]["agendamentos"]],
+            ["2030-01-10T15:00:00Z", "2030-01-11T15:00:00Z"],
+        )
+        self.assertEqual(
+            data[1]["agendamentos"][0]["estabelecimento"], "Salão de Beleza"
+        )
+
+    def test_lista_apenas_os_proximos_agendamentos(self):
+        response = self.client.get(
+            "/api/prestadores/?inicio=2030-01-01&proximos=1&tamanho=2"
+        )
+        data = json.loads(response.content)
+
+        self.assertEqual(len(data), 2)
+        self.assertIn('rel="next"', response["Link"])
+        self.assertEqual(
+            [a["data_horario"] for a in data[1]["agendamentos"]],
+            ["2030-01-08T15:00:00Z"],
+        )
+
+    def test_proximos_invalido_retorna_400(self):
+        for proximos in ["-1", "101", "um"]:
+            response = self.client.get(f"/api/prestadores/?proximos={proximos}")
+
+            self.assertEqual(response.status_code, 400)
+
+
 class TestGetHorarios(APITestCase):
+    def setUp(self):
+        cache.clear()
+
     @mock.patch("agenda.libs.brasil_api.is_feriado", return_value=True)
     def test_quando_data_e_feriado_retorna_lista_vazia(self, _):
         response = self.client.get("/api/horarios/?data=2022-04-15")
@@ -855,6 +1151,705 @@ class TestGetHorarios(APITestCase):
         self.assertEqual(data[0], "2022-12-20T09:00:00Z")
         self.assertEqual(data[-1], "2022-12-20T17:30:00Z")
 
+    @mock.patch("agenda.libs.brasil_api.is_feriado", return_value=False)
+    def test_horarios_do_dia_sao_calculados_com_uma_consulta(self, _):
+        user = User.objects.create(
+            email="silvia@email.com", username="silvia", password="123"
+        )
+        servico = Servicos.objects.create(servico="Manicure")
+        estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        Agendamento.objects.create(
+            prestador=user,
+            estabelecimento=estabelecimento,
+            servico=servico,
+            data_horario=datetime(2022, 12, 20, 10, tzinfo=timezone.utc),
+            nome_cliente="Virginia",
+            email_cliente="virginia@email.com",
+            telefone_cliente="123123123",
+            states="CONF",
+        )
+
+        with self.assertNumQueries(1):
+            horarios = get_horarios_disponiveis(date(2022, 12, 20))
+
+        self.assertEqual(len(horarios), 15)
+        self.assertNotIn(datetime(2022, 12, 20, 10, tzinfo=timezone.utc), horarios)
+        self.assertNotIn(datetime(2022, 12, 20, 12, tzinfo=timezone.utc), horarios)
+
+    @mock.patch("agenda.libs.brasil_api.is_feriado", return_value=False)
+    def test_sabado_encerra_as_treze_horas(self, _):
+        horarios = get_horarios_disponiveis(date(2022, 12, 24))
+
+        self.assertEqual(horarios[0], datetime(2022, 12, 24, 9, tzinfo=timezone.utc))
+        self.assertEqual(
+            horarios[-1], datetime(2022, 12, 24, 12, 30, tzinfo=timezone.utc)
+        )
+        self.assertEqual(len(horarios), 8)
+
+    @mock.patch("agenda.libs.brasil_api.get_feriados")
+    def test_periodo_agrupa_horarios_por_data(self, get_feriados):
+        get_feriados.return_value = {date(2022, 12, 25), date(2023, 1, 1)}
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/api/horarios/?inicio=2022-12-24&fim=2023-01-02"
+            )
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data), 10)
+        self.assertEqual(len(data["2022-12-24"]), 8)
+        self.assertEqual(data["2022-12-25"], [])
+        self.assertEqual(data["2022-12-26"][0], "2022-12-26T09:00:00Z")
+        self.assertEqual(data["2023-01-01"], [])
+        self.assertEqual(get_feriados.call_count, 2)
+
+    @mock.patch("agenda.libs.brasil_api.get_feriados", return_value=set())
+    def test_periodo_por_quantidade_de_dias(self, _):
+        response = self.client.get("/api/horarios/?inicio=2022-12-20&dias=7")
+        data = json.loads(response.content)
+
+        self.assertEqual(list(data)[0], "2022-12-20")
+        self.assertEqual(list(data)[-1], "2022-12-26")
+
+    def test_periodo_maior_que_o_limite_retorna_400(self):
+        response = self.client.get("/api/horarios/?inicio=2022-01-01&fim=2022-12-31")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_quantidade_de_dias_invalida_retorna_400(self):
+        for dias in ["0", "99999999999", "9999-12-31"]:
+            response = self.client.get(f"/api/horarios/?inicio=2022-01-01&dias={dias}")
+
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.get("/api/horarios/?inicio=9999-12-31&dias=2")
+        self.assertEqual(response.status_code, 400)
+
+
+class TestCacheHorarios(DadosAgendamentoMixin, APITestCase):
+    def get_horarios(self, data):
+        return json.loads(self.client.get(f"/api/horarios/?data={data}").content)
+
+    def test_segunda_consulta_vem_do_cache(self):
+        self.client.get("/api/horarios/?inicio=2030-01-07&dias=3")
+        self.client.get("/api/horarios/?data=2030-01-08")
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/horarios/?inicio=2030-01-07&dias=3")
+        with self.assertNumQueries(0):
+            self.client.get("/api/horarios/?data=2030-01-08")
+
+        self.assertEqual(response["Cache-Control"], "public, max-age=15")
+
+    def test_confirmar_e_cancelar_invalidam_o_dia(self):
+        self.assertIn("2030-01-08T10:00:00Z", self.get_horarios("2030-01-08"))
+
+        agendamento = self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc), states="CONF"
+        )
+        self.assertNotIn("2030-01-08T10:00:00Z", self.get_horarios("2030-01-08"))
+
+        agendamento.cancelado = True
+        agendamento.save()
+        self.assertIn("2030-01-08T10:00:00Z", self.get_horarios("2030-01-08"))
+
+    def test_remarcar_invalida_o_dia_antigo_e_o_novo(self):
+        agendamento = self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc), states="CONF"
+        )
+        self.assertNotIn("2030-01-08T10:00:00Z", self.get_horarios("2030-01-08"))
+        self.assertIn("2030-01-09T10:00:00Z", self.get_horarios("2030-01-09"))
+
+        agendamento = Agendamento.objects.get(id=agendamento.id)
+        agendamento.data_horario = datetime(2030, 1, 9, 10, tzinfo=timezone.utc)
+        agendamento.save()
+
+        self.assertIn("2030-01-08T10:00:00Z", self.get_horarios("2030-01-08"))
+        self.assertNotIn("2030-01-09T10:00:00Z", self.get_horarios("2030-01-09"))
+
+    def test_reconstroi_ocupacao_invalida_os_dias(self):
+        agendamento = self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc), states="CONF"
+        )
+        self.assertNotIn("2030-01-08T10:00:00Z", self.get_horarios("2030-01-08"))
+
+        # update() não dispara os sinais; quem corrige é reconstroi_ocupacao
+        Agendamento.objects.filter(id=agendamento.id).update(cancelado=True)
+        self.assertNotIn("2030-01-08T10:00:00Z", self.get_horarios("2030-01-08"))
+
+        ocupacao_lib.reconstroi_ocupacao()
+        self.assertIn("2030-01-08T10:00:00Z", self.get_horarios("2030-01-08"))
+
+    def test_cancelamento_desfeito_se_a_ocupacao_falha(self):
+        agendamento = self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc), states="CONF"
+        )
+        self.client.force_authenticate(self.user)
+
+        with mock.patch(
+            "agenda.signals.atualiza_ocupacao", side_effect=OperationalError
+        ):
+            with self.assertRaises(OperationalError):
+                self.client.delete(f"/api/agendamentos/{agendamento.id}/")
+
+        agendamento.refresh_from_db()
+        self.assertFalse(agendamento.cancelado)
+
+
+@override_settings(CACHES={"default": settings.CACHES["banco"]})
+class TestCacheHorariosNoBanco(DadosAgendamentoMixin, APITestCase):
+    """/api/horarios/ com o cache de produção sem REDIS_URL (no banco)."""
+
+    def setUp(self):
+        super().setUp()
+        for n in range(4):
+            Funcionarios.objects.create(
+                prestador=User.objects.create(
+                    email=f"prestador{n}@email.com", username=f"prestador{n}"
+                ),
+                estabelecimento=self.estabelecimento,
+                servico=self.servico,
+            )
+        brasil_api.get_feriados(2030)
+        expediente.limpa_cache_modelos()
+        self.addCleanup(expediente.limpa_cache_modelos)
+
+    def test_periodo_usa_poucas_consultas_ao_cache(self):
+        url = "/api/horarios/?estabelecimento=Salão de Beleza&inicio=2030-01-07&dias=62"
+        with CaptureQueriesContext(connection) as primeira:
+            self.client.get(url)
+        # Funcionarios, as versões dos prestadores e a entrada do período
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(primeira), 50)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM agenda_cache")
+            # Uma versão por prestador, a das regras de expediente e uma
+            # entrada para os 62 dias
+            self.assertEqual(cursor.fetchone()[0], 7)
+
+
+class TestOcupacaoDia(DadosAgendamentoMixin, APITestCase):
+    def get_ocupados(self, dia=date(2030, 1, 8)):
+        ocupacao = OcupacaoDia.objects.filter(prestador=self.user, dia=dia).first()
+        return ocupacao and ocupacao_lib.de_bytes(ocupacao.ocupados)
+
+    def test_mascara_do_agendamento(self):
+        mascara = ocupacao_lib.get_mascara(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc)
+        )
+        self.assertEqual(mascara, 0b111111 << 120)
+
+    def test_apagar_prestador_com_agendamento_confirmado(self):
+        self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc), states="CONF"
+        )
+
+        self.user.delete()
+
+        # O SQLite só verifica as chaves estrangeiras no commit
+        connection.check_constraints()
+        self.assertFalse(Agendamento.objects.exists())
+        self.assertFalse(OcupacaoDia.objects.exists())
+
+    def test_acompanha_confirmacao_remarcacao_e_cancelamento(self):
+        agendamento = self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc)
+        )
+        self.assertIsNone(self.get_ocupados())
+
+        agendamento.states = "CONF"
+        agendamento.save()
+        self.assertEqual(self.get_ocupados(), 0b111111 << 120)
+
+        agendamento.data_horario = datetime(2030, 1, 9, 15, tzinfo=timezone.utc)
+        agendamento.save()
+        self.assertEqual(self.get_ocupados(), 0)
+        self.assertEqual(self.get_ocupados(date(2030, 1, 9)), 0b111111 << 180)
+
+        agendamento.cancelado = True
+        agendamento.save()
+        self.assertEqual(self.get_ocupados(date(2030, 1, 9)), 0)
+
+    def test_horarios_disponiveis_leem_a_ocupacao(self):
+        self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc), states="CONF"
+        )
+        Agendamento.objects.update(states="UNCO")
+
+        # update() não passa pelos sinais: a ocupação continua valendo
+        self.assertNotIn(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc),
+            get_horarios_disponiveis(date(2030, 1, 8)),
+        )
+
+    def test_verifica_e_corrige_divergencias(self):
+        self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc), states="CONF"
+        )
+        self.cria_agendamento(
+            datetime(2030, 1, 8, 15, tzinfo=timezone.utc), states="CONF"
+        )
+        Agendamento.objects.filter(data_horario__hour=15).update(cancelado=True)
+        OcupacaoDia.objects.create(prestador=self.user, dia=date(2030, 1, 10))
+
+        saida = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("verifica_ocupacao", stdout=saida)
+        self.assertIn("em 2030-01-08: faltando -, sobrando 15:00", saida.getvalue())
+
+        call_command("verifica_ocupacao", "--corrige", stdout=StringIO())
+        call_command("verifica_ocupacao", stdout=StringIO())
+        self.assertEqual(self.get_ocupados(), 0b111111 << 120)
+
+    def test_reconstroi_ocupacao(self):
+        self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc), states="CONF"
+        )
+        OcupacaoDia.objects.all().delete()
+
+        call_command("reconstroi_ocupacao", "--inicio", "2030-01-08", stdout=StringIO())
+
+        self.assertEqual(self.get_ocupados(), 0b111111 << 120)
+        self.assertEqual(ocupacao_lib.verifica_ocupacao(), [])
+
+
+class TestHorariosPorPrestador(APITestCase):
+    def setUp(self):
+        cache.clear()
+        servico = Servicos.objects.create(servico="Manicure")
+        self.estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        outro_estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Barbearia"
+        )
+        self.prestadores = {}
+        for username, estabelecimento in [
+            ("maria", self.estabelecimento),
+            ("silvia", self.estabelecimento),
+            ("ana", outro_estabelecimento),
+        ]:
+            user = User.objects.create(
+                email=f"{username}@email.com", username=username, password="123"
+            )
+            Funcionarios.objects.create(
+                prestador=user, estabelecimento=estabelecimento, servico=servico
+            )
+            self.prestadores[username] = user
+        Agendamento.objects.create(
+            prestador=self.prestadores["silvia"],
+            estabelecimento=self.estabelecimento,
+            servico=servico,
+            data_horario=datetime(2030, 1, 8, 10, tzinfo=timezone.utc),
+            nome_cliente="Virginia",
+            email_cliente="virginia@email.com",
+            telefone_cliente="123123123",
+            states="CONF",
+        )
+
+    def test_filtra_por_estabelecimento_com_duas_consultas(self):
+        # Feriados e regras de expediente ficam em memória depois da primeira
+        # leitura
+        brasil_api.get_feriados(2030)
+        expediente.limpa_cache_modelos()
+        expediente.get_modelo(self.estabelecimento.id)
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/api/horarios/?data=2030-01-08&estabelecimento=Salão de Beleza"
+            )
+        data = json.loads(response.content)
+
+        self.assertEqual(
+            data[0],
+            {"horario": "2030-01-08T09:00:00Z", "prestadores": ["maria", "silvia"]},
+        )
+        self.assertEqual(
+            data[2], {"horario": "2030-01-08T10:00:00Z", "prestadores": ["maria"]}
+        )
+
+    def test_filtra_por_prestador_no_periodo(self):
+        response = self.client.get(
+            "/api/horarios/?inicio=2030-01-08&dias=2&prestador=silvia"
+        )
+        data = json.loads(response.content)
+
+        horarios_dia_8 = [item["horario"] for item in data["2030-01-08"]]
+        self.assertNotIn("2030-01-08T10:00:00Z", horarios_dia_8)
+        self.assertEqual(len(horarios_dia_8), 15)
+        self.assertEqual(len(data["2030-01-09"]), 16)
+
+    def test_horario_de_um_prestador_nao_bloqueia_outro(self):
+        horario = datetime(2030, 1, 8, 10, tzinfo=timezone.utc)
+        self.assertIn(
+            horario,
+            get_horarios_disponiveis(date(2030, 1, 8), self.prestadores["maria"].id),
+        )
+        self.assertNotIn(
+            horario,
+            get_horarios_disponiveis(date(2030, 1, 8), self.prestadores["silvia"].id),
+        )
+
+        self.client.force_authenticate(self.prestadores["maria"])
+        response = self.client.post(
+            "/api/agendamentos/",
+            {
+                "prestador": "maria",
+                "estabelecimento": "Salão de Beleza",
+                "servico": "Manicure",
+                "data_horario": "2030-01-08T10:00:00Z",
+                "nome_cliente": "Joana",
+                "email_cliente": "joana@email.com",
+                "telefone_cliente": "123123123",
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+
+class TestHorarioFuncionamento(DadosAgendamentoMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        expediente.limpa_cache_modelos()
+        # As regras criadas no teste somem no rollback, sem passar pelos sinais
+        self.addCleanup(expediente.limpa_cache_modelos)
+        # Domingo, das 10h às 12h, com horários de uma hora
+        HorarioFuncionamento.objects.create(
+            estabelecimento=self.estabelecimento,
+            dia_semana=6,
+            inicio="10:00",
+            fim="12:00",
+            duracao_horario=timedelta(hours=1),
+        )
+
+    def test_expediente_padrao_sem_regras(self):
+        grade = expediente.get_modelo().grade(date(2030, 1, 8))
+
+        self.assertEqual(len(grade), 16)
+        self.assertEqual(grade[0], datetime(2030, 1, 8, 9, tzinfo=timezone.utc))
+        self.assertEqual(expediente.get_modelo().grade(date(2030, 1, 13)), [])
+
+    def test_regras_do_estabelecimento(self):
+        domingo = date(2030, 1, 13)
+
+        self.assertEqual(
+            expediente.get_modelo(self.estabelecimento.id).grade(domingo),
+            [
+                datetime(2030, 1, 13, 10, tzinfo=timezone.utc),
+                datetime(2030, 1, 13, 11, tzinfo=timezone.utc),
+            ],
+        )
+        self.assertEqual(
+            expediente.get_modelo(self.estabelecimento.id).grade(date(2030, 1, 8)), []
+        )
+
+    def test_regras_do_prestador_substituem_as_do_estabelecimento(self):
+        HorarioFuncionamento.objects.create(
+            estabelecimento=self.estabelecimento,
+            prestador=self.user,
+            dia_semana=6,
+            inicio="14:00",
+            fim="15:00",
+        )
+
+        grade = expediente.get_modelo(self.estabelecimento.id, self.user.id).grade(
+            date(2030, 1, 13)
+        )
+        self.assertEqual(
+            grade,
+            [
+                datetime(2030, 1, 13, 14, tzinfo=timezone.utc),
+                datetime(2030, 1, 13, 14, 30, tzinfo=timezone.utc),
+            ],
+        )
+
+    def test_duracao_horario_multipla_de_5_minutos(self):
+        horario = HorarioFuncionamento(
+            estabelecimento=self.estabelecimento,
+            dia_semana=0,
+            inicio="09:00",
+            fim="12:00",
+            duracao_horario=timedelta(minutes=7),
+        )
+        with self.assertRaises(ValidationError):
+            horario.full_clean()
+
+        horario.duracao_horario = timedelta(minutes=45)
+        horario.full_clean()
+
+    def test_regras_compiladas_ficam_em_memoria_ate_serem_alteradas(self):
+        with self.assertNumQueries(1):
+            expediente.get_modelo(self.estabelecimento.id)
+        with self.assertNumQueries(0):
+            modelo = expediente.get_modelo(self.estabelecimento.id, self.user.id)
+        self.assertEqual(len(modelo.horarios[6]), 2)
+
+        HorarioFuncionamento.objects.update(fim="13:00")
+        HorarioFuncionamento.objects.get().save()
+
+        modelo = expediente.get_modelo(self.estabelecimento.id)
+        self.assertEqual(len(modelo.horarios[6]), 3)
+
+    def test_alteracao_em_outro_processo_recompila_as_regras(self):
+        self.assertEqual(
+            len(expediente.get_modelo(self.estabelecimento.id).horarios[6]), 2
+        )
+
+        # Outro processo altera as regras: o banco e o cache compartilhado
+        # mudam, mas a memória deste processo não.
+        HorarioFuncionamento.objects.update(fim="13:00")
+        cache.delete(expediente.CHAVE_VERSAO)
+
+        # Até a versão ser relida, vale o que está em memória
+        self.assertEqual(
+            len(expediente.get_modelo(self.estabelecimento.id).horarios[6]), 2
+        )
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 2):
+            modelo = expediente.get_modelo(self.estabelecimento.id)
+        self.assertEqual(len(modelo.horarios[6]), 3)
+
+    def test_horarios_do_estabelecimento_usam_as_regras(self):
+        brasil_api.get_feriados(2030)
+        response = self.client.get(
+            "/api/horarios/?data=2030-01-13&estabelecimento=Salão de Beleza"
+        )
+
+        self.assertEqual(
+            json.loads(response.content),
+            [
+                {"horario": "2030-01-13T10:00:00Z", "prestadores": ["silvia"]},
+                {"horario": "2030-01-13T11:00:00Z", "prestadores": ["silvia"]},
+            ],
+        )
+
+
+class TestDuracaoServico(DadosAgendamentoMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.escova = Servicos.objects.create(
+            servico="Escova", duracao=timedelta(minutes=90)
+        )
+        Funcionarios.objects.filter(prestador=self.user).update(servico=self.escova)
+        # Terça, das 10h às 11h30
+        self.cria_agendamento(
+            datetime(2030, 1, 8, 10, tzinfo=timezone.utc),
+            servico=self.escova,
+            states="CONF",
+        )
+
+    def test_agendamento_ocupa_a_duracao_do_servico(self):
+        horarios = utils.get_horarios_disponiveis(date(2030, 1, 8), self.user.id)
+
+        for hora, minuto in [(10, 0), (10, 30), (11, 0)]:
+            self.assertNotIn(
+                datetime(2030, 1, 8, hora, minuto, tzinfo=timezone.utc), horarios
+            )
+        self.assertIn(datetime(2030, 1, 8, 11, 30, tzinfo=timezone.utc), horarios)
+
+    def test_servico_longo_so_comeca_onde_cabe(self):
+        horarios = utils.get_horarios_disponiveis(
+            date(2030, 1, 8), self.user.id, duracao=timedelta(minutes=90)
+        )
+
+        # Antes das 13h, todo início cruza o agendamento ou o almoço
+        self.assertEqual(
+            horarios,
+            [
+                datetime(2030, 1, 8, 13, tzinfo=timezone.utc) + timedelta(minutes=m)
+                for m in range(0, 240, 30)
+            ],
+        )
+
+    def test_horarios_filtrados_por_servico_usam_a_duracao(self):
+        response = self.client.get("/api/horarios/?data=2030-01-08&servico=Escova")
+        data = json.loads(response.content)
+
+        self.assertEqual(data[0]["horario"], "2030-01-08T13:00:00Z")
+        self.assertEqual(data[-1]["horario"], "2030-01-08T16:30:00Z")
+
+    def test_agendamento_sobreposto_e_recusado(self):
+        with self.assertRaises(ocupacao_lib.ConflitoHorario):
+            with transaction.atomic():
+                self.cria_agendamento(
+                    datetime(2030, 1, 8, 11, tzinfo=timezone.utc), states="CONF"
+                )
+
+        self.assertEqual(Agendamento.objects.count(), 1)
+        self.assertEqual(ocupacao_lib.verifica_ocupacao(), [])
+        self.cria_agendamento(
+            datetime(2030, 1, 8, 11, 30, tzinfo=timezone.utc), states="CONF"
+        )
+        self.assertEqual(ocupacao_lib.verifica_ocupacao(), [])
+
+
+class TestProximosHorarios(APITestCase):
+    def setUp(self):
+        cache.clear()
+        expediente.limpa_cache_modelos()
+        self.addCleanup(expediente.limpa_cache_modelos)
+        self.estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        self.escova = Servicos.objects.create(
+            servico="Escova", duracao=timedelta(minutes=90)
+        )
+        self.prestadores = {}
+        for username in ("maria", "silvia"):
+            self.prestadores[username] = User.objects.create(
+                email=f"{username}@email.com", username=username, password="123"
+            )
+            Funcionarios.objects.create(
+                prestador=self.prestadores[username],
+                estabelecimento=self.estabelecimento,
+                servico=self.escova,
+            )
+        Agendamento.objects.create(
+            prestador=self.prestadores["silvia"],
+            estabelecimento=self.estabelecimento,
+            servico=self.escova,
+            data_horario=datetime(2030, 1, 8, 16, tzinfo=timezone.utc),
+            nome_cliente="Virginia",
+            email_cliente="virginia@email.com",
+            telefone_cliente="123123123",
+            states="CONF",
+        )
+        # Feriados e regras de expediente ficam em memória
+        brasil_api.get_feriados(2030)
+        expediente.get_modelo(self.estabelecimento.id)
+
+    def test_primeiros_horarios_com_tres_consultas(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                "/api/horarios/proximos/?servico=Escova&estabelecimento=Salão de Beleza"
+                "&a_partir_de=2030-01-08T15:45:00%2B00:00&quantidade=3"
+            )
+
+        self.assertEqual(
+            json.loads(response.content),
+            [
+                {"horario": "2030-01-08T16:00:00Z", "prestadores": ["maria"]},
+                {"horario": "2030-01-08T16:30:00Z", "prestadores": ["maria"]},
+                {"horario": "2030-01-09T09:00:00Z", "prestadores": ["maria", "silvia"]},
+            ],
+        )
+
+    def test_busca_continua_nas_janelas_seguintes(self):
+        # Só aos domingos, às 10h e às 11h
+        HorarioFuncionamento.objects.create(
+            estabelecimento=self.estabelecimento,
+            dia_semana=6,
+            inicio="10:00",
+            fim="13:00",
+            duracao_horario=timedelta(hours=1),
+        )
+        expediente.get_modelo(self.estabelecimento.id)
+        a_partir_de = datetime(2030, 1, 14, tzinfo=timezone.utc)
+
+        with self.assertNumQueries(2):
+            proximos = utils.busca_proximos_horarios(
+                a_partir_de,
+                {self.prestadores["maria"].id: self.estabelecimento.id},
+                self.escova.duracao,
+                quantidade=3,
+            )
+
+        self.assertEqual(
+            [horario for horario, _ in proximos],
+            [
+                datetime(2030, 1, 20, 10, tzinfo=timezone.utc),
+                datetime(2030, 1, 20, 11, tzinfo=timezone.utc),
+                datetime(2030, 1, 27, 10, tzinfo=timezone.utc),
+            ],
+        )
+
+    def test_busca_limitada_pelo_horizonte(self):
+        response = self.client.get(
+            "/api/horarios/proximos/?servico=Escova"
+            "&a_partir_de=2030-01-08T17:00:00%2B00:00&dias=1"
+        )
+
+        self.assertEqual(json.loads(response.content), [])
+
+    def test_servico_obrigatorio(self):
+        response = self.client.get("/api/horarios/proximos/?dias=1000")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class TestCalendarioFeriados(APITestCase):
+    def setUp(self):
+        brasil_api.limpa_cache_feriados()
+        self.addCleanup(brasil_api.limpa_cache_feriados)
+
+    @mock.patch("agenda.libs.brasil_api.busca_feriados")
+    def test_feriados_do_ano_sao_buscados_uma_vez(self, busca_feriados):
+        busca_feriados.return_value = [{"date": "2040-04-15", "name": "Feriado"}]
+
+        self.assertTrue(brasil_api.is_feriado(date(2040, 4, 15)))
+        with self.assertNumQueries(0):
+            self.assertFalse(brasil_api.is_feriado(date(2040, 4, 16)))
+
+        busca_feriados.assert_called_once_with(2040)
+        self.assertEqual(CalendarioFeriados.objects.get().datas, ["2040-04-15"])
+
+    @mock.patch("agenda.libs.brasil_api.busca_feriados")
+    def test_calendario_salvo_e_usado_apos_reinicio(self, busca_feriados):
+        CalendarioFeriados.objects.create(
+            ano=2040, datas=["2040-04-15"], atualizado_em=now()
+        )
+
+        self.assertTrue(brasil_api.is_feriado(date(2040, 4, 15)))
+        busca_feriados.assert_not_called()
+
+    @mock.patch("agenda.libs.brasil_api.busca_feriados")
+    def test_calendario_expirado_e_buscado_novamente(self, busca_feriados):
+        busca_feriados.return_value = [{"date": "2040-09-07", "name": "Feriado"}]
+        CalendarioFeriados.objects.create(
+            ano=2040,
+            datas=["2040-04-15"],
+            atualizado_em=now() - timedelta(days=365),
+        )
+
+        self.assertTrue(brasil_api.is_feriado(date(2040, 9, 7)))
+        self.assertEqual(CalendarioFeriados.objects.get().datas, ["2040-09-07"])
+
+    @mock.patch("agenda.libs.brasil_api.busca_feriados", return_value=None)
+    def test_falha_na_brasil_api_usa_calendario_expirado(self, busca_feriados):
+        CalendarioFeriados.objects.create(
+            ano=2040,
+            datas=["2040-04-15"],
+            atualizado_em=now() - timedelta(days=365),
+        )
+
+        self.assertTrue(brasil_api.is_feriado(date(2040, 4, 15)))
+        self.assertTrue(brasil_api.is_feriado(date(2040, 4, 15)))
+        busca_feriados.assert_called_once_with(2040)
+
+    @mock.patch("agenda.libs.brasil_api.busca_feriados")
+    def test_ano_do_arquivo_nao_consulta_brasil_api(self, busca_feriados):
+        self.assertTrue(brasil_api.is_feriado(date(2024, 11, 20)))
+        self.assertFalse(brasil_api.is_feriado(date(2024, 11, 21)))
+        busca_feriados.assert_not_called()
+
+    @mock.patch("agenda.libs.brasil_api.busca_feriados")
+    def test_comando_atualiza_feriados(self, busca_feriados):
+        busca_feriados.side_effect = [
+            [{"date": "2024-11-20", "name": "Dia da consciência negra"}],
+            None,
+        ]
+
+        call_command("atualiza_feriados", "2024", "2025", stdout=StringIO())
+
+        calendario = CalendarioFeriados.objects.get()
+        self.assertEqual(calendario.ano, 2024)
+        self.assertEqual(calendario.datas, ["2024-11-20"])
+        self.assertFalse(brasil_api.is_feriado(date(2024, 12, 25)))
+
 
 class TestCriacaoServico(APITestCase):
     def test_retorna_servico(self):
@@ -867,7 +1862,7 @@ class TestCriacaoServico(APITestCase):
 
         servico_request = {"servico": "Manicure"}
 
-        servico_serializado = {"id": 1, "servico": "Manicure"}
+        servico_serializado = {"id": 1, "servico": "Manicure", "duracao": "00:30:00"}
 
         response = self.client.post("/api/servicos/", servico_request, format="json")
 
@@ -896,3 +1891,793 @@ class TestCriacaoServico(APITestCase):
 
         self.assertEqual(response.status_code, 400)
         self.assertDictEqual(data, resposta_agendamento)
+
+    def test_duracao_precisa_ser_multiplo_de_5_minutos_de_ate_um_dia(self):
+        self.client.force_authenticate(
+            User.objects.create(
+                email="maria@email.com", username="maria", is_staff=True
+            )
+        )
+
+        for n, duracao in enumerate(
+            ["-00:30:00", "00:00:00", "00:07:00", "1 00:05:00"]
+        ):
+            response = self.client.post(
+                "/api/servicos/",
+                {"servico": f"Serviço {n}", "duracao": duracao},
+                format="json",
+            )
+
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("duracao", json.loads(response.content))
+
+        response = self.client.post(
+            "/api/servicos/",
+            {"servico": "Escova", "duracao": "01:35:00"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Servicos.objects.get().duracao, timedelta(minutes=95))
+
+    def test_banco_recusa_duracao_fora_do_intervalo(self):
+        with self.assertRaises(IntegrityError):
+            Servicos.objects.create(servico="Manicure", duracao=timedelta(0))
+
+
+class TestCacheCep(APITestCase):
+    def setUp(self):
+        utils._cache_cep.clear()
+        self.addCleanup(utils._cache_cep.clear)
+
+    @mock.patch("agenda.libs.brasil_api.busca_cep")
+    def test_cria_endereco_consulta_cep_uma_vez(self, busca_cep):
+        busca_cep.return_value = {
+            "cep": "13010111",
+            "state": "SP",
+            "city": "Campinas",
+            "neighborhood": "Centro",
+            "street": "Rua Barao de Jaguara",
+        }
+        user = User.objects.create(
+            email="maria@email.com", username="maria", password="123"
+        )
+        self.client.force_authenticate(user)
+        Estabelecimento.objects.create(nome_estabelecimento="Salão de Beleza")
+
+        endereco_request = {
+            "estabelecimento": "Salão de Beleza",
+            "cep": "13010111",
+            "estado": "SP",
+            "cidade": "Campinas",
+            "bairro": "Centro",
+            "rua": "Rua Barao de Jaguara",
+        }
+
+        response = self.client.post("/api/endereco/", endereco_request, format="json")
+        self.client.post("/api/endereco/", endereco_request, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        busca_cep.assert_called_once_with("13010111")
+
+    @mock.patch("agenda.libs.brasil_api.busca_cep", return_value=False)
+    def test_cep_invalido_fica_em_cache(self, busca_cep):
+        self.assertFalse(utils.verifica_cep("00000000"))
+        self.assertFalse(utils.verifica_cep("00000000"))
+
+        busca_cep.assert_called_once()
+
+    @mock.patch("agenda.libs.brasil_api.busca_cep", return_value=None)
+    def test_erro_na_brasil_api_nao_fica_em_cache(self, busca_cep):
+        self.assertFalse(utils.verifica_cep("13010111"))
+        self.assertFalse(utils.verifica_cep("13010111"))
+
+        self.assertEqual(busca_cep.call_count, 2)
+
+    def test_cache_descarta_entrada_usada_ha_mais_tempo(self):
+        cache = CacheLRU(tamanho_maximo=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("c"), (True, 3))
+
+    def test_cache_expira_entrada(self):
+        cache = CacheLRU(tamanho_maximo=2, ttl=0)
+        cache.set("a", 1)
+
+        self.assertEqual(cache.get("a"), (False, None))
+
+
+class BrasilAPIFalsa(BaseHTTPRequestHandler):
+    """Servidor local que imita a BrasilAPI nos testes do cliente HTTP."""
+
+    respostas = {}
+    chamadas = []
+
+    def do_GET(self):
+        self.chamadas.append(self.path)
+        status, corpo, atraso = self.respostas.get(self.path, (404, {}, 0))
+        time.sleep(atraso)
+        conteudo = json.dumps(corpo).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(conteudo)))
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestClienteBrasilAPI(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(("127.0.0.1", 0), BrasilAPIFalsa)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.servidor.server_port}/api"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        BrasilAPIFalsa.respostas = {}
+        BrasilAPIFalsa.chamadas = []
+
+    def cria_cliente(self, **kwargs):
+        opcoes = {
+            "url_base": self.url,
+            "timeout": (0.5, 0.2),
+            "tentativas": 0,
+            "limite_falhas": 2,
+            "tempo_aberto": 60,
+        }
+        opcoes.update(kwargs)
+        return ClienteBrasilAPI(**opcoes)
+
+    def test_busca_cep_no_servidor(self):
+        BrasilAPIFalsa.respostas["/api/cep/v2/13010111"] = (200, {"city": "X"}, 0)
+
+        with mock.patch(
+            "agenda.libs.brasil_api.get_cliente", return_value=self.cria_cliente()
+        ):
+            self.assertEqual(brasil_api.busca_cep("13010111"), {"city": "X"})
+            self.assertFalse(brasil_api.busca_cep("00000000"))
+
+    def test_repete_requisicao_com_erro_temporario(self):
+        BrasilAPIFalsa.respostas["/api/cep/v2/13010111"] = (503, {}, 0)
+        cliente = self.cria_cliente(tentativas=2)
+
+        with self.assertRaises(BrasilAPIIndisponivel):
+            cliente.get("/cep/v2/13010111")
+
+        self.assertEqual(len(BrasilAPIFalsa.chamadas), 3)
+
+    def test_timeout_abre_o_disjuntor(self):
+        BrasilAPIFalsa.respostas["/api/cep/v2/13010111"] = (200, {}, 0.5)
+        cliente = self.cria_cliente()
+
+        for _ in range(2):
+            with self.assertRaises(BrasilAPIIndisponivel):
+                cliente.get("/cep/v2/13010111")
+
+        inicio = time.monotonic()
+        with self.assertRaises(BrasilAPIIndisponivel):
+            cliente.get("/cep/v2/13010111")
+
+        self.assertTrue(cliente.disjuntor.aberto)
+        self.assertLess(time.monotonic() - inicio, 0.1)
+        self.assertEqual(len(BrasilAPIFalsa.chamadas), 2)
+
+    def test_disjuntor_fecha_apos_chamada_de_teste(self):
+        BrasilAPIFalsa.respostas["/api/feriados/v1/2040"] = (500, {}, 0)
+        cliente = self.cria_cliente(tempo_aberto=0.01)
+
+        for _ in range(2):
+            with self.assertRaises(BrasilAPIIndisponivel):
+                cliente.get("/feriados/v1/2040")
+        self.assertTrue(cliente.disjuntor.aberto)
+
+        time.sleep(0.02)
+        BrasilAPIFalsa.respostas["/api/feriados/v1/2040"] = (200, [], 0)
+
+        self.assertEqual(cliente.get("/feriados/v1/2040").json(), [])
+        self.assertFalse(cliente.disjuntor.aberto)
+
+
+class TestChamadaUnica(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def executa_em_paralelo(self, funcao, quantidade=8):
+        resultados = []
+        threads = [
+            threading.Thread(target=lambda: resultados.append(funcao()))
+            for _ in range(quantidade)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return resultados
+
+    def test_chamadas_concorrentes_executam_uma_vez(self):
+        chamada_unica = ChamadaUnica("teste")
+        chamadas = []
+
+        def busca():
+            chamadas.append(1)
+            time.sleep(0.1)
+            return {"ano": 2040}
+
+        resultados = self.executa_em_paralelo(
+            lambda: chamada_unica.executa(2040, busca)
+        )
+
+        self.assertEqual(len(chamadas), 1)
+        self.assertEqual(resultados, [{"ano": 2040}] * 8)
+
+    def test_erro_e_repassado_para_quem_esperava(self):
+        chamada_unica = ChamadaUnica("teste")
+        erros = []
+
+        def busca():
+            time.sleep(0.1)
+            raise ValueError("falhou")
+
+        def executa():
+            try:
+                chamada_unica.executa(2040, busca)
+            except ValueError as erro:
+                erros.append(erro)
+
+        self.executa_em_paralelo(executa, quantidade=4)
+
+        self.assertEqual(len(erros), 4)
+
+    def test_espera_resultado_de_outro_processo(self):
+        chamada_unica = ChamadaUnica("teste", espera_maxima=2)
+        cache.add("teste:2040:lock", True)
+
+        def outro_processo():
+            time.sleep(0.1)
+            cache.set("teste:2040:resultado", ({"ano": 2040},))
+            cache.delete("teste:2040:lock")
+
+        threading.Thread(target=outro_processo).start()
+        busca = mock.Mock(return_value={"ano": 0})
+
+        self.assertEqual(chamada_unica.executa(2040, busca), {"ano": 2040})
+        busca.assert_not_called()
+
+    @mock.patch("agenda.libs.brasil_api.busca_cep")
+    def test_verifica_cep_concorrente_consulta_uma_vez(self, busca_cep):
+        utils._cache_cep.clear()
+        self.addCleanup(utils._cache_cep.clear)
+
+        def busca(cep):
+            time.sleep(0.1)
+            return {"cep": cep}
+
+        busca_cep.side_effect = busca
+
+        resultados = self.executa_em_paralelo(lambda: utils.verifica_cep("13010111"))
+
+        busca_cep.assert_called_once_with("13010111")
+        self.assertEqual(resultados, [{"cep": "13010111"}] * 8)
+
+
+class TestConcorrenciaAgendamento(DadosAgendamentoMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.horario = datetime(2030, 1, 9, 15, tzinfo=timezone.utc)
+        self.agendamento_request = {
+            "prestador": "silvia",
+            "estabelecimento": "Salão de Beleza",
+            "servico": "Manicure",
+            "data_horario": "2030-01-09T15:00:00Z",
+            "nome_cliente": "Virginia",
+            "email_cliente": "virginia@email.com",
+            "telefone_cliente": "123123123",
+            "states": "CONF",
+        }
+
+    def test_horario_confirmado_por_outra_requisicao_retorna_409(self):
+        self.cria_agendamento(
+            self.horario,
+            nome_cliente="Silvia",
+            email_cliente="silvia@email.com",
+            states="CONF",
+        )
+
+        # Simula a outra requisição confirmando o horário depois da validação
+        with mock.patch(
+            "agenda.serializers.get_horarios_disponiveis",
+            return_value=[self.horario],
+        ):
+            response = self.client.post(
+                "/api/agendamentos/", self.agendamento_request, format="json"
+            )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            json.loads(response.content),
+            {"detail": "Este horário não está disponível!"},
+        )
+        self.assertEqual(Agendamento.objects.count(), 1)
+        self.assertFalse(Fidelidade.objects.exists())
+
+    def test_horario_cancelado_pode_ser_confirmado_novamente(self):
+        self.cria_agendamento(
+            self.horario,
+            nome_cliente="Silvia",
+            email_cliente="silvia@email.com",
+            states="CONF",
+            cancelado=True,
+        )
+
+        response = self.client.post(
+            "/api/agendamentos/", self.agendamento_request, format="json"
+        )
+
+        self.assertEqual(response.status_code, 201)
+
+    def test_cria_agendamento_com_numero_fixo_de_consultas(self):
+        brasil_api.get_feriados(2030)
+        expediente.limpa_cache_modelos()
+        expediente.get_modelo(self.estabelecimento.id, self.user.id)
+        del self.agendamento_request["states"]
+
+        # 9 consultas e 2 pares de SAVEPOINT/RELEASE das transações
+        with self.assertNumQueries(13):
+            response = self.client.post(
+                "/api/agendamentos/", self.agendamento_request, format="json"
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Fidelidade.objects.get().nivel_fidelidade, 0)
+
+
+class TestIdempotencia(DadosAgendamentoMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.agendamento_request = {
+            "prestador": "silvia",
+            "estabelecimento": "Salão de Beleza",
+            "servico": "Manicure",
+            "data_horario": "2030-01-09T15:00:00Z",
+            "nome_cliente": "Virginia",
+            "email_cliente": "virginia@email.com",
+            "telefone_cliente": "123123123",
+            "states": "CONF",
+        }
+
+    def post(self, dados, chave="chave-1"):
+        return self.client.post(
+            "/api/agendamentos/", dados, format="json", HTTP_IDEMPOTENCY_KEY=chave
+        )
+
+    @override_settings(CACHES={"default": settings.CACHES["banco"]})
+    def test_chave_longa_nao_passa_do_tamanho_das_chaves_do_cache(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            response = self.post(self.agendamento_request, chave="k" * 255)
+            repetida = self.post(self.agendamento_request, chave="k" * 255)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(repetida["Idempotent-Replayed"], "true")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT MAX(LENGTH(cache_key)) FROM agenda_cache")
+            self.assertLessEqual(cursor.fetchone()[0], 250)
+
+    def test_repeticao_recebe_a_resposta_gravada(self):
+        primeira = self.post(self.agendamento_request)
+        with self.assertNumQueries(1):
+            repeticao = self.post(self.agendamento_request)
+
+        self.assertEqual(primeira.status_code, 201)
+        self.assertEqual(repeticao.status_code, 201)
+        self.assertEqual(json.loads(repeticao.content), json.loads(primeira.content))
+        self.assertNotIn("Idempotent-Replayed", primeira)
+        self.assertEqual(repeticao["Idempotent-Replayed"], "true")
+        self.assertEqual(Agendamento.objects.count(), 1)
+        self.assertEqual(Fidelidade.objects.get().nivel_fidelidade, 0)
+
+    def test_chave_reutilizada_com_outra_requisicao_retorna_422(self):
+        self.post(self.agendamento_request)
+        response = self.post({**self.agendamento_request, "nome_cliente": "Maria"})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Agendamento.objects.count(), 1)
+
+    def test_erros_nao_sao_gravados(self):
+        dados = {**self.agendamento_request, "prestador": "maria"}
+
+        self.assertEqual(self.post(dados).status_code, 400)
+        self.assertFalse(RespostaIdempotente.objects.exists())
+        self.assertEqual(self.post(self.agendamento_request).status_code, 201)
+
+    def test_resposta_expirada_e_substituida(self):
+        self.post(self.agendamento_request)
+        RespostaIdempotente.objects.update(criado_em=now() - timedelta(days=2))
+
+        response = self.post(
+            {**self.agendamento_request, "data_horario": "2030-01-10T15:00:00Z"}
+        )
+
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Agendamento.objects.count(), 2)
+        self.assertEqual(RespostaIdempotente.objects.count(), 1)
+
+    def test_chave_gravada_por_outro_processo_desfaz_o_agendamento(self):
+        gravada = RespostaIdempotente.objects.create(
+            chave="chave-1",
+            impressao=idempotencia.get_impressao(self.agendamento_request),
+            status=201,
+            corpo={"id": 99},
+        )
+
+        # O outro processo grava a chave depois da primeira leitura
+        with mock.patch(
+            "agenda.idempotencia.get_resposta", side_effect=[None, gravada]
+        ):
+            response = self.post(self.agendamento_request)
+
+        self.assertEqual(json.loads(response.content), {"id": 99})
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+        self.assertFalse(Agendamento.objects.exists())
+
+
+class TestAgendamentoLote(DadosAgendamentoMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        # Feriados e regras de expediente ficam em memória
+        brasil_api.get_feriados(2030)
+        expediente.limpa_cache_modelos()
+        expediente.get_modelo(self.estabelecimento.id, self.user.id)
+
+    def item(self, n, **campos):
+        dia, hora = divmod(n, 8)
+        return {
+            "prestador": "silvia",
+            "estabelecimento": "Salão de Beleza",
+            "servico": "Manicure",
+            "data_horario": (
+                datetime(2030, 1, 7, 13, tzinfo=timezone.utc)
+                + timedelta(days=dia, minutes=30 * hora)
+            ).isoformat(),
+            "nome_cliente": f"Cliente {n}",
+            "email_cliente": f"cliente{n}@email.com",
+            "telefone_cliente": "123123123",
+            "states": "CONF",
+            **campos,
+        }
+
+    def test_resultado_de_cada_item(self):
+        lote = [
+            self.item(0),
+            self.item(0, nome_cliente="Outra", email_cliente="outra@email.com"),
+            self.item(1, prestador="maria"),
+            self.item(2),
+        ]
+
+        response = self.client.post("/api/agendamentos/batch/", lote, format="json")
+        data = json.loads(response.content)
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([item["status"] for item in data], [201, 400, 400, 201])
+        self.assertEqual(data[0]["agendamento"]["nome_cliente"], "Cliente 0")
+        self.assertEqual(
+            [data[0]["agendamento"]["id"], data[3]["agendamento"]["id"]],
+            list(Agendamento.objects.order_by("id").values_list("id", flat=True)),
+        )
+        self.assertEqual(
+            data[1]["erros"], {"data_horario": ["Este horário não está disponível!"]}
+        )
+        self.assertEqual(data[2]["erros"], {"prestador": ["Username incorreto!"]})
+        self.assertEqual(Agendamento.objects.count(), 2)
+        self.assertEqual(ocupacao_lib.verifica_ocupacao(), [])
+        self.assertEqual(Fidelidade.objects.count(), 2)
+
+    def test_consultas_nao_dependem_do_tamanho_do_lote(self):
+        with CaptureQueriesContext(connection) as um_item:
+            self.client.post("/api/agendamentos/batch/", [self.item(0)], format="json")
+        with CaptureQueriesContext(connection) as vinte_itens:
+            response = self.client.post(
+                "/api/agendamentos/batch/",
+                [self.item(n) for n in range(8, 28)],
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Agendamento.objects.count(), 21)
+        self.assertEqual(len(vinte_itens), len(um_item))
+
+    def test_horario_ocupado_depois_da_validacao_retorna_409(self):
+        validos = lote_lib.valida_lote([self.item(0)])
+        self.cria_agendamento(
+            datetime(2030, 1, 7, 13, tzinfo=timezone.utc),
+            nome_cliente="Silvia",
+            email_cliente="silvia@email.com",
+            states="CONF",
+        )
+
+        with self.assertRaises(ocupacao_lib.ConflitoHorario):
+            lote_lib.grava_lote(validos)
+
+    @override_settings(TIME_ZONE="America/Sao_Paulo")
+    def test_ocupacao_carregada_pelo_dia_utc(self):
+        # 01h UTC do dia 8 ainda é dia 7 em São Paulo
+        data_horario = datetime(2030, 1, 8, 1, tzinfo=timezone.utc)
+        self.cria_agendamento(
+            data_horario,
+            nome_cliente="Silvia",
+            email_cliente="silvia@email.com",
+            states="CONF",
+        )
+
+        lote = lote_lib.ContextoLote(
+            [self.item(0, data_horario=data_horario.isoformat())]
+        )
+
+        self.assertIn((self.user.id, date(2030, 1, 8)), lote.ocupacao)
+
+    def test_lote_precisa_ser_uma_lista(self):
+        response = self.client.post(
+            "/api/agendamentos/batch/", self.item(0), format="json"
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+class TestFidelidade(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email="silvia@email.com", username="silvia", password="123"
+        )
+
+    def test_incremento_e_feito_sem_ler_o_nivel_atual(self):
+        registra_fidelidade({("Virginia", self.user.id): 1})
+        fidelidade = Fidelidade.objects.get()
+
+        # Outro agendamento do mesmo cliente é registrado enquanto este
+        # objeto está em memória; nenhum incremento pode ser perdido.
+        registra_fidelidade({("Virginia", self.user.id): 1})
+        with self.assertNumQueries(2):
+            registra_fidelidade({("Virginia", self.user.id): 1})
+
+        fidelidade.refresh_from_db()
+        self.assertEqual(fidelidade.nivel_fidelidade, 2)
+
+    def test_acumulador_grava_varios_clientes_de_uma_vez(self):
+        registra_fidelidade({("Virginia", self.user.id): 1})
+        acumulador = AcumuladorFidelidade()
+        for nome_cliente in ["Virginia", "Maria", "Virginia", "Ana", "Maria"]:
+            acumulador.adiciona(nome_cliente, self.user)
+
+        with self.assertNumQueries(2):
+            acumulador.grava()
+
+        niveis = dict(
+            Fidelidade.objects.values_list("nome_cliente", "nivel_fidelidade")
+        )
+        self.assertEqual(niveis, {"Virginia": 2, "Maria": 1, "Ana": 0})
+
+
+class TestMigracaoHorarioConfirmado(TransactionTestCase):
+    antes = [("agenda", "0016_calendarioferiados")]
+    depois = [("agenda", "0017_agendamento_horario_confirmado_unique")]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_horarios_confirmados_duplicados_sao_desconfirmados(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.antes)
+        apps = executor.loader.project_state(self.antes).apps
+        Agendamento = apps.get_model("agenda", "Agendamento")
+        prestador = apps.get_model("auth", "User").objects.create(username="silvia")
+        estabelecimento = apps.get_model("agenda", "Estabelecimento").objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        servico = apps.get_model("agenda", "Servicos").objects.create(
+            servico="Manicure"
+        )
+        horario = datetime(2030, 1, 9, 15, tzinfo=timezone.utc)
+        ids = [
+            Agendamento.objects.create(
+                prestador=prestador,
+                estabelecimento=estabelecimento,
+                servico=servico,
+                data_horario=horario,
+                nome_cliente=f"Cliente {n}",
+                email_cliente=f"cliente{n}@email.com",
+                telefone_cliente="123123123",
+                states="CONF",
+            ).id
+            for n in range(3)
+        ]
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.depois)
+
+        Agendamento = executor.loader.project_state(self.depois).apps.get_model(
+            "agenda", "Agendamento"
+        )
+        self.assertEqual(
+            list(Agendamento.objects.order_by("id").values_list("id", "states")),
+            [(ids[0], "CONF"), (ids[1], "UNCO"), (ids[2], "UNCO")],
+        )
+
+
+class TestMigracaoDuracaoServico(TransactionTestCase):
+    antes = [("agenda", "0025_respostaidempotente")]
+    depois = [("agenda", "0026_servicos_duracao_valida")]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duracoes_invalidas_sao_corrigidas(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.antes)
+        Servicos = executor.loader.project_state(self.antes).apps.get_model(
+            "agenda", "Servicos"
+        )
+        for servico, duracao in [
+            ("Negativo", timedelta(minutes=-30)),
+            ("Zero", timedelta(0)),
+            ("Quebrado", timedelta(minutes=7)),
+            ("Escova", timedelta(minutes=90)),
+        ]:
+            Servicos.objects.create(servico=servico, duracao=duracao)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.depois)
+
+        Servicos = executor.loader.project_state(self.depois).apps.get_model(
+            "agenda", "Servicos"
+        )
+        self.assertEqual(
+            dict(Servicos.objects.values_list("servico", "duracao")),
+            {
+                "Negativo": timedelta(minutes=30),
+                "Zero": timedelta(minutes=30),
+                "Quebrado": timedelta(minutes=10),
+                "Escova": timedelta(minutes=90),
+            },
+        )
+
+
+class TestFidelidadeConcorrente(TransactionTestCase):
+    def test_agendamentos_simultaneos_nao_perdem_incrementos(self):
+        user = User.objects.create(
+            email="silvia@email.com", username="silvia", password="123"
+        )
+        barreira = threading.Barrier(8)
+        erros = []
+
+        def registra():
+            # O SQLite recusa escritas simultâneas ("database table is
+            # locked") em vez de esperar; a transação recusada é repetida.
+            for _ in range(1000):
+                try:
+                    return registra_fidelidade({("Virginia", user.id): 1})
+                except OperationalError:
+                    time.sleep(0.001)
+            self.fail("registra_fidelidade recusada 1000 vezes seguidas")
+
+        def agenda():
+            try:
+                barreira.wait()
+                for _ in range(5):
+                    registra()
+            except Exception as erro:
+                erros.append(erro)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=agenda) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(erros, [])
+        self.assertEqual(Fidelidade.objects.get().nivel_fidelidade, 39)
+
+
+class TestListagemUsuarios(APITestCase):
+    def test_lista_usuarios_em_fluxo(self):
+        for username in ["maria", "silvia"]:
+            User.objects.create(
+                email=f"{username}@email.com", username=username, password="123"
+            )
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/users/")
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(1):
+            conteudo = b"".join(response.streaming_content)
+
+        data = json.loads(conteudo)
+        self.assertEqual(
+            data,
+            [
+                {
+                    "id": user.id,
+                    "username": user.username,
+                    "email": user.email,
+                    "is_staff": False,
+                }
+                for user in User.objects.order_by("id")
+            ],
+        )
+
+    def test_codifica_em_blocos(self):
+        response = JsonEmFluxoResponse(({"n": n} for n in range(5)), tamanho_bloco=2)
+        blocos = list(response.streaming_content)
+
+        self.assertEqual(len(blocos), 4)
+        self.assertEqual(json.loads(b"".join(blocos)), [{"n": n} for n in range(5)])
+
+    def test_lista_vazia(self):
+        response = JsonEmFluxoResponse(iter([]))
+        self.assertEqual(b"".join(response.streaming_content), b"[]")
+
+
+class TestGetCondicionalCatalogo(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.estabelecimento = Estabelecimento.objects.create(
+            nome_estabelecimento="Salão de Beleza"
+        )
+        Servicos.objects.create(servico="Manicure")
+
+    def test_retorna_304_sem_consultar_a_listagem(self):
+        response = self.client.get("/api/servicos/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/servicos/", HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_alteracao_muda_o_etag(self):
+        etag = self.client.get("/api/servicos/")["ETag"]
+
+        Servicos.objects.create(servico="Pedicure")
+
+        response = self.client.get("/api/servicos/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_enderecos_dependem_dos_estabelecimentos(self):
+        etag = self.client.get("/api/endereco/")["ETag"]
+
+        self.estabelecimento.nome_estabelecimento = "Salão da Silvia"
+        self.estabelecimento.save()
+
+        response = self.client.get("/api/endereco/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_versao_e_lida_em_uma_consulta_e_depois_do_cache(self):
+        cache.clear()
+        with self.assertNumQueries(1):
+            versoes = utils.get_versoes_catalogo(["endereco", "estabelecimento"])
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                utils.get_versoes_catalogo(["endereco", "estabelecimento"]), versoes
+            )
+        self.assertEqual(versoes["endereco"], (0, None))
+        self.assertEqual(versoes["estabelecimento"][0], 1)
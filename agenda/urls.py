@@ -3,6 +3,7 @@ from django.urls import path
 from agenda.views import (
     AgendamentoDetail,
     AgendamentoList,
+    AgendamentoLote,
     EnderecoList,
     ServicosList,
     EstabelecimentoList,
@@ -10,6 +11,7 @@ from agenda.views import (
     PrestadorList,
     FidelidadeList,
     get_horarios,
+    get_proximos_horarios,
     healthcheck,
     users,
 )
@@ -17,7 +19,9 @@ from agenda.views import (
 urlpatterns = [
     path("agendamentos/", AgendamentoList.as_view(), name="agendamento_list"),
     path("agendamentos/<int:id>/", AgendamentoDetail.as_view()),
+    path("agendamentos/batch/", AgendamentoLote.as_view()),
     path("horarios/", get_horarios),
+    path("horarios/proximos/", get_proximos_horarios),
     path("prestadores/", PrestadorList.as_view()),
     path("fidelidade/", FidelidadeList.as_view()),
     path("funcionarios/", FuncionarioList.as_view()),
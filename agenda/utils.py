@@ -1,55 +1,493 @@
+from collections import Counter
+import hashlib
+import uuid
 from multiprocessing.sharedctypes import Value
 from typing import Iterable
-from datetime import date, datetime, timedelta, timezone
+from datetime import date, datetime, time, timedelta, timezone
 
-import requests
-import logging
-from agenda.models import Agendamento
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from django.utils import timezone as django_timezone
+
+from agenda.models import Fidelidade, Funcionarios, VersaoCatalogo
 from agenda.libs import brasil_api
+from agenda.libs.cache import CacheLRU, ChamadaUnica
+from agenda.expediente import MODELO_PADRAO, get_modelo
+from agenda.ocupacao import get_dia, get_ocupacao, get_ocupacao_por_dia
+
+
+class MapaIdentidade:
+    """
+    Identity map de uma requisição: cada objeto buscado com `get` é carregado
+    do banco uma única vez e reaproveitado nas buscas seguintes.
+    """
+
+    def __init__(self):
+        self._objetos = {}
+
+    def get(self, model, **filtros):
+        chave = (model, tuple(sorted(filtros.items())))
+        if chave not in self._objetos:
+            self._objetos[chave] = model.objects.get(**filtros)
+        if self._objetos[chave] is None:
+            raise model.DoesNotExist(f"{model.__name__} {filtros} não encontrado")
+        return self._objetos[chave]
+
+    def carrega(self, model, campo: str, valores):
+        """
+        Busca em uma consulta os objetos com `campo` em `valores`, para que
+        os `get(model, campo=valor)` seguintes não vão ao banco. Os valores não
+        encontrados também ficam registrados e levantam DoesNotExist. Retorna
+        os objetos encontrados.
+        """
+        valores = set(valores)
+        encontrados = {
+            getattr(objeto, campo): objeto
+            for objeto in model.objects.filter(**{f"{campo}__in": valores})
+        }
+        for valor in valores:
+            self._objetos[(model, ((campo, valor),))] = encontrados.get(valor)
+        return list(encontrados.values())
+
+
+def get_mapa_identidade(request) -> MapaIdentidade:
+    """Retorna o MapaIdentidade da requisição, criando-o na primeira chamada."""
+    request = getattr(request, "_request", request)
+    if not hasattr(request, "mapa_identidade"):
+        request.mapa_identidade = MapaIdentidade()
+    return request.mapa_identidade
+
+
+# Clientes por UPDATE em registra_fidelidade: o filtro tem um OR por cliente e
+# o SQLite limita a profundidade das expressões a 1000.
+BLOCO_FIDELIDADE = 200
+
+
+def registra_fidelidade(incrementos: dict):
+    """
+    Soma ao nível de fidelidade de cada cliente o número de novos agendamentos.
+    `incrementos` mapeia (nome_cliente, prestador_id) para a quantidade.
+
+    Não lê os níveis atuais: cria as fidelidades que faltam com nível -1 (o
+    primeiro agendamento leva o cliente ao nível 0) ignorando as que já
+    existem, e soma os incrementos com um UPDATE a cada BLOCO_FIDELIDADE
+    clientes. Agendamentos simultâneos do mesmo cliente não perdem
+    incrementos.
+    """
+    incrementos = {chave: n for chave, n in incrementos.items() if n}
+    if not incrementos:
+        return
+
+    with transaction.atomic(savepoint=False):
+        Fidelidade.objects.bulk_create(
+            [
+                Fidelidade(
+                    nome_cliente=nome_cliente,
+                    prestador_id=prestador_id,
+                    nivel_fidelidade=-1,
+                )
+                for nome_cliente, prestador_id in incrementos
+            ],
+            ignore_conflicts=True,
+        )
+        itens = list(incrementos.items())
+        for inicio in range(0, len(itens), BLOCO_FIDELIDADE):
+            _soma_fidelidade(itens[inicio : inicio + BLOCO_FIDELIDADE])
+
+
+def _soma_fidelidade(itens: list):
+    filtro = Q()
+    quantidades = set()
+    casos = []
+    for (nome_cliente, prestador_id), quantidade in itens:
+        filtro |= Q(nome_cliente=nome_cliente, prestador_id=prestador_id)
+        quantidades.add(quantidade)
+        casos.append(
+            When(
+                nome_cliente=nome_cliente,
+                prestador_id=prestador_id,
+                then=quantidade,
+            )
+        )
+
+    if len(quantidades) == 1:
+        incremento = quantidades.pop()
+    else:
+        incremento = Case(*casos, default=0, output_field=IntegerField())
+
+    Fidelidade.objects.filter(filtro).update(
+        nivel_fidelidade=F("nivel_fidelidade") + incremento
+    )
 
 
-def get_horarios_disponiveis(data: date) -> Iterable[datetime]:
+class AcumuladorFidelidade:
+    """
+    Junta os incrementos de fidelidade de vários agendamentos para gravá-los
+    de uma vez com registra_fidelidade.
+    """
 
-    if brasil_api.is_feriado(data) or data.weekday() == 6:
+    def __init__(self):
+        self.incrementos = Counter()
+
+    def adiciona(self, nome_cliente, prestador):
+        self.incrementos[(nome_cliente, prestador.pk)] += 1
+
+    def grava(self):
+        registra_fidelidade(self.incrementos)
+        self.incrementos.clear()
+
+
+def get_intervalo_do_dia(data_horario: datetime):
+    """
+    Retorna o intervalo [início, fim) do dia de `data_horario` no fuso atual.
+    Filtrar por esse intervalo, em vez de usar `data_horario__date`, permite
+    que o banco use os índices sobre data_horario.
+    """
+    dia = django_timezone.localtime(data_horario).date()
+    inicio = django_timezone.make_aware(datetime.combine(dia, time.min))
+    return inicio, inicio + timedelta(days=1)
+
+
+def get_horarios_disponiveis(
+    data: date,
+    prestador_id: int = None,
+    estabelecimento_id: int = None,
+    duracao: timedelta = None,
+    ocupacao: dict = None,
+) -> Iterable[datetime]:
+    """
+    Horários disponíveis do dia. Sem prestador, usa o expediente padrão e um
+    horário confirmado para qualquer prestador fica indisponível; com
+    prestador, usa o expediente dele e só os agendamentos dele contam.
+
+    Com `duracao`, só os horários em que um serviço dessa duração cabe no
+    expediente sem se sobrepor a outro agendamento. Com `ocupacao` (como em
+    get_ocupacao, já lida), o prestador não é consultado no banco.
+    """
+
+    if brasil_api.is_feriado(data):
+        return []
+
+    modelo = get_modelo(estabelecimento_id, prestador_id)
+    if not modelo.horarios[data.weekday()]:
         return []
 
-    inicio = datetime(data.year, data.month, data.day, 9, 0, tzinfo=timezone.utc)
-    fim = datetime(data.year, data.month, data.day, 18, 00, tzinfo=timezone.utc)
-    fim_sabado = datetime(data.year, data.month, data.day, 13, 00, tzinfo=timezone.utc)
-    inicio_pausa = datetime(
-        data.year, data.month, data.day, 12, 00, tzinfo=timezone.utc
+    if prestador_id is None:
+        ocupados = get_ocupacao_por_dia(data, data).get(data, 0)
+    elif ocupacao is not None:
+        ocupados = ocupacao.get((prestador_id, data), 0)
+    else:
+        ocupados = get_ocupacao(data, data, [prestador_id]).get((prestador_id, data), 0)
+
+    return modelo.grade(data, ocupados, duracao)
+
+
+def get_dias_abertos(inicio: date, fim: date) -> tuple:
+    """
+    Retorna (dias, abertos): todos os dias entre inicio e fim (inclusive) e
+    os que não são feriado. Faz uma consulta de feriados por ano.
+    """
+
+    feriados = set()
+    for ano in range(inicio.year, fim.year + 1):
+        feriados |= brasil_api.get_feriados(ano)
+
+    dias = [inicio + timedelta(days=n) for n in range((fim - inicio).days + 1)]
+    return dias, [dia for dia in dias if dia not in feriados]
+
+
+def get_horarios_disponiveis_periodo(inicio: date, fim: date) -> dict:
+    """
+    Horários disponíveis de cada dia entre inicio e fim (inclusive), agrupados
+    por data. Faz uma consulta de feriados por ano e uma única consulta de
+    ocupação para todo o período.
+    """
+
+    dias, abertos = get_dias_abertos(inicio, fim)
+    abertos = [dia for dia in abertos if MODELO_PADRAO.horarios[dia.weekday()]]
+    ocupados = {}
+    if abertos:
+        ocupados = get_ocupacao_por_dia(abertos[0], abertos[-1])
+
+    abertos = set(abertos)
+    return {
+        dia: MODELO_PADRAO.grade(dia, ocupados.get(dia, 0)) if dia in abertos else []
+        for dia in dias
+    }
+
+
+def get_horarios_disponiveis_prestadores(
+    inicio: date,
+    fim: date,
+    prestadores: dict,
+    ocupacao: dict = None,
+    duracao: timedelta = None,
+) -> dict:
+    """
+    Horários disponíveis de cada prestador em cada dia entre inicio e fim, como
+    {dia: {prestador_id: horarios}}. `prestadores` é {prestador_id:
+    estabelecimento_id}, o estabelecimento cujo expediente vale (ou None).
+    Com `duracao`, como em get_horarios_disponiveis.
+
+    Faz uma consulta de ocupação (a menos que `ocupacao` seja informada, como
+    em get_ocupacao) e, se as regras de expediente não estiverem em memória,
+    uma de regras, qualquer que seja o número de prestadores.
+    """
+
+    dias, abertos = get_dias_abertos(inicio, fim)
+    if ocupacao is None:
+        ocupacao = {}
+        if abertos and prestadores:
+            ocupacao = get_ocupacao(abertos[0], abertos[-1], list(prestadores))
+
+    modelos = {
+        prestador_id: get_modelo(estabelecimento_id, prestador_id)
+        for prestador_id, estabelecimento_id in prestadores.items()
+    }
+    abertos = set(abertos)
+    return {
+        dia: {
+            prestador_id: (
+                modelo.grade(dia, ocupacao.get((prestador_id, dia), 0), duracao)
+                if dia in abertos
+                else []
+            )
+            for prestador_id, modelo in modelos.items()
+        }
+        for dia in dias
+    }
+
+
+def get_prestadores(
+    prestador: str = None, estabelecimento: str = None, servico: str = None
+) -> dict:
+    """
+    Prestadores que atendem no estabelecimento e oferecem o serviço, segundo
+    Funcionarios, como {id: (username, estabelecimento_id)}. Filtros não
+    informados não restringem; quem atende em mais de um dos estabelecimentos
+    encontrados fica com estabelecimento_id None (vale o expediente dele).
+    """
+
+    filtros = {}
+    if prestador:
+        filtros["prestador__username"] = prestador
+    if estabelecimento:
+        filtros["estabelecimento__nome_estabelecimento"] = estabelecimento
+    if servico:
+        filtros["servico__servico"] = servico
+
+    prestadores = {}
+    funcionarios = (
+        Funcionarios.objects.filter(**filtros)
+        .order_by("prestador__username")
+        .values_list("prestador_id", "prestador__username", "estabelecimento_id")
     )
-    fim_pausa = datetime(data.year, data.month, data.day, 13, 00, tzinfo=timezone.utc)
-    delta = timedelta(minutes=30)
-    horarios_disponiveis = []
-
-    if data.weekday() == 5:
-        while inicio < fim_sabado:
-            if not Agendamento.objects.filter(
-                data_horario=inicio, states="CONF"
-            ).exists():
-                horarios_disponiveis.append(inicio)
-            inicio = inicio + delta
+    for prestador_id, username, estabelecimento_id in funcionarios:
+        if prestador_id in prestadores:
+            estabelecimento_id = None
+        prestadores[prestador_id] = (username, estabelecimento_id)
+    return prestadores
+
+
+# Dias da primeira janela lida por busca_proximos_horarios; cada janela
+# seguinte tem o dobro do tamanho da anterior.
+JANELA_BUSCA = 7
+
+
+def busca_proximos_horarios(
+    a_partir_de: datetime,
+    prestadores: dict,
+    duracao: timedelta = None,
+    quantidade: int = 5,
+    dias: int = 90,
+) -> list:
+    """
+    Os primeiros `quantidade` horários a partir de `a_partir_de` em que algum
+    dos prestadores ({prestador_id: estabelecimento_id}, como em
+    get_horarios_disponiveis_prestadores) está livre, como [(horario,
+    [prestador_id])], procurando em no máximo `dias` dias.
+
+    Os dias são lidos em janelas de JANELA_BUSCA dias, dobrando a cada
+    janela, com uma consulta de ocupação por janela (ou nenhuma, se estiver
+    no cache); a busca para na primeira janela em que os horários aparecem.
+    """
+
+    livres = {}
+    inicio = get_dia(a_partir_de)
+    ultimo = inicio + timedelta(days=dias - 1)
+    tamanho = JANELA_BUSCA
+    while prestadores and inicio <= ultimo and len(livres) < quantidade:
+        fim = min(inicio + timedelta(days=tamanho - 1), ultimo)
+        horarios_periodo = get_horarios_disponiveis_prestadores(
+            inicio,
+            fim,
+            prestadores,
+            ocupacao=get_ocupacao_em_cache(inicio, fim, prestadores),
+            duracao=duracao,
+        )
+        for dia in sorted(horarios_periodo):
+            for prestador_id, horarios in horarios_periodo[dia].items():
+                for horario in horarios:
+                    if horario >= a_partir_de:
+                        livres.setdefault(horario, []).append(prestador_id)
+            if len(livres) >= quantidade:
+                break
+        inicio, tamanho = fim + timedelta(days=1), tamanho * 2
+
+    return [(horario, livres[horario]) for horario in sorted(livres)[:quantidade]]
+
+
+def _chave_versao_horarios(prestador_id: int = None) -> str:
+    if prestador_id is None:
+        return "horarios:versao"
+    return f"horarios:versao:{prestador_id}"
+
+
+def _chave_periodo(tipo: str, inicio: date, fim: date, prestador_ids=None) -> str:
+    """
+    Chave da entrada de cache de um período, com a versão atual dos horários
+    de cada prestador (sem prestador_ids, a de todos). invalida_horarios
+    descarta as versões; as entradas antigas deixam de ser lidas e expiram.
+    """
+    if prestador_ids is None:
+        chaves = [_chave_versao_horarios()]
     else:
-        while inicio < fim:
-            if not Agendamento.objects.filter(
-                data_horario=inicio, states="CONF"
-            ).exists():
-                if not inicio_pausa <= inicio < fim_pausa:
-                    horarios_disponiveis.append(inicio)
-            inicio = inicio + delta
+        chaves = [_chave_versao_horarios(pid) for pid in sorted(prestador_ids)]
+    versoes = cache.get_many(chaves)
+    novas = {chave: uuid.uuid4().hex for chave in chaves if chave not in versoes}
+    if novas:
+        cache.set_many(novas, settings.HORARIOS_CACHE_TTL.total_seconds())
+        versoes.update(novas)
+    marca = hashlib.sha256(
+        " ".join(versoes[chave] for chave in chaves).encode()
+    ).hexdigest()
+    return f"{tipo}:{inicio.isoformat()}:{fim.isoformat()}:{marca}"
+
+
+def get_horarios_disponiveis_em_cache(inicio: date, fim: date) -> dict:
+    """
+    Como get_horarios_disponiveis_periodo, mas guardando o período inteiro em
+    uma entrada de cache, descartada quando um agendamento muda.
+    """
+    chave = _chave_periodo("horarios", inicio, fim)
+    horarios = cache.get(chave)
+    if horarios is None:
+        if inicio == fim:
+            horarios = {inicio: list(get_horarios_disponiveis(inicio))}
+        else:
+            horarios = get_horarios_disponiveis_periodo(inicio, fim)
+        cache.set(chave, horarios, settings.HORARIOS_CACHE_TTL.total_seconds())
+    return horarios
+
+
+def get_ocupacao_em_cache(inicio: date, fim: date, prestador_ids) -> dict:
+    """
+    Como get_ocupacao, mas guardando o período em uma entrada de cache,
+    descartada quando um agendamento de algum dos prestadores muda.
+    """
+    chave = _chave_periodo("ocupacao", inicio, fim, prestador_ids)
+    ocupacao = cache.get(chave)
+    if ocupacao is None:
+        ocupacao = get_ocupacao(inicio, fim, list(prestador_ids))
+        cache.set(chave, ocupacao, settings.HORARIOS_CACHE_TTL.total_seconds())
+    return ocupacao
 
-    return horarios_disponiveis
+
+def invalida_horarios(*agendamentos):
+    """
+    Descarta do cache os horários disponíveis e a ocupação guardados para os
+    prestadores de `agendamentos`, pares (prestador_id, data_horario). Como
+    em incrementa_versao_catalogo, descarta de novo após o commit.
+    """
+    chaves = {
+        _chave_versao_horarios(prestador_id)
+        for prestador_id, data_horario in agendamentos
+        if data_horario is not None
+    }
+    if not chaves:
+        return
+    chaves.add(_chave_versao_horarios())
+    cache.delete_many(chaves)
+    transaction.on_commit(lambda: cache.delete_many(chaves))
+
+
+_cache_cep = CacheLRU(
+    tamanho_maximo=settings.CEP_CACHE_TAMANHO,
+    ttl=settings.CEP_CACHE_TTL.total_seconds(),
+)
+# Requisições concorrentes pelo mesmo CEP viram uma só
+_busca_cep_agrupada = ChamadaUnica("brasil_api:cep")
 
 
 def verifica_cep(cep: str):
-    logging.info(f"Fazendo requisição para BrasilAPI com o CEP: {cep}")
+    """
+    Consulta o CEP na BrasilAPI. Retorna os dados do endereço ou False se o CEP
+    não for válido. As respostas, inclusive de CEPs inválidos, ficam em cache.
+    """
+    encontrado, info = _cache_cep.get(cep)
+    if encontrado:
+        return info
 
-    r = requests.get(f"https://brasilapi.com.br/api/cep/v2/{cep}")
+    info = _busca_cep_agrupada.executa(cep, lambda: brasil_api.busca_cep(cep))
+
+    if info is None:
+        return False
 
-    if not r.status_code == 200:
-        logging.error("Algum erro ocorreu na Brasil API")
+    if info is False:
+        _cache_cep.set(cep, False, ttl=settings.CEP_CACHE_TTL_INVALIDO.total_seconds())
         return False
 
-    info = r.json()
+    _cache_cep.set(cep, info)
     return info
+
+
+def _chave_versao_catalogo(tabela: str) -> str:
+    return f"catalogo:versao:{tabela}"
+
+
+def incrementa_versao_catalogo(tabela: str):
+    """
+    Marca a tabela de catálogo como alterada. O cache da versão é descartado
+    agora e de novo após o commit, caso alguém tenha guardado a versão antiga
+    enquanto a transação estava aberta.
+    """
+    agora = django_timezone.now()
+    atualizadas = VersaoCatalogo.objects.filter(tabela=tabela).update(
+        versao=F("versao") + 1, atualizado_em=agora
+    )
+    if not atualizadas:
+        VersaoCatalogo.objects.bulk_create(
+            [VersaoCatalogo(tabela=tabela, versao=1, atualizado_em=agora)],
+            ignore_conflicts=True,
+        )
+    chave = _chave_versao_catalogo(tabela)
+    cache.delete(chave)
+    transaction.on_commit(lambda: cache.delete(chave))
+
+
+def get_versoes_catalogo(tabelas: Iterable[str]) -> dict:
+    """
+    Retorna {tabela: (versao, atualizado_em)}. Lê do cache e busca as que
+    faltam em uma única consulta; tabelas nunca alteradas têm versão 0.
+    """
+    chaves = {_chave_versao_catalogo(tabela): tabela for tabela in tabelas}
+    versoes = {chaves[chave]: valor for chave, valor in cache.get_many(chaves).items()}
+
+    faltando = [tabela for tabela in chaves.values() if tabela not in versoes]
+    if faltando:
+        encontradas = {
+            tabela: (versao, atualizado_em)
+            for tabela, versao, atualizado_em in VersaoCatalogo.objects.filter(
+                tabela__in=faltando
+            ).values_list("tabela", "versao", "atualizado_em")
+        }
+        novas = {tabela: encontradas.get(tabela, (0, None)) for tabela in faltando}
+        cache.set_many(
+            {_chave_versao_catalogo(tabela): valor for tabela, valor in novas.items()},
+            settings.CATALOGO_VERSAO_CACHE_TTL.total_seconds(),
+        )
+        versoes.update(novas)
+
+    return versoes
@@ -3,12 +3,19 @@ import email
 from genericpath import exists
 from django.utils import timezone
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from rest_framework.response import Response
-from rest_framework import generics, permissions, serializers
+from rest_framework import exceptions, generics, permissions, serializers, status
 from rest_framework.decorators import api_view
 
+from agenda.idempotencia import executa_idempotente, get_impressao
+from agenda.lote import grava_lote, valida_lote
 from agenda.models import (
     Agendamento,
     Endereco,
@@ -17,16 +24,31 @@ from agenda.models import (
     Estabelecimento,
     Servicos,
 )
+from agenda.pagination import PaginacaoAgendamentos, PaginacaoCursor
+from agenda.respostas import JsonEmFluxoResponse, itera_linhas
 from agenda.serializers import (
+    AgendamentoLeitura,
+    AgendamentoLoteSerializer,
     AgendamentoSerializer,
     EnderecoSerializer,
     EstabelecimentoSerializer,
+    FidelidadeLeitura,
     FidelidadeSerializer,
     FuncionarioSerializer,
     PrestadorSerializer,
+    ServicosLeitura,
     ServicosSerializer,
 )
-from agenda.utils import get_horarios_disponiveis
+from agenda.utils import (
+    AcumuladorFidelidade,
+    busca_proximos_horarios,
+    get_horarios_disponiveis_em_cache,
+    get_horarios_disponiveis_prestadores,
+    get_ocupacao_em_cache,
+    get_prestadores,
+    get_mapa_identidade,
+    get_versoes_catalogo,
+)
 
 
 class IsOwnerOrCreateOnly(permissions.BasePermission):
@@ -46,43 +68,126 @@ class IsPrestador(permissions.BasePermission):
         return False
 
 
-class AgendamentoList(generics.ListCreateAPIView):
+class HorarioIndisponivel(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Este horário não está disponível!"
+    default_code = "horario_indisponivel"
+
+
+class ChaveIdempotenciaReutilizada(exceptions.APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "A Idempotency-Key já foi usada com outra requisição!"
+    default_code = "chave_idempotencia_reutilizada"
+
+
+class ListagemRapidaMixin:
+    """
+    Faz o GET da listagem com `serializer_leitura_class` (um SerializerLeitura)
+    em vez do serializer do modelo; os demais métodos não mudam.
+    """
+
+    serializer_leitura_class = None
+
+    def list(self, request, *args, **kwargs):
+        leitura = self.serializer_leitura_class
+        queryset = leitura.prepara(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(leitura(page, many=True).data)
+        return Response(leitura(queryset, many=True).data)
+
+
+class GetCondicionalMixin:
+    """
+    Responde o GET com ETag e Last-Modified derivados da versão das tabelas
+    em `tabelas_catalogo`; se o cliente já tem essa versão, devolve 304 sem
+    consultar nem serializar a listagem.
+    """
+
+    tabelas_catalogo = ()
+
+    def get(self, request, *args, **kwargs):
+        versoes = get_versoes_catalogo(self.tabelas_catalogo)
+        etag = "-".join(
+            f"{tabela}.{versao}" for tabela, (versao, _) in sorted(versoes.items())
+        )
+        alteracoes = [atualizado_em for _, atualizado_em in versoes.values()]
+        ultima_alteracao = None if None in alteracoes else max(alteracoes)
+
+        get_condicional = condition(
+            etag_func=lambda *args, **kwargs: etag,
+            last_modified_func=lambda *args, **kwargs: ultima_alteracao,
+        )(super().get)
+        return get_condicional(request, *args, **kwargs)
+
+
+def salva_agendamento(serializer):
+    """
+    Salva o agendamento em um savepoint. Se outra requisição confirmou o mesmo
+    horário para o prestador depois da validação, a constraint
+    agendamento_horario_confirmado_unique é violada e retornamos 409.
+    """
+    try:
+        with transaction.atomic():
+            serializer.save()
+    except IntegrityError:
+        raise HorarioIndisponivel()
+
+
+class AgendamentoList(ListagemRapidaMixin, generics.ListCreateAPIView):
     serializer_class = AgendamentoSerializer
+    serializer_leitura_class = AgendamentoLeitura
     permission_classes = [IsOwnerOrCreateOnly]
+    pagination_class = PaginacaoAgendamentos
 
     def post(self, request, *args, **kwargs):
+        chave = request.headers.get("Idempotency-Key")
+        if chave is None:
+            return self.cria(request, *args, **kwargs)
+        if not chave or len(chave) > 255:
+            raise serializers.ValidationError(
+                "A Idempotency-Key deve ter de 1 a 255 caracteres!"
+            )
 
-        serializer = AgendamentoSerializer(data=request.data)
-        data = request.data
-        nome_cliente = data["nome_cliente"]
-        prestador_request = data["prestador"]
-        prestador = User.objects.filter(username=prestador_request).first()
-        estabelecimento = data["estabelecimento"]
-        fidelidade_usuario = Fidelidade.objects.filter(
-            nome_cliente=nome_cliente, prestador__username=prestador_request
-        )
+        # Guarda o corpo da resposta se esta requisição executar o POST; a
+        # resposta devolvida é de outra requisição se não for esse mesmo corpo.
+        executada = []
 
-        estabelecimento_obj = Estabelecimento.objects.filter(
-            nome_estabelecimento=estabelecimento
-        )
+        def cria():
+            response = self.cria(request, *args, **kwargs)
+            executada.append(response.data)
+            return response.status_code, response.data
+
+        impressao = get_impressao(request.data)
+        resposta = executa_idempotente(chave, impressao, cria)
+        if resposta.impressao != impressao:
+            raise ChaveIdempotenciaReutilizada()
 
-        if serializer.is_valid():
-            if estabelecimento_obj.exists():
-                if Funcionarios.objects.filter(
-                    prestador__username=prestador_request,
-                    estabelecimento=estabelecimento_obj.first(),
-                ).exists():
-                    if fidelidade_usuario.exists():
-                        fidelidade_usuario = fidelidade_usuario.first()
-                        fidelidade_usuario.nivel_fidelidade += 1
-                        fidelidade_usuario.save()
-                    else:
-                        Fidelidade.objects.create(
-                            nome_cliente=nome_cliente, prestador=prestador
-                        )
+        response = Response(resposta.corpo, status=resposta.status)
+        if not executada or resposta.corpo is not executada[0]:
+            response["Idempotent-Replayed"] = "true"
+        return response
 
+    @transaction.atomic
+    def cria(self, request, *args, **kwargs):
         return super().post(request, *args, **kwargs)
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["mapa_identidade"] = get_mapa_identidade(self.request)
+        return context
+
+    def perform_create(self, serializer):
+        salva_agendamento(serializer)
+
+        fidelidade = AcumuladorFidelidade()
+        fidelidade.adiciona(
+            serializer.validated_data["nome_cliente"],
+            serializer.validated_data["prestador"],
+        )
+        fidelidade.grava()
+
     def get_queryset(self):
         executado = self.request.query_params.get("executado", None)
         confirmado = self.request.query_params.get("confirmado", None)
@@ -112,30 +217,145 @@ class AgendamentoList(generics.ListCreateAPIView):
             )
 
 
+MAX_ITENS_LOTE = 1000
+
+
+class AgendamentoLote(generics.GenericAPIView):
+    """
+    Cria uma lista de agendamentos em uma requisição. Cada item é validado
+    como em POST /agendamentos/, com consultas feitas para o lote inteiro, e
+    os válidos são gravados juntos. A resposta traz o resultado de cada
+    item, na ordem enviada: 201 se todos foram criados, 400 se nenhum foi e
+    207 se só parte deles.
+    """
+
+    serializer_class = AgendamentoLoteSerializer
+    permission_classes = [IsOwnerOrCreateOnly]
+
+    @transaction.atomic
+    def post(self, request, *args, **kwargs):
+        itens = request.data
+        if not isinstance(itens, list) or not itens:
+            raise serializers.ValidationError("Envie uma lista de agendamentos!")
+        if len(itens) > MAX_ITENS_LOTE:
+            raise serializers.ValidationError(
+                f"O lote pode ter no máximo {MAX_ITENS_LOTE} agendamentos!"
+            )
+
+        validados = valida_lote(itens)
+        validos = [serializer for serializer in validados if not serializer.errors]
+        try:
+            with transaction.atomic():
+                grava_lote(validos)
+        except IntegrityError:
+            raise HorarioIndisponivel()
+
+        resultados = [
+            {"status": status.HTTP_400_BAD_REQUEST, "erros": serializer.errors}
+            if serializer.errors
+            else {"status": status.HTTP_201_CREATED, "agendamento": serializer.data}
+            for serializer in validados
+        ]
+        if not validos:
+            codigo = status.HTTP_400_BAD_REQUEST
+        elif len(validos) < len(validados):
+            codigo = status.HTTP_207_MULTI_STATUS
+        else:
+            codigo = status.HTTP_201_CREATED
+        return Response(resultados, status=codigo)
+
+
 class AgendamentoDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsPrestador]
     queryset = Agendamento.objects.filter(cancelado=False)
     serializer_class = AgendamentoSerializer
     lookup_field = "id"  # pk
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["mapa_identidade"] = get_mapa_identidade(self.request)
+        return context
+
+    def perform_update(self, serializer):
+        salva_agendamento(serializer)
+
     def perform_destroy(self, instance):
-        instance.cancelado = True
-        instance.save()
+        # O cancelamento e a atualização da ocupação (no post_save) são
+        # gravados juntos
+        with transaction.atomic():
+            instance.cancelado = True
+            instance.save()
 
 
-class FidelidadeList(generics.ListAPIView):
+class FidelidadeList(ListagemRapidaMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PaginacaoCursor
     serializer_class = FidelidadeSerializer
+    serializer_leitura_class = FidelidadeLeitura
 
     def get_queryset(self):
         username = self.request.query_params.get("username", None)
         return Fidelidade.objects.filter(prestador__username=username)
 
 
+def le_data_horario(valor: str) -> datetime:
+    """Lê uma data/hora ISO 8601; sem fuso, considera o fuso atual."""
+    data_horario = datetime.fromisoformat(valor)
+    if timezone.is_naive(data_horario):
+        data_horario = timezone.make_aware(data_horario)
+    return data_horario
+
+
 class PrestadorList(generics.ListAPIView):
+    """
+    Lista os prestadores com os agendamentos ativos de uma janela de datas:
+    ``inicio`` e ``fim`` (por padrão, de agora até JANELA_PADRAO à frente) e,
+    opcionalmente, apenas os ``proximos`` N de cada prestador. Usa sempre duas
+    consultas: a página de usuários e os agendamentos de todos eles.
+    """
+
+    JANELA_PADRAO = timedelta(days=30)
+    MAX_PROXIMOS = 100
+
     permission_classes = [permissions.IsAdminUser]
     serializer_class = PrestadorSerializer
-    queryset = User.objects.all()
+    pagination_class = PaginacaoCursor
+
+    def get_janela(self):
+        inicio = self.request.query_params.get("inicio")
+        fim = self.request.query_params.get("fim")
+        try:
+            inicio = le_data_horario(inicio) if inicio else timezone.now()
+            fim = le_data_horario(fim) if fim else inicio + self.JANELA_PADRAO
+        except ValueError:
+            raise serializers.ValidationError("Período informado é inválido!")
+        return inicio, fim
+
+    def get_queryset(self):
+        inicio, fim = self.get_janela()
+        agendamentos = (
+            Agendamento.objects.filter(
+                cancelado=False, data_horario__gte=inicio, data_horario__lt=fim
+            )
+            .select_related("estabelecimento", "servico")
+            .order_by("data_horario", "id")
+        )
+        return User.objects.prefetch_related(
+            Prefetch("agendamentos", queryset=agendamentos)
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        try:
+            proximos = int(self.request.query_params.get("proximos", 0))
+        except ValueError:
+            raise serializers.ValidationError("proximos deve ser um número!")
+        if not 0 <= proximos <= self.MAX_PROXIMOS:
+            raise serializers.ValidationError(
+                f"proximos deve ser de 0 a {self.MAX_PROXIMOS}!"
+            )
+        context["limite_agendamentos"] = proximos
+        return context
 
 
 class FuncionarioList(generics.ListCreateAPIView):
@@ -181,40 +401,234 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         return False
 
 
-class EstabelecimentoList(generics.ListCreateAPIView):
+class EstabelecimentoList(GetCondicionalMixin, generics.ListCreateAPIView):
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = PaginacaoCursor
     serializer_class = EstabelecimentoSerializer
+    tabelas_catalogo = ["estabelecimento"]
 
     def get_queryset(self):
         return Estabelecimento.objects.all()
 
 
-class ServicosList(generics.ListCreateAPIView):
+class ServicosList(
+    GetCondicionalMixin, ListagemRapidaMixin, generics.ListCreateAPIView
+):
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = PaginacaoCursor
     serializer_class = ServicosSerializer
+    serializer_leitura_class = ServicosLeitura
+    tabelas_catalogo = ["servicos"]
 
     def get_queryset(self):
         return Servicos.objects.all()
 
 
-class EnderecoList(generics.ListCreateAPIView):
+class EnderecoList(GetCondicionalMixin, generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = PaginacaoCursor
     serializer_class = EnderecoSerializer
+    # A listagem mostra o nome do estabelecimento de cada endereço
+    tabelas_catalogo = ["endereco", "estabelecimento"]
 
     def get_queryset(self):
         return Endereco.objects.all()
 
 
+MAX_DIAS_PERIODO = 62
+
+
+def get_periodo(query_params):
+    """
+    Lê o período pedido em /horarios/: ``inicio`` e ``fim`` (inclusive) ou
+    ``dias`` a partir de ``inicio`` (ou de hoje). Retorna None quando nenhum
+    desses parâmetros foi informado.
+    """
+    inicio = query_params.get("inicio")
+    fim = query_params.get("fim")
+    dias = query_params.get("dias")
+
+    if not inicio and not fim and not dias:
+        return None
+
+    try:
+        inicio = date.fromisoformat(inicio) if inicio else datetime.now().date()
+        if fim:
+            fim = date.fromisoformat(fim)
+        elif dias:
+            dias = int(dias)
+            if not 1 <= dias <= MAX_DIAS_PERIODO:
+                raise serializers.ValidationError(
+                    f"O período pode ter no máximo {MAX_DIAS_PERIODO} dias!"
+                )
+            fim = inicio + timedelta(days=dias - 1)
+        else:
+            raise serializers.ValidationError("Informe o fim do período ou os dias!")
+    except (ValueError, OverflowError):
+        raise serializers.ValidationError("Período informado é inválido!")
+
+    if fim < inicio:
+        raise serializers.ValidationError("O fim do período deve ser após o início!")
+
+    if (fim - inicio).days >= MAX_DIAS_PERIODO:
+        raise serializers.ValidationError(
+            f"O período pode ter no máximo {MAX_DIAS_PERIODO} dias!"
+        )
+
+    return inicio, fim
+
+
+def lista_horarios_prestadores(horarios_por_prestador: dict, prestadores: dict):
+    """
+    Converte {prestador_id: horarios} na lista de horários com ao menos um
+    prestador livre, cada um com os usernames dos prestadores livres.
+    `prestadores` é o retorno de get_prestadores.
+    """
+    livres = {}
+    for prestador_id, horarios in horarios_por_prestador.items():
+        for horario in horarios:
+            livres.setdefault(horario, []).append(prestadores[prestador_id][0])
+    return [
+        {"horario": horario, "prestadores": sorted(livres[horario])}
+        for horario in sorted(livres)
+    ]
+
+
+def get_duracao_servico(servico: str = None):
+    """Duração do serviço pelo nome, ou None sem serviço (grade do expediente)."""
+    if not servico:
+        return None
+    return (
+        Servicos.objects.filter(servico=servico)
+        .values_list("duracao", flat=True)
+        .first()
+    )
+
+
 @api_view(http_method_names=["GET"])
 def get_horarios(request):
-    data = request.query_params.get("data")
-    if not data:
-        data = datetime.now().date()
+    filtros = {
+        campo: request.query_params.get(campo)
+        for campo in ("prestador", "estabelecimento", "servico")
+        if request.query_params.get(campo)
+    }
+    prestadores = get_prestadores(**filtros) if filtros else None
+
+    periodo = get_periodo(request.query_params)
+    if periodo:
+        inicio, fim = periodo
     else:
-        data = datetime.fromisoformat(data).date()
+        data = request.query_params.get("data")
+        if not data:
+            data = datetime.now().date()
+        else:
+            data = datetime.fromisoformat(data).date()
+        inicio = fim = data
+
+    if prestadores is None:
+        horarios_periodo = get_horarios_disponiveis_em_cache(inicio, fim)
+        formata = sorted
+    else:
+        horarios_periodo = get_horarios_disponiveis_prestadores(
+            inicio,
+            fim,
+            {
+                pid: estabelecimento_id
+                for pid, (_, estabelecimento_id) in prestadores.items()
+            },
+            ocupacao=get_ocupacao_em_cache(inicio, fim, prestadores),
+            duracao=get_duracao_servico(filtros.get("servico")),
+        )
 
-    horarios_disponiveis = sorted(list(get_horarios_disponiveis(data)))
-    return JsonResponse(horarios_disponiveis, safe=False)
+        def formata(horarios):
+            return lista_horarios_prestadores(horarios, prestadores)
+
+    if periodo:
+        response = JsonResponse(
+            {
+                dia.isoformat(): formata(horarios)
+                for dia, horarios in horarios_periodo.items()
+            }
+        )
+    else:
+        response = JsonResponse(formata(horarios_periodo[inicio]), safe=False)
+
+    patch_cache_control(
+        response, public=True, max_age=int(settings.HORARIOS_MAX_AGE.total_seconds())
+    )
+    return response
+
+
+MAX_DIAS_BUSCA = 90
+MAX_PROXIMOS_HORARIOS = 50
+
+
+@api_view(http_method_names=["GET"])
+def get_proximos_horarios(request):
+    """
+    Os primeiros horários livres para o ``servico`` (obrigatório), com os
+    mesmos filtros opcionais de /horarios/, a partir de ``a_partir_de`` (por
+    padrão, agora): até ``quantidade`` horários (5 por padrão), procurados em
+    no máximo ``dias`` dias (MAX_DIAS_BUSCA).
+    """
+    servico = request.query_params.get("servico")
+    if not servico:
+        raise serializers.ValidationError("Informe o serviço!")
+
+    try:
+        quantidade = int(request.query_params.get("quantidade", 5))
+        dias = int(request.query_params.get("dias", MAX_DIAS_BUSCA))
+        a_partir_de = timezone.now()
+        if request.query_params.get("a_partir_de"):
+            a_partir_de = max(
+                le_data_horario(request.query_params["a_partir_de"]), a_partir_de
+            )
+    except ValueError:
+        raise serializers.ValidationError("Parâmetros de busca inválidos!")
+
+    if not 1 <= quantidade <= MAX_PROXIMOS_HORARIOS:
+        raise serializers.ValidationError(
+            f"A quantidade deve ser de 1 a {MAX_PROXIMOS_HORARIOS}!"
+        )
+    if not 1 <= dias <= MAX_DIAS_BUSCA:
+        raise serializers.ValidationError(
+            f"A busca pode ter no máximo {MAX_DIAS_BUSCA} dias!"
+        )
+
+    duracao = get_duracao_servico(servico)
+    if duracao is None:
+        raise serializers.ValidationError("O serviço informado não existe!")
+
+    prestadores = get_prestadores(
+        prestador=request.query_params.get("prestador"),
+        estabelecimento=request.query_params.get("estabelecimento"),
+        servico=servico,
+    )
+    proximos = busca_proximos_horarios(
+        a_partir_de,
+        {
+            pid: estabelecimento_id
+            for pid, (_, estabelecimento_id) in prestadores.items()
+        },
+        duracao,
+        quantidade,
+        dias,
+    )
+
+    response = JsonResponse(
+        [
+            {
+                "horario": horario,
+                "prestadores": sorted(prestadores[pid][0] for pid in prestador_ids),
+            }
+            for horario, prestador_ids in proximos
+        ],
+        safe=False,
+    )
+    patch_cache_control(
+        response, public=True, max_age=int(settings.HORARIOS_MAX_AGE.total_seconds())
+    )
+    return response
 
 
 @api_view(http_method_names=["GET"])
@@ -260,17 +674,7 @@ def users(request):
         return JsonResponse(obj, safe=False)
 
     if request.method == "GET":
-        qs = User.objects.all()
-        users_list = []
-
-        for user in qs:
-            users_list.append(
-                {
-                    "id": user.id,
-                    "username": user.username,
-                    "email": user.email,
-                    "is_staff": user.is_staff,
-                }
-            )
-
-        return JsonResponse(users_list, safe=False)
+        qs = User.objects.order_by("id")
+        return JsonEmFluxoResponse(
+            itera_linhas(qs, ["id", "username", "email", "is_staff"])
+        )
@@ -0,0 +1,127 @@
+"""
+Compara a criação de N agendamentos com N requisições a POST /api/agendamentos/
+e com uma requisição a POST /api/agendamentos/batch/, em tempo total, tempo
+por item e número de consultas ao banco.
+
+    python -m benchmarks.agendamento_lote --itens 1 100 1000
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import time
+
+from benchmarks.ambiente import banco_de_teste, configura_django
+
+PRESTADORES = 10
+
+
+def prepara_dados():
+    from django.contrib.auth.models import User
+
+    from agenda.models import Estabelecimento, Funcionarios, Servicos
+
+    estabelecimento = Estabelecimento.objects.create(
+        nome_estabelecimento="Salão de Beleza"
+    )
+    servico = Servicos.objects.create(servico="Manicure")
+    for i in range(PRESTADORES):
+        prestador = User.objects.create(
+            username=f"prestador{i}", email=f"prestador{i}@email.com"
+        )
+        Funcionarios.objects.create(
+            prestador=prestador, estabelecimento=estabelecimento, servico=servico
+        )
+
+
+def horarios_livres():
+    """Horários da grade padrão (dias úteis, 9h às 12h e 13h às 18h) de 2031."""
+    dia = datetime(2031, 1, 6, tzinfo=timezone.utc)
+    while True:
+        if dia.weekday() < 5:
+            for hora in [9, 10, 11, 13, 14, 15, 16, 17]:
+                for minuto in (0, 30):
+                    yield dia.replace(hour=hora, minute=minuto)
+        dia += timedelta(days=1)
+
+
+def gera_itens(quantidade, horarios, rotulo):
+    itens = []
+    while len(itens) < quantidade:
+        horario = next(horarios)
+        for i in range(PRESTADORES):
+            n = len(itens)
+            itens.append(
+                {
+                    "prestador": f"prestador{i}",
+                    "estabelecimento": "Salão de Beleza",
+                    "servico": "Manicure",
+                    "data_horario": horario.isoformat(),
+                    "nome_cliente": f"Cliente {rotulo}-{n}",
+                    "email_cliente": f"cliente{rotulo}-{n}@email.com",
+                    "telefone_cliente": "123123123",
+                    "states": "CONF",
+                }
+            )
+    return itens[:quantidade]
+
+
+class ContaConsultas:
+    """Conta as consultas sem guardá-las (connection.queries guarda só 9000)."""
+
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        return execute(sql, params, many, context)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--itens", type=int, nargs="+", default=[1, 100, 1000])
+    args = parser.parse_args()
+
+    configura_django()
+    from django.db import connection
+    from rest_framework.test import APIClient
+
+    cliente = APIClient()
+    with banco_de_teste():
+        prepara_dados()
+        horarios = horarios_livres()
+        for quantidade in args.itens:
+            print(f"\n{quantidade} agendamentos")
+
+            itens = gera_itens(quantidade, horarios, f"seq{quantidade}")
+            consultas = ContaConsultas()
+            with connection.execute_wrapper(consultas):
+                inicio = time.perf_counter()
+                criados = sum(
+                    cliente.post("/api/agendamentos/", item, format="json").status_code
+                    == 201
+                    for item in itens
+                )
+                duracao = time.perf_counter() - inicio
+            print(
+                f"  {'sequencial':<10} {duracao * 1000:.1f} ms, "
+                f"{duracao / quantidade * 1000:.2f} ms/item, "
+                f"{consultas.total} consultas, {criados} criados"
+            )
+
+            itens = gera_itens(quantidade, horarios, f"lote{quantidade}")
+            consultas = ContaConsultas()
+            with connection.execute_wrapper(consultas):
+                inicio = time.perf_counter()
+                response = cliente.post(
+                    "/api/agendamentos/batch/", itens, format="json"
+                )
+                duracao = time.perf_counter() - inicio
+            criados = sum(item["status"] == 201 for item in response.json())
+            print(
+                f"  {'lote':<10} {duracao * 1000:.1f} ms, "
+                f"{duracao / quantidade * 1000:.2f} ms/item, "
+                f"{consultas.total} consultas, {criados} criados"
+            )
+
+
+if __name__ == "__main__":
+    main()
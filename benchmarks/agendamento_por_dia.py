@@ -0,0 +1,78 @@
+"""
+Compara a verificação de "um agendamento por cliente e dia" feita com
+`data_horario__date` e sem o índice agendamento_cliente_dia_idx (antiga) com
+a feita pelo intervalo [início, fim) do dia usando o índice (atual), à medida
+que o histórico do prestador cresce.
+
+    python -m benchmarks.agendamento_por_dia --linhas 1000 10000 100000
+"""
+import argparse
+from datetime import timedelta
+import time
+
+from benchmarks.ambiente import banco_de_teste, configura_django, resume_tempos
+from benchmarks.dados import horario_mais_recente, popula_agendamentos
+
+PRESTADORES = 5
+
+
+def mede(queryset, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        queryset.exists()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--linhas", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeticoes", type=int, default=50)
+    args = parser.parse_args()
+
+    configura_django()
+    from django.db import connection
+
+    from agenda.models import Agendamento
+    from agenda.utils import get_intervalo_do_dia
+
+    for linhas in args.linhas:
+        with banco_de_teste():
+            prestadores = popula_agendamentos(linhas, prestadores=PRESTADORES)
+            dia = horario_mais_recente(linhas, PRESTADORES) - timedelta(days=1)
+            inicio_dia, fim_dia = get_intervalo_do_dia(dia)
+            filtros = {
+                "nome_cliente": "Cliente 7",
+                "email_cliente": "cliente7@email.com",
+                "prestador": prestadores[0],
+                "cancelado": False,
+            }
+            antiga = Agendamento.objects.filter(data_horario__date=dia, **filtros)
+            atual = Agendamento.objects.filter(
+                data_horario__gte=inicio_dia, data_horario__lt=fim_dia, **filtros
+            )
+
+            indice = next(
+                indice
+                for indice in Agendamento._meta.indexes
+                if indice.name == "agendamento_cliente_dia_idx"
+            )
+            with connection.schema_editor() as editor:
+                editor.remove_index(Agendamento, indice)
+            tempos_antiga = mede(antiga, args.repeticoes)
+            plano_antiga = antiga.explain()
+            with connection.schema_editor() as editor:
+                editor.add_index(Agendamento, indice)
+            tempos_atual = mede(atual, args.repeticoes)
+            plano_atual = atual.explain()
+
+            print(f"\n{linhas} agendamentos ({linhas // PRESTADORES} por prestador)")
+            print(f"  antiga: {resume_tempos(tempos_antiga)}")
+            print(f"    {plano_antiga}")
+            print(f"  atual:  {resume_tempos(tempos_atual)}")
+            print(f"    {plano_atual}")
+
+
+if __name__ == "__main__":
+    main()
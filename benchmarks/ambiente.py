@@ -0,0 +1,51 @@
+"""
+Preparação comum dos benchmarks: configura o Django e cria um banco de teste
+descartável, para que os benchmarks nunca toquem no banco configurado.
+
+Os benchmarks usam o banco definido em DJANGO_SETTINGS_MODULE (por padrão
+tamarcado.settings.dev). Para resultados próximos dos de produção, rode com as
+configurações do PostgreSQL.
+"""
+from contextlib import contextmanager
+import logging
+import os
+import statistics
+
+import django
+
+
+def configura_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tamarcado.settings.dev")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    django.setup()
+    # Os logs de cada requisição distorcem as medições
+    logging.disable(logging.CRITICAL)
+
+
+@contextmanager
+def banco_de_teste():
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    if connection.vendor == "sqlite":
+        # O banco de teste do SQLite fica em memória por padrão, o que não
+        # permite escritas concorrentes de várias threads.
+        connection.settings_dict["TEST"]["NAME"] = "benchmark.sqlite3"
+    nome_original = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(nome_original, verbosity=0)
+        teardown_test_environment()
+
+
+def resume_tempos(tempos):
+    """Formata mediana e p95 de uma lista de tempos em segundos."""
+    ordenados = sorted(tempos)
+    p95 = ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.95))]
+    return (
+        f"mediana {statistics.median(ordenados) * 1000:.2f} ms, "
+        f"p95 {p95 * 1000:.2f} ms"
+    )
@@ -0,0 +1,57 @@
+"""Geração de dados em volume para os benchmarks."""
+from datetime import datetime, timedelta, timezone
+import random
+
+INICIO = datetime(2025, 1, 1, 9, tzinfo=timezone.utc)
+
+
+def popula_agendamentos(linhas: int, prestadores: int = 200, lote: int = 10000):
+    """
+    Cria `prestadores` usuários e `linhas` agendamentos distribuídos entre
+    eles: cada prestador ocupa horários consecutivos de 30 minutos a partir
+    de 2025, com 50% confirmados, 40% não confirmados, 10% executados e 10%
+    cancelados. Retorna a lista de prestadores.
+    """
+    from django.contrib.auth.models import User
+
+    from agenda.models import Agendamento, Estabelecimento, Servicos
+
+    aleatorio = random.Random(42)
+    estabelecimento = Estabelecimento.objects.create(
+        nome_estabelecimento="Salão de Beleza"
+    )
+    servico = Servicos.objects.create(servico="Manicure")
+    usuarios = User.objects.bulk_create(
+        [
+            User(username=f"prestador{i}", email=f"prestador{i}@email.com")
+            for i in range(prestadores)
+        ]
+    )
+    usuarios = list(User.objects.order_by("id"))
+
+    agendamentos = []
+    for i in range(linhas):
+        prestador = usuarios[i % prestadores]
+        cliente = aleatorio.randrange(linhas // 10 + 1)
+        agendamentos.append(
+            Agendamento(
+                prestador=prestador,
+                estabelecimento=estabelecimento,
+                servico=servico,
+                data_horario=INICIO + timedelta(minutes=30 * (i // prestadores)),
+                nome_cliente=f"Cliente {cliente}",
+                email_cliente=f"cliente{cliente}@email.com",
+                telefone_cliente="123123123",
+                states=aleatorio.choices(["CONF", "UNCO", "EXEC"], [5, 4, 1])[0],
+                cancelado=aleatorio.random() < 0.1,
+            )
+        )
+        if len(agendamentos) == lote:
+            Agendamento.objects.bulk_create(agendamentos)
+            agendamentos = []
+    Agendamento.objects.bulk_create(agendamentos)
+    return usuarios
+
+
+def horario_mais_recente(linhas: int, prestadores: int = 200) -> datetime:
+    return INICIO + timedelta(minutes=30 * ((linhas - 1) // prestadores))
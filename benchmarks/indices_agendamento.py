@@ -0,0 +1,107 @@
+"""
+Mede as consultas mais frequentes em Agendamento com e sem os índices
+compostos de agenda.models.Agendamento.Meta.indexes: popula o banco, remove
+os índices, registra plano e tempo de cada consulta, recria os índices e
+mede de novo.
+
+    python -m benchmarks.indices_agendamento --linhas 1000000
+"""
+import argparse
+from datetime import timedelta
+import time
+
+from benchmarks.ambiente import banco_de_teste, configura_django, resume_tempos
+from benchmarks.dados import horario_mais_recente, popula_agendamentos
+
+
+def consultas(prestador, agora, dia):
+    """As consultas de AgendamentoList, disponibilidade e duplicidade."""
+    from agenda.models import Agendamento
+
+    ativos = Agendamento.objects.filter(
+        prestador__username=prestador.username, cancelado=False
+    ).order_by("data_horario", "id")
+    return {
+        "lista confirmados": ativos.filter(states="CONF")[:51],
+        "lista não confirmados": ativos.filter(states="UNCO")[:51],
+        "lista executados": ativos.filter(data_horario__lt=agora, states="CONF")[:51],
+        "lista todos": ativos[:51],
+        "horários ocupados do dia": Agendamento.objects.filter(
+            data_horario__gte=dia,
+            data_horario__lt=dia + timedelta(hours=9),
+            states="CONF",
+            cancelado=False,
+        ).values_list("data_horario", flat=True),
+        "agendamento no mesmo dia": Agendamento.objects.filter(
+            nome_cliente="Cliente 7",
+            email_cliente="cliente7@email.com",
+            data_horario__gte=dia,
+            data_horario__lt=dia + timedelta(days=1),
+            prestador=prestador,
+            cancelado=False,
+        ),
+    }
+
+
+def mede(querysets, repeticoes):
+    resultados = {}
+    for nome, queryset in querysets.items():
+        plano = queryset.explain()
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            list(queryset.all())
+            tempos.append(time.perf_counter() - inicio)
+        resultados[nome] = (plano, tempos)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--linhas", type=int, default=1000000)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+
+    configura_django()
+    from django.db import connection
+
+    from agenda.models import Agendamento
+
+    with banco_de_teste():
+        inicio = time.perf_counter()
+        prestadores = popula_agendamentos(args.linhas)
+        print(
+            f"{args.linhas} agendamentos criados em {time.perf_counter() - inicio:.1f}s"
+        )
+
+        recente = horario_mais_recente(args.linhas)
+        querysets = consultas(
+            prestadores[0], recente - timedelta(days=30), recente - timedelta(days=1)
+        )
+        indices = Agendamento._meta.indexes
+
+        with connection.schema_editor() as editor:
+            for indice in indices:
+                editor.remove_index(Agendamento, indice)
+        if connection.vendor == "sqlite":
+            connection.cursor().execute("ANALYZE")
+        antes = mede(querysets, args.repeticoes)
+
+        with connection.schema_editor() as editor:
+            for indice in indices:
+                editor.add_index(Agendamento, indice)
+        if connection.vendor == "sqlite":
+            connection.cursor().execute("ANALYZE")
+        depois = mede(querysets, args.repeticoes)
+
+        for nome in querysets:
+            print(f"\n== {nome}")
+            for rotulo, resultados in (("sem índices", antes), ("com índices", depois)):
+                plano, tempos = resultados[nome]
+                print(f"  {rotulo}: {resume_tempos(tempos)}")
+                for linha in plano.splitlines():
+                    print(f"    {linha}")
+
+
+if __name__ == "__main__":
+    main()
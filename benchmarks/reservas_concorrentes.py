@@ -0,0 +1,114 @@
+"""
+Dispara várias requisições simultâneas de agendamento confirmado para o mesmo
+horário e verifica que exatamente uma é aceita.
+
+    python -m benchmarks.reservas_concorrentes --requisicoes 20 --rodadas 5
+
+No SQLite, escritas concorrentes falham com "database is locked" em vez de
+esperar a vez, então as requisições perdedoras aparecem como status 500 e às
+vezes nenhuma vence. O resultado só é representativo no PostgreSQL.
+"""
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+import threading
+import time
+
+from benchmarks.ambiente import banco_de_teste, configura_django, resume_tempos
+
+
+def prepara_dados():
+    from django.contrib.auth.models import User
+
+    from agenda.models import Estabelecimento, Funcionarios, Servicos
+
+    prestador = User.objects.create(username="prestador", email="p@email.com")
+    estabelecimento = Estabelecimento.objects.create(
+        nome_estabelecimento="Salão de Beleza"
+    )
+    servico = Servicos.objects.create(servico="Manicure")
+    Funcionarios.objects.create(
+        prestador=prestador, estabelecimento=estabelecimento, servico=servico
+    )
+
+
+def dispara(horario: datetime, requisicoes: int, rodada: int):
+    from django.db import connection
+    from rest_framework.test import APIClient
+
+    barreira = threading.Barrier(requisicoes)
+    resultados = []
+
+    def reserva(indice):
+        # Com várias threads, o cliente de teste receberia exceções das
+        # requisições das outras threads; erros viram status 500.
+        cliente = APIClient(raise_request_exception=False)
+        barreira.wait()
+        inicio = time.perf_counter()
+        response = cliente.post(
+            "/api/agendamentos/",
+            {
+                "prestador": "prestador",
+                "estabelecimento": "Salão de Beleza",
+                "servico": "Manicure",
+                "data_horario": horario.isoformat(),
+                "nome_cliente": f"Cliente {rodada}-{indice}",
+                "email_cliente": f"cliente{rodada}-{indice}@email.com",
+                "telefone_cliente": "123123123",
+                "states": "CONF",
+            },
+            format="json",
+        )
+        resultados.append((response.status_code, time.perf_counter() - inicio))
+        connection.close()
+
+    threads = [
+        threading.Thread(target=reserva, args=(indice,))
+        for indice in range(requisicoes)
+    ]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resultados, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requisicoes", type=int, default=20)
+    parser.add_argument("--rodadas", type=int, default=5)
+    args = parser.parse_args()
+
+    configura_django()
+    from django.db import connection
+
+    from agenda.models import Agendamento
+
+    if connection.vendor == "sqlite":
+        print("Aviso: SQLite não suporta escritas concorrentes; use o PostgreSQL.")
+
+    with banco_de_teste():
+        prepara_dados()
+        falhas = 0
+        for rodada in range(args.rodadas):
+            horario = datetime(2030, 1, 9, 9 + rodada, tzinfo=timezone.utc)
+            resultados, duracao = dispara(horario, args.requisicoes, rodada)
+            status = Counter(status for status, _ in resultados)
+            confirmados = Agendamento.objects.filter(
+                data_horario=horario, states="CONF", cancelado=False
+            ).count()
+            ok = status[201] == 1 and confirmados == 1
+            falhas += not ok
+            print(
+                f"{horario:%H:%M} {'OK' if ok else 'FALHOU'} "
+                f"status={dict(status)} confirmados={confirmados} "
+                f"{args.requisicoes / duracao:.1f} req/s "
+                f"({resume_tempos([tempo for _, tempo in resultados])})"
+            )
+        if falhas:
+            raise SystemExit(f"{falhas} rodada(s) sem exatamente um vencedor")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compara o custo por linha da listagem de agendamentos serializada com
+AgendamentoSerializer (um modelo por linha e um SELECT por chave estrangeira
+não carregada) e com AgendamentoLeitura (values() com os nomes por join),
+incluindo a consulta ao banco.
+
+    python -m benchmarks.serializacao_listagem --linhas 50 200 1000
+"""
+import argparse
+import time
+
+from benchmarks.ambiente import banco_de_teste, configura_django, resume_tempos
+from benchmarks.dados import popula_agendamentos
+
+
+def mede(serializa, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        serializa()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--linhas", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+
+    configura_django()
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from agenda.models import Agendamento
+    from agenda.serializers import AgendamentoLeitura, AgendamentoSerializer
+
+    with banco_de_teste():
+        popula_agendamentos(max(args.linhas), prestadores=1)
+        for linhas in args.linhas:
+            queryset = Agendamento.objects.order_by("data_horario", "id")[:linhas]
+            variantes = {
+                "serializer": lambda: AgendamentoSerializer(queryset, many=True).data,
+                "leitura": lambda: AgendamentoLeitura(
+                    AgendamentoLeitura.prepara(queryset)
+                ).data,
+            }
+
+            print(f"\n{linhas} agendamentos")
+            for nome, serializa in variantes.items():
+                with CaptureQueriesContext(connection) as consultas:
+                    serializa()
+                tempos = mede(serializa, args.repeticoes)
+                por_linha = sorted(tempos)[len(tempos) // 2] / linhas * 1e6
+                print(
+                    f"  {nome:<10} {resume_tempos(tempos)}, "
+                    f"{por_linha:.1f} µs/linha, {len(consultas)} consultas"
+                )
+
+
+if __name__ == "__main__":
+    main()
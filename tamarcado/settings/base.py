@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
 import os
+from datetime import timedelta
 from pathlib import Path
 import sys
 
@@ -133,6 +134,76 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 TESTING = False
 
+# Cliente HTTP da BrasilAPI: timeouts (conexão, leitura) em segundos, número de
+# novas tentativas para erros temporários e quantas falhas seguidas abrem o
+# disjuntor, que então recusa chamadas por BRASIL_API_TEMPO_ABERTO.
+BRASIL_API_URL = "https://brasilapi.com.br/api"
+BRASIL_API_TIMEOUT = (3.05, 5)
+BRASIL_API_TENTATIVAS = 2
+BRASIL_API_LIMITE_FALHAS = 5
+BRASIL_API_TEMPO_ABERTO = timedelta(seconds=30)
+
+# Por quanto tempo o calendário de feriados de um ano obtido na BrasilAPI é
+# considerado válido antes de ser buscado novamente.
+FERIADOS_TTL = timedelta(days=30)
+
+# Cache das consultas de CEP na BrasilAPI. CEPs inválidos ficam em cache por
+# menos tempo, para que um CEP recém-criado seja reconhecido logo.
+CEP_CACHE_TAMANHO = 10000
+CEP_CACHE_TTL = timedelta(days=7)
+CEP_CACHE_TTL_INVALIDO = timedelta(hours=1)
+
+# Cache compartilhado entre os processos (workers do gunicorn). A invalidação
+# dos horários disponíveis, ChamadaUnica e as Idempotency-Keys dependem de
+# todos os processos verem o mesmo cache; com um cache local por processo, um
+# agendamento feito em um worker não descartaria os horários guardados nos
+# outros. Em produção, com REDIS_URL (o add-on Heroku Redis a define), o cache
+# fica no Redis. Sem ele, fica no próprio banco, em uma tabela criada com
+# `python manage.py createcachetable` (no release, ver Procfile); cada set
+# nesse backend custa algumas consultas e ele se esvazia ao passar de
+# MAX_ENTRIES, então /api/horarios/ guarda uma entrada por período consultado,
+# não por dia.
+CACHE_BANCO = {
+    "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+    "LOCATION": "agenda_cache",
+    "OPTIONS": {"MAX_ENTRIES": 50000},
+}
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {"default": CACHE_BANCO}
+
+# Por quanto tempo a versão das tabelas de catálogo (ETag das listagens de
+# serviços, estabelecimentos e endereços) fica no cache. Alterações limpam o
+# cache na hora; o TTL só limita alterações feitas sem passar pelos sinais.
+CATALOGO_VERSAO_CACHE_TTL = timedelta(seconds=30)
+
+# Cache dos horários disponíveis de cada período consultado em /api/horarios/.
+# Alterações nos agendamentos descartam os períodos do prestador na hora, em
+# todos os processos (ver CACHES); o TTL limita quanto tempo um feriado novo
+# leva para aparecer.
+# HORARIOS_MAX_AGE é o Cache-Control enviado aos clientes, que não recebem
+# a invalidação e por isso guardam a resposta por pouco tempo.
+HORARIOS_CACHE_TTL = timedelta(minutes=10)
+HORARIOS_MAX_AGE = timedelta(seconds=15)
+
+# Por quanto tempo as regras de horário de funcionamento compiladas ficam em
+# memória. Alterações nas regras descartam a versão delas no cache
+# compartilhado; cada processo relê a versão no máximo uma vez por
+# EXPEDIENTE_VERSAO_INTERVALO e recompila as regras se ela mudou.
+EXPEDIENTE_CACHE_TTL = timedelta(minutes=5)
+EXPEDIENTE_VERSAO_INTERVALO = timedelta(seconds=1)
+
+# Por quanto tempo a resposta de um POST /api/agendamentos/ com
+# Idempotency-Key é devolvida às repetições com a mesma chave. Respostas mais
+# antigas são ignoradas e apagadas pelo comando limpa_idempotencia.
+IDEMPOTENCIA_TTL = timedelta(hours=24)
+
 LOGGING = {  # DictConfig schema: https://docs.python.org/3/library/logging.config.html#configuration-dictionary-schema
     "version": 1,  # Versão do schema atual
     "disable_existing_loggers": False,  # Django possui alguns loggers por padrão (request, ORM, etc.)
@@ -1,3 +1,12 @@
 from tamarcado.settings.dev import *
 
 TESTING = True
+
+# Os testes rodam em um processo só; o cache em memória não conta consultas
+# ao banco nos assertNumQueries. O cache no banco, usado em produção sem
+# REDIS_URL, fica em "banco" para os testes que contam as consultas dele; a
+# tabela é criada junto com o banco de testes.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "banco": CACHE_BANCO,
+}